@@ -1,29 +1,115 @@
+from django import forms
 from django.contrib import admin
-from .models import Album, MediaFile
+from django.db.models import Count, Exists, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from .models import Album, AlbumArchivo, MediaFile
 from django.utils.html import format_html
+from .albums import crea_ciclo, enlaces_bajo, ruta_de_album
+from .presets import sign_url
+
+
+def _conteo(queryset, campo):
+    """Subconsulta COUNT(*) correlacionada por `campo` (sin multiplicar filas como dos JOIN + COUNT DISTINCT)."""
+    filas = queryset.filter(**{campo: OuterRef('pk')}).order_by().values(campo).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(filas, output_field=IntegerField()), 0)
+
+
+class AlbumListFilter(admin.SimpleListFilter):
+    """
+    Filtro por álbum (incluye sus subálbumes, vía la ruta materializada) que no
+    enumera todos los álbumes: ofrece solo los de primer nivel más recientes
+    y el seleccionado. Cualquier otro se filtra con ?album=<id>.
+    """
+    title = "álbum"
+    parameter_name = 'album'
+    max_opciones = 30
+
+    def lookups(self, request, model_admin):
+        raices = (
+            Album.objects.filter(album_padre__isnull=True)
+            .order_by('-creado_en')
+            .values_list('id', 'nombre')[:self.max_opciones]
+        )
+        opciones = [(str(pk), nombre) for pk, nombre in raices]
+        if self.value() and self.value() not in {pk for pk, _ in opciones}:
+            elegido = Album.objects.filter(pk=self.value()).values_list('nombre', flat=True).first()
+            if elegido:
+                opciones.append((self.value(), elegido))
+        return opciones
+
+    def _album(self):
+        if not (self.value() or '').isdigit():
+            return None
+        return Album.objects.filter(pk=self.value()).only('ruta').first()
+
+    def queryset(self, request, queryset):
+        album = self._album()
+        if album is None:
+            return queryset
+        return self.filtrar(queryset, ruta_de_album(album), album)
+
+    def filtrar(self, queryset, ruta, album):
+        return queryset.filter(Exists(enlaces_bajo(ruta).filter(mediafile_id=OuterRef('pk'))))
+
+
+class AlbumPadreListFilter(AlbumListFilter):
+    """Mismo filtro en la lista de álbumes: el subárbol del álbum elegido."""
+    title = "dentro de"
+    parameter_name = 'dentro_de'
+
+    def filtrar(self, queryset, ruta, album):
+        return queryset.filter(ruta__startswith=ruta).exclude(pk=album.pk)
+
+
+class AlbumAdminForm(forms.ModelForm):
+    class Meta:
+        model = Album
+        fields = '__all__'
+
+    def clean_subalbumes(self):
+        subalbumes = self.cleaned_data.get('subalbumes')
+        if self.instance.pk and subalbumes:
+            for sub in subalbumes:
+                if crea_ciclo(self.instance.pk, sub.pk):
+                    raise forms.ValidationError(f"«{sub}» ya contiene a este álbum: se formaría un ciclo.")
+        return subalbumes
+
 
 @admin.register(Album)
 class AlbumAdmin(admin.ModelAdmin):
+    form = AlbumAdminForm
     list_display = ('nombre', 'creado_en', 'cantidad_archivos', 'cantidad_subalbumes', 'album_padre')
+    list_select_related = ('album_padre',)
     search_fields = ('nombre', 'descripcion')
-    list_filter = ('creado_en', 'album_padre',)
+    list_filter = ('creado_en', AlbumPadreListFilter)
     date_hierarchy = 'creado_en'
+    autocomplete_fields = ('album_padre', 'imagen_preview', 'subalbumes')
     
     class MediaFileInline(admin.TabularInline):
         model = MediaFile.albumes.through
         extra = 1
+        autocomplete_fields = ('mediafile',)
         verbose_name = "Archivo"
         verbose_name_plural = "Archivos"
 
     inlines = [MediaFileInline]
 
+    def get_queryset(self, request):
+        # Contadores en la misma consulta del listado: sin dos COUNT por fila
+        return super().get_queryset(request).annotate(
+            _cantidad_archivos=_conteo(AlbumArchivo.objects, 'album'),
+            _cantidad_subalbumes=_conteo(Album.objects, 'album_padre'),
+        )
+
     def cantidad_archivos(self, obj):
-        return obj.archivos.count()
+        return obj._cantidad_archivos
     cantidad_archivos.short_description = "Archivos"
+    cantidad_archivos.admin_order_field = '_cantidad_archivos'
 
     def cantidad_subalbumes(self, obj):
-        return obj.subalbumes_directos.count()
+        return obj._cantidad_subalbumes
     cantidad_subalbumes.short_description = "Subálbumes"
+    cantidad_subalbumes.admin_order_field = '_cantidad_subalbumes'
 
     def preview_list(self, obj):
         if obj.preview_url:
@@ -38,11 +124,27 @@ class AlbumAdmin(admin.ModelAdmin):
 @admin.register(MediaFile)
 class MediaFileAdmin(admin.ModelAdmin):
     # Mostramos el tamaño formateado y el tipo
-    readonly_fields = ('tipo', 'tamano_legible', 'preview_detail', 'file_id')
+    readonly_fields = ('tipo', 'tamano_legible', 'ahorro_optimizacion', 'preview_detail', 'file_id')
     list_display = ('nombre_archivo', 'tipo', 'tamano_legible', 'creado_en', 'display_albums', 'preview_list')
-    list_filter = ('tipo', 'albumes')
+    list_filter = ('tipo', AlbumListFilter)
     search_fields = ('nombre', 'file_id')
-    filter_horizontal = ('albumes',)
+
+    # albumes usa una tabla intermedia propia (AlbumArchivo): se edita como inline
+    # con autocompletado, sin cargar todos los álbumes en la página
+    class AlbumesInline(admin.TabularInline):
+        model = MediaFile.albumes.through
+        extra = 1
+        autocomplete_fields = ('album',)
+        verbose_name = "Álbum"
+        verbose_name_plural = "Álbumes"
+
+    inlines = [AlbumesInline]
+
+    def get_queryset(self, request):
+        # Álbumes de todas las filas de la página en una sola consulta extra
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('albumes', queryset=Album.objects.only('id', 'nombre').order_by('nombre'))
+        )
 
     def nombre_archivo(self, obj):
         return obj.nombre or "Sin Título"
@@ -60,6 +162,15 @@ class MediaFileAdmin(admin.ModelAdmin):
         return f"{size:.2f} {power_labels[n]}B"
     tamano_legible.short_description = "Tamaño"
 
+    def ahorro_optimizacion(self, obj):
+        if not obj.tamano_original:
+            return "-"
+        ahorro = obj.tamano_original - obj.tamano
+        porcentaje = (ahorro / obj.tamano_original) * 100
+        cpu = f", {obj.optimizacion_cpu_ms} ms CPU" if obj.optimizacion_cpu_ms is not None else ""
+        return f"{ahorro / 1024:.1f} KB ({porcentaje:.1f}%){cpu}"
+    ahorro_optimizacion.short_description = "Ahorro por optimización"
+
     def display_albums(self, obj):
         return ", ".join(a.nombre for a in obj.albumes.all())
     display_albums.short_description = "Álbumes"
@@ -76,8 +187,8 @@ class MediaFileAdmin(admin.ModelAdmin):
                 url
             )
         else:
-            # Pedimos una versión mediana para la vista de detalle del admin
-            thumb_url = f"{url}?tr=w-300,h-300,fo-auto"
+            # Versión mediana para la vista de detalle del admin (preset del registro)
+            thumb_url = sign_url(obj.url_preset('admin-detail'))
             return format_html(
                 '<img src="{}" style="max-width: 300px; max-height: 300px;" />', 
                 thumb_url
@@ -88,8 +199,8 @@ class MediaFileAdmin(admin.ModelAdmin):
         if not obj.archivo:
             return "❌"
         
-        # Pedimos miniatura muy pequeña (50px) para la tabla
-        thumb_url = f"{obj.archivo.url}?tr=w-50,h-50,fo-auto"
+        # Miniatura muy pequeña (50px) para la tabla (preset del registro)
+        thumb_url = sign_url(obj.url_preset('admin-list'))
         
         if obj.is_video():
             # ImageKit no genera posters de video automáticamente en la URL estándar sin configuración extra,
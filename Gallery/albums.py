@@ -0,0 +1,258 @@
+from django.core.exceptions import ValidationError
+from django.db.models import BigIntegerField, Case, Count, Exists, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Concat, Substr
+
+from .models import Album, AlbumArchivo, MediaFile
+from .pagination import PAGE_SIZE, KeysetPage, decode_cursor, newer_than, older_than
+
+# Ruta materializada de cada álbum por album_padre: "/<raíz>/.../<id>/".
+# Los descendientes de un álbum son los que empiezan por su ruta (LIKE 'ruta%' sobre
+# un índice), así que subárbol, migas de pan y totales recursivos salen en una consulta.
+SEP = '/'
+
+
+def ruta_de(pk, ruta_padre=''):
+    return f"{ruta_padre or SEP}{pk}{SEP}"
+
+
+def ids_de_ruta(ruta):
+    return [int(part) for part in ruta.strip(SEP).split(SEP) if part]
+
+
+def _ruta_guardada(pk):
+    """Ruta de un álbum en la BD; si aún no tiene (datos sin rellenar) se calcula subiendo por album_padre."""
+    cadena = []
+    vistos = set()
+    while pk is not None and pk not in vistos:
+        vistos.add(pk)
+        ruta, padre_id = Album.objects.filter(pk=pk).values_list('ruta', 'album_padre_id').get()
+        if ruta:
+            break
+        cadena.append(pk)
+        pk = padre_id
+    else:
+        ruta = ''
+    for pk in reversed(cadena):
+        ruta = ruta_de(pk, ruta)
+    return ruta
+
+
+def crea_ciclo(padre_id, hijo_id):
+    """
+    ¿Colgar `hijo` de `padre` (por album_padre o por subalbumes) cerraría un ciclo?
+    Lo hace si `padre` ya es alcanzable desde `hijo` siguiendo ambas relaciones.
+    """
+    if padre_id == hijo_id:
+        return True
+    # Camino rápido: el padre está en el subárbol del hijo según la ruta materializada
+    ruta_padre = Album.objects.filter(pk=padre_id).values_list('ruta', flat=True).first() or ''
+    if f"{SEP}{hijo_id}{SEP}" in ruta_padre:
+        return True
+
+    # Recorrido por niveles (una consulta por nivel y relación) para los enlaces de subalbumes
+    enlaces = Album.subalbumes.through.objects
+    visitados = {hijo_id}
+    frontera = {hijo_id}
+    while frontera:
+        siguientes = set(Album.objects.filter(album_padre_id__in=frontera).values_list('id', flat=True))
+        siguientes.update(enlaces.filter(from_album_id__in=frontera).values_list('to_album_id', flat=True))
+        if padre_id in siguientes:
+            return True
+        frontera = siguientes - visitados
+        visitados |= frontera
+    return False
+
+
+def validar_padre(album):
+    """ValidationError si el album_padre de `album` lo convertiría en su propio ancestro."""
+    if album.pk and album.album_padre_id and crea_ciclo(album.album_padre_id, album.pk):
+        raise ValidationError({'album_padre': "Un álbum no puede colgar de sí mismo ni de uno de sus subálbumes."})
+
+
+def preparar_ruta(album):
+    """
+    Antes de guardar: comprueba ciclos y calcula la ruta nueva.
+    Devuelve la ruta anterior si el álbum se está moviendo (para reescribir su subárbol).
+    """
+    anterior = None
+    if album.pk:
+        fila = Album.objects.filter(pk=album.pk).values_list('ruta', 'album_padre_id').first()
+        if fila:
+            anterior, padre_anterior = fila
+            if album.album_padre_id != padre_anterior:
+                validar_padre(album)
+            ruta_padre = _ruta_guardada(album.album_padre_id) if album.album_padre_id else ''
+            album.ruta = ruta_de(album.pk, ruta_padre)
+            album.profundidad = album.ruta.count(SEP) - 2
+    return anterior if anterior and anterior != album.ruta else None
+
+
+def completar_ruta(album, anterior=None):
+    """Después de guardar: fija la ruta de un álbum nuevo o mueve el subárbol en un único UPDATE."""
+    if not album.ruta:
+        ruta_padre = _ruta_guardada(album.album_padre_id) if album.album_padre_id else ''
+        album.ruta = ruta_de(album.pk, ruta_padre)
+        album.profundidad = album.ruta.count(SEP) - 2
+        Album.objects.filter(pk=album.pk).update(ruta=album.ruta, profundidad=album.profundidad)
+    if anterior:
+        salto = album.ruta.count(SEP) - anterior.count(SEP)
+        (
+            Album.objects.filter(ruta__startswith=anterior).exclude(pk=album.pk)
+            .update(
+                ruta=Concat(Value(album.ruta), Substr('ruta', len(anterior) + 1)),
+                profundidad=F('profundidad') + salto,
+            )
+        )
+
+
+def rebuild_album_paths(batch_size=1000):
+    """
+    Recalcula todas las rutas desde album_padre (una lectura y bulk_update por lotes).
+    Un ciclo heredado se corta convirtiendo en raíz al álbum donde se detecta.
+    Devuelve (álbumes actualizados, ciclos cortados).
+    """
+    filas = {pk: (padre_id, ruta) for pk, padre_id, ruta in Album.objects.values_list('id', 'album_padre_id', 'ruta')}
+    rutas = {}
+    ciclos = 0
+
+    for pk in filas:
+        cadena = []
+        en_cadena = set()
+        actual = pk
+        while actual is not None and actual not in rutas:
+            if actual in en_cadena or actual not in filas:
+                ciclos += actual in en_cadena
+                break
+            cadena.append(actual)
+            en_cadena.add(actual)
+            actual = filas[actual][0]
+        ruta_padre = rutas.get(actual, '')
+        for nodo in reversed(cadena):
+            ruta_padre = rutas[nodo] = ruta_de(nodo, ruta_padre)
+
+    cambios = [
+        Album(pk=pk, ruta=ruta, profundidad=ruta.count(SEP) - 2)
+        for pk, ruta in rutas.items() if filas[pk][1] != ruta
+    ]
+    Album.objects.bulk_update(cambios, ['ruta', 'profundidad'], batch_size=batch_size)
+    return len(cambios), ciclos
+
+
+def asegurar_rutas():
+    """
+    Rellena las rutas que falten (álbumes anteriores al árbol o creados con bulk_create)
+    antes de consultar por prefijo: con ruta vacía, `ruta LIKE '%'` abarcaría toda la
+    biblioteca. Si ya están todas, cuesta un EXISTS sobre el índice de ruta.
+    """
+    if Album.objects.filter(ruta='').exists():
+        rebuild_album_paths()
+
+
+def ruta_de_album(album):
+    """Ruta del álbum, rellenando las pendientes. ValueError si aun así no tiene (álbum sin guardar)."""
+    asegurar_rutas()
+    if not album.ruta and album.pk:
+        album.ruta, album.profundidad = (
+            Album.objects.filter(pk=album.pk).values_list('ruta', 'profundidad').first() or ('', 0)
+        )
+    if not album.ruta:
+        raise ValueError(f"El álbum {album.pk} no tiene ruta en el árbol")
+    return album.ruta
+
+
+# --- Consultas sobre el árbol ---
+
+def descendientes(album, incluir_propio=False):
+    queryset = Album.objects.filter(ruta__startswith=ruta_de_album(album))
+    return queryset if incluir_propio else queryset.exclude(pk=album.pk)
+
+
+def ancestros(album):
+    """Ancestros de la raíz al padre, en una consulta."""
+    ids = ids_de_ruta(ruta_de_album(album))[:-1]
+    encontrados = Album.objects.in_bulk(ids)
+    return [encontrados[pk] for pk in ids if pk in encontrados]
+
+
+def enlaces_bajo(ruta):
+    """Enlaces archivo-álbum del subárbol con esa ruta (nunca con una ruta vacía)."""
+    if not ruta:
+        raise ValueError("Ruta de álbum vacía")
+    return AlbumArchivo.objects.filter(album__ruta__startswith=ruta)
+
+
+def _archivos_bajo(ruta):
+    if isinstance(ruta, str):
+        enlaces = enlaces_bajo(ruta)
+    else:
+        enlaces = AlbumArchivo.objects.filter(album__ruta__startswith=ruta)
+    return MediaFile.objects.filter(Exists(enlaces.filter(mediafile_id=OuterRef('pk'))))
+
+
+def totales_recursivos(album):
+    """{'archivos', 'bytes'} del álbum y todo su subárbol; un archivo en varios subálbumes cuenta una vez."""
+    totales = _archivos_bajo(ruta_de_album(album)).aggregate(archivos=Count('pk'), bytes=Sum('tamano'))
+    return {'archivos': totales['archivos'], 'bytes': totales['bytes'] or 0}
+
+
+def con_totales_recursivos(queryset):
+    """Anota total_archivos y total_bytes (subárbol incluido) en cada álbum, en la misma consulta."""
+    asegurar_rutas()
+    base = _archivos_bajo(OuterRef(OuterRef('ruta'))).order_by().annotate(grupo=Value(1)).values('grupo')
+    # Una fila que llegue sin ruta (carrera con un bulk_create) da 0, no el total de la biblioteca
+    sin_ruta = When(ruta='', then=Value(0))
+    return queryset.annotate(
+        total_archivos=Case(sin_ruta, default=Coalesce(
+            Subquery(base.annotate(n=Count('pk')).values('n'), output_field=BigIntegerField()), 0
+        ), output_field=BigIntegerField()),
+        total_bytes=Case(sin_ruta, default=Coalesce(
+            Subquery(base.annotate(b=Sum('tamano')).values('b'), output_field=BigIntegerField()), 0
+        ), output_field=BigIntegerField()),
+    )
+
+
+# --- Cuadrícula de un álbum (cursor sobre la tabla intermedia) ---
+
+def _archivos_en_orden(ids):
+    encontrados = MediaFile.objects.in_bulk(ids)
+    return [encontrados[pk] for pk in ids if pk in encontrados]
+
+
+def album_page(album, after=None, before=None, per_page=PAGE_SIZE):
+    """
+    Igual que paginate_keyset pero recorriendo AlbumArchivo por su índice
+    (album, -creado_en, -mediafile): los ids de la página salen del índice y los
+    archivos en una segunda consulta por PK. Los cursores son los de la línea de tiempo.
+    """
+    enlaces = AlbumArchivo.objects.filter(album=album)
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+
+    if before_key:
+        ids = list(
+            enlaces.filter(newer_than(*before_key, pk_field='mediafile_id'))
+            .order_by('creado_en', 'mediafile_id')
+            .values_list('mediafile_id', flat=True)[:per_page + 1]
+        )
+        if ids:
+            has_previous = len(ids) > per_page
+            ids = ids[:per_page]
+            ids.reverse()
+            return KeysetPage(_archivos_en_orden(ids), has_next=True, has_previous=has_previous)
+
+    if after_key:
+        enlaces = enlaces.filter(older_than(*after_key, pk_field='mediafile_id'))
+
+    ids = list(
+        enlaces.order_by('-creado_en', '-mediafile_id')
+        .values_list('mediafile_id', flat=True)[:per_page + 1]
+    )
+    has_next = len(ids) > per_page
+    return KeysetPage(_archivos_en_orden(ids[:per_page]), has_next=has_next, has_previous=bool(after_key))
+
+
+def rellenar_fechas_enlaces(queryset=None):
+    """Copia MediaFile.creado_en en los enlaces que no la tienen (un UPDATE). Devuelve las filas tocadas."""
+    enlaces = AlbumArchivo.objects.all() if queryset is None else queryset
+    fecha = MediaFile.objects.filter(pk=OuterRef('mediafile_id')).values('creado_en')[:1]
+    return enlaces.filter(creado_en__isnull=True).update(creado_en=Subquery(fecha))
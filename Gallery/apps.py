@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GalleryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Gallery'
+
+    def ready(self):
+        # Contadores de almacenamiento (StorageStats) mantenidos por señales
+        from . import signals  # noqa: F401
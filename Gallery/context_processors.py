@@ -0,0 +1,9 @@
+from .generation import current_generation, fragment_timeout
+
+
+def library(request):
+    """Generación de la biblioteca para las claves de los fragmentos {% cache %}."""
+    return {
+        'library_generation': current_generation()[0],
+        'fragment_timeout': fragment_timeout(),
+    }
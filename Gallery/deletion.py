@@ -0,0 +1,73 @@
+from django.db import transaction
+
+from .albums import enlaces_bajo, ruta_de_album
+from .generation import bump_generation
+from .ik_api import delete_files
+from .models import AlbumArchivo, MediaFile
+from .search import apply_search, remove_ids
+from .stats import apply_delta, delta_from_queryset, signals_suspended
+from .timeline import invalidate_timeline
+
+
+def select_ids(ids=None, album=None, subalbumes=False, consulta=None):
+    """
+    Ids de MediaFile a partir de una selección: lista de ids, un álbum (con o sin
+    su subárbol) o el resultado de una búsqueda del buscador de la galería.
+    """
+    if ids is not None:
+        return list(dict.fromkeys(int(pk) for pk in ids))
+    if album is not None:
+        # ruta_de_album rellena las rutas pendientes: nunca un prefijo vacío (toda la biblioteca)
+        enlaces = enlaces_bajo(ruta_de_album(album)) if subalbumes \
+            else AlbumArchivo.objects.filter(album=album)
+        return list(enlaces.values_list('mediafile_id', flat=True).distinct())
+    if consulta:
+        # Todas las coincidencias, sin el tope MAX_MATCHES de la línea de tiempo
+        return list(apply_search(MediaFile.objects.all(), consulta, limit=None)[0].values_list('id', flat=True))
+    return []
+
+
+def delete_media(ids, concurrency=None):
+    """
+    Borra archivos de la nube y de la BD.
+    - Nube: borrado por lotes de ImageKit, varios lotes en paralelo (ik_api.delete_files).
+      Un asset que sigue usando otro registro (deduplicado) no se borra de la nube.
+    - BD: un único QuerySet.delete() con los que se borraron en la nube (o no tenían asset).
+      Misma regla que eliminar_archivo: si la nube falla, el registro local se queda.
+    Devuelve [{'id', 'ok', 'error'?}] en el orden de `ids`.
+    """
+    ids = list(dict.fromkeys(ids))
+    rows = dict(MediaFile.objects.filter(id__in=ids).values_list('id', 'file_id'))
+    file_ids = {file_id for file_id in rows.values() if file_id}
+    compartidos = set(
+        MediaFile.objects.filter(file_id__in=file_ids).exclude(id__in=list(rows))
+        .values_list('file_id', flat=True)
+    )
+    errores_nube = delete_files(file_ids - compartidos, concurrency=concurrency)
+
+    errores = {}
+    borrables = []
+    for pk in ids:
+        if pk not in rows:
+            errores[pk] = "No encontrado"
+        elif errores_nube.get(rows[pk]):
+            errores[pk] = f"No se pudo borrar de la nube: {errores_nube[rows[pk]]}"
+        else:
+            borrables.append(pk)
+
+    if borrables:
+        # Sin señales por fila: contadores, índice de búsqueda y cachés se ajustan una vez
+        queryset = MediaFile.objects.filter(id__in=borrables)
+        with transaction.atomic():
+            delta = delta_from_queryset(queryset, sign=-1, shared_file_ids=compartidos)
+            with signals_suspended():
+                queryset.delete()
+            apply_delta(delta)
+        remove_ids(borrables)
+        invalidate_timeline()
+        bump_generation()
+
+    return [
+        {'id': pk, 'ok': False, 'error': errores[pk]} if pk in errores else {'id': pk, 'ok': True}
+        for pk in ids
+    ]
@@ -0,0 +1,128 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import StorageStats
+from .stats import rebuild_storage_stats
+
+CACHE_KEY = 'gallery:generation'
+
+
+def _cache_seconds():
+    # Cuánto puede tardar otro proceso en ver una generación nueva (la caché
+    # locmem es por proceso; con Redis el borrado en bump_generation es global).
+    return getattr(settings, 'GALLERY_GENERATION_CACHE_SECONDS', 2)
+
+
+def current_generation():
+    """(generación, modificado_en) de la biblioteca: caché -> fila StorageStats."""
+    data = cache.get(CACHE_KEY)
+    if data is None:
+        row = StorageStats.objects.filter(clave='global').values('generacion', 'modificado_en').first()
+        data = (row['generacion'], row['modificado_en']) if row else (0, None)
+        cache.set(CACHE_KEY, data, _cache_seconds())
+    return data
+
+
+def bump_generation():
+    """Marca la biblioteca como modificada (UPDATE atómico con F())."""
+    now = timezone.now()
+    updated = StorageStats.objects.filter(clave='global').update(
+        generacion=F('generacion') + 1, modificado_en=now
+    )
+    if not updated:
+        # Sin fila todavía: se crea con los contadores reales (una fila a cero ocultaría
+        # la reconstrucción de stats.get_storage_stats) y se marca la generación
+        rebuild_storage_stats()
+        StorageStats.objects.filter(clave='global').update(generacion=F('generacion') + 1, modificado_en=now)
+    cache.delete(CACHE_KEY)
+
+
+# --- Peticiones condicionales (ETag / Last-Modified -> 304) ---
+
+def _pending_messages(request):
+    # len() no marca los mensajes como leídos
+    return len(get_messages(request))
+
+
+def _etag(request, *args, **kwargs):
+    if _pending_messages(request):
+        return None  # la página incluye mensajes flash: no es reutilizable
+    generation, _ = current_generation()
+    raw = '|'.join([
+        str(generation),
+        request.get_full_path(),
+        str(request.user.pk or 0),
+        request.META.get('CSRF_COOKIE', ''),
+    ])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _last_modified(request, *args, **kwargs):
+    if _pending_messages(request):
+        return None
+    return current_generation()[1]
+
+
+def library_conditional(view):
+    """
+    Responde 304 a los GET condicionales mientras la biblioteca no cambie.
+    El ETag combina la generación, la URL, el usuario y la cookie CSRF (la página
+    lleva el token). Cache-Control private + no-cache: el navegador guarda la página
+    pero revalida siempre, así que un cambio se ve en la siguiente visita.
+    """
+    conditional = condition(etag_func=_etag, last_modified_func=_last_modified)(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = conditional(request, *args, **kwargs)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return wrapper
+
+
+# --- Caché de respuestas JSON (no dependen del usuario) ---
+
+def cached_json_view(view):
+    """
+    Cachea el cuerpo de una vista JSON por (generación, URL completa) y además
+    responde 304 por ETag. Una escritura en la biblioteca cambia la generación y,
+    con ella, todas las claves.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        generation, _ = current_generation()
+        digest = hashlib.sha1(request.get_full_path().encode('utf-8')).hexdigest()
+        key = f'gallery:json:{generation}:{digest}'
+        etag = f'"{generation}-{digest[:16]}"'
+
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=304)
+        else:
+            body = cache.get(key)
+            if body is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                body = response.content
+                cache.set(key, body, getattr(settings, 'GALLERY_PAGE_CACHE_TIMEOUT', 300))
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return wrapper
+
+
+def fragment_timeout():
+    """TTL de los fragmentos {% cache %}; la clave ya incluye la generación."""
+    return getattr(settings, 'GALLERY_PAGE_CACHE_TIMEOUT', 300)
@@ -0,0 +1,132 @@
+import threading
+import time
+from datetime import datetime
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .ik_api import api_url, get_session
+
+STATUS_KEY = 'gallery:health:status'
+SAMPLES_KEY = 'gallery:health:samples'
+LOCK_KEY = 'gallery:health:lock'
+
+OK = 'ok'
+DEGRADADO = 'degradado'
+CAIDO = 'caido'
+DESCONOCIDO = 'desconocido'
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _interval():
+    return _setting('GALLERY_HEALTH_INTERVAL', 60)
+
+
+def probe():
+    """Una comprobación: GET files?limit=1. Devuelve (ok, latencia_ms, error)."""
+    started = time.perf_counter()
+    try:
+        response = get_session().get(
+            api_url('files'), params={'limit': 1}, timeout=_setting('GALLERY_HEALTH_TIMEOUT', 5)
+        )
+        latency = (time.perf_counter() - started) * 1000
+        if response.status_code == 200:
+            return True, latency, ''
+        return False, latency, f"HTTP {response.status_code}"
+    except requests.exceptions.RequestException as e:
+        return False, (time.perf_counter() - started) * 1000, str(e)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 1)
+
+
+def summarize(samples, last):
+    """Estado a partir de la ventana de muestras [(timestamp, latencia_ms, ok)] y la última comprobación."""
+    latencias = [latency for _, latency, ok in samples if ok]
+    errores = sum(1 for _, _, ok in samples if not ok)
+    error_rate = errores / len(samples) if samples else 0.0
+    ok, latency, error = last
+
+    if not ok:
+        status = CAIDO
+    elif latency > _setting('GALLERY_HEALTH_SLOW_MS', 2000) or error_rate > _setting('GALLERY_HEALTH_MAX_ERROR_RATE', 0.2):
+        status = DEGRADADO
+    else:
+        status = OK
+
+    return {
+        'status': status,
+        'checked_at': timezone.now().isoformat(),
+        'latency_ms': round(latency, 1),
+        'error': error,
+        'p50_ms': _percentile(latencias, 0.50),
+        'p95_ms': _percentile(latencias, 0.95),
+        'p99_ms': _percentile(latencias, 0.99),
+        'error_rate': round(error_rate, 3),
+        'samples': len(samples),
+    }
+
+
+def run_probe():
+    """Comprueba la API, añade la muestra a la ventana y publica el estado en la caché."""
+    last = probe()
+    window = _setting('GALLERY_HEALTH_WINDOW', 120)
+    samples = (cache.get(SAMPLES_KEY) or []) + [(time.time(), last[1], last[0])]
+    samples = samples[-window:]
+    # Las muestras y el estado sobreviven varios intervalos: si el sondeo se para, se nota por checked_at
+    ttl = _interval() * window
+    cache.set(SAMPLES_KEY, samples, ttl)
+    status = summarize(samples, last)
+    cache.set(STATUS_KEY, status, ttl)
+    return status
+
+
+def _loop():
+    while True:
+        # Con una caché compartida (Redis) solo un proceso sondea por intervalo
+        if cache.add(LOCK_KEY, 1, max(1, _interval() - 1)):
+            try:
+                run_probe()
+            except Exception as e:
+                print(f"Error en el sondeo de ImageKit: {e}")
+        time.sleep(_interval())
+
+
+def ensure_probe_thread():
+    """Arranca (una vez por proceso) el hilo que sondea ImageKit en segundo plano."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_loop, daemon=True, name='imagekit-health')
+            _thread.start()
+
+
+def get_health():
+    """
+    Último estado conocido de ImageKit, leído de la caché (nunca hace la petición).
+    Si no hay datos o el sondeo lleva más de 3 intervalos sin actualizarse: 'desconocido'.
+    """
+    ensure_probe_thread()
+    status = cache.get(STATUS_KEY)
+    if not status:
+        return {'status': DESCONOCIDO, 'checked_at': None}
+    checked_at = datetime.fromisoformat(status['checked_at'])
+    age = (timezone.now() - checked_at).total_seconds()
+    status = {**status, 'age_seconds': round(age)}
+    if age > 3 * _interval():
+        status['status'] = DESCONOCIDO
+    return status
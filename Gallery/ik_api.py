@@ -0,0 +1,329 @@
+import json
+import mimetypes
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+API_BASE = "https://api.imagekit.io/v1"
+UPLOAD_URL = "https://upload.imagekit.io/api/v1/files/upload"
+
+# Tamaño de cada trozo leído del archivo subido al hacer streaming
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Conexiones keep-alive por host y páginas pedidas en paralelo
+POOL_SIZE = 10
+DEFAULT_CONCURRENCY = 4
+
+# Máximo de fileIds por llamada al borrado por lotes de ImageKit
+BULK_DELETE_LIMIT = 100
+
+_session = None
+_cdn_session = None
+_session_lock = threading.Lock()
+
+
+def _build_session(auth=True):
+    session = requests.Session()
+
+    # ImageKit usa Basic Auth: Usuario=PrivateKey, Password=""
+    if auth:
+        session.auth = HTTPBasicAuth(settings.IMAGEKIT_PRIVATE_KEY or '', '')
+
+    # Reintentos con backoff exponencial ante rate limit (429) y errores 5xx.
+    # Respeta la cabecera Retry-After que manda ImageKit al limitar.
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'DELETE']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    pool_size = getattr(settings, 'IMAGEKIT_API_POOL_SIZE', POOL_SIZE)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Sesión HTTP compartida por el proceso (reutiliza conexiones TCP+TLS)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_cdn_session():
+    """
+    Sesión compartida para descargar de la CDN (url_endpoint). Sin credenciales: la
+    clave privada solo viaja a la API, nunca a las URLs públicas de los assets.
+    """
+    global _cdn_session
+    if _cdn_session is None:
+        with _session_lock:
+            if _cdn_session is None:
+                _cdn_session = _build_session(auth=False)
+    return _cdn_session
+
+
+def api_url(path):
+    base = getattr(settings, 'IMAGEKIT_API_BASE', API_BASE).rstrip('/')
+    return f"{base}/{path.lstrip('/')}"
+
+
+# --- HELPERS ROBUSTOS (API DIRECTA) ---
+def safe_list_files(options):
+    """
+    Lista archivos conectando directamente a la API de ImageKit.
+    Documentación: https://imagekit.io/docs/api-reference
+    """
+    try:
+        response = get_session().get(api_url('files'), params=options, timeout=10)
+        response.raise_for_status() # Lanza error si hay 400/500
+        return response.json()      # Devuelve la lista de archivos
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Error de conexión con ImageKit: {e}")
+
+
+def safe_delete_file(file_id):
+    """
+    Borra un archivo usando la API directa.
+    """
+    try:
+        response = get_session().delete(api_url(f'files/{file_id}'), timeout=10)
+        response.raise_for_status()
+        return True
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Error borrando en ImageKit: {e}")
+
+
+def get_file_details(file_id):
+    """Metadatos de un asset (GET files/{id}/details). None si ya no existe en la nube."""
+    try:
+        response = get_session().get(api_url(f'files/{file_id}/details'), timeout=10)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise Exception(f"Error de conexión con ImageKit: {e}")
+
+
+def find_file(path):
+    """
+    Busca un asset por su ruta ("carpeta/nombre.jpg" o solo "nombre.jpg").
+    El listado filtra por nombre dentro de la carpeta; la ruta exacta se compara aquí.
+    Devuelve sus metadatos o None.
+    """
+    path = path.lstrip('/')
+    folder, _, name = path.rpartition('/')
+    options = {
+        'path': f'/{folder}' if folder else '/',
+        'searchQuery': f'name = "{name}"',
+        'type': 'file',
+        'limit': 100,
+    }
+    matches = safe_list_files(options)
+    for file_data in matches:
+        if (file_data.get('filePath') or '').lstrip('/') == path:
+            return file_data
+    # Archivos sincronizados guardan solo el nombre (sin carpeta)
+    if not folder:
+        for file_data in matches:
+            if file_data.get('name') == name:
+                return file_data
+    return None
+
+
+def bulk_delete_files(file_ids):
+    """
+    Borrado por lotes (POST files/batch/deleteByFileIds, hasta BULK_DELETE_LIMIT ids).
+    Devuelve (borrados, inexistentes). Si falta alguno, la API responde 404 con
+    `missingFileIds` y no borra el resto: quien llama reintenta sin ellos.
+    """
+    try:
+        response = get_session().post(
+            api_url('files/batch/deleteByFileIds'), json={'fileIds': list(file_ids)}, timeout=30
+        )
+        if response.status_code == 404:
+            missing = response.json().get('missingFileIds') or []
+            if missing:
+                return [], missing
+        response.raise_for_status()
+        return response.json().get('successfullyDeletedFileIds', []), []
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise Exception(f"Error borrando en ImageKit: {e}")
+
+
+def _delete_chunk(chunk):
+    results = {}
+    pending = list(chunk)
+    try:
+        for _ in range(3):
+            deleted, missing = bulk_delete_files(pending)
+            # Lo que ya no está en la nube cuenta como borrado
+            results.update({file_id: None for file_id in missing})
+            results.update({file_id: None for file_id in deleted})
+            pending = [file_id for file_id in pending if file_id not in results]
+            if not missing or not pending:
+                break
+        for file_id in pending:
+            results[file_id] = "ImageKit no confirmó el borrado"
+    except Exception:
+        # El lote falló entero: uno a uno para saber exactamente qué falla
+        for file_id in pending:
+            try:
+                safe_delete_file(file_id)
+                results[file_id] = None
+            except Exception as e:
+                results[file_id] = str(e)
+    return results
+
+
+def delete_files(file_ids, concurrency=None):
+    """
+    Borra muchos archivos de la nube: lotes de BULK_DELETE_LIMIT por la API batch,
+    hasta `concurrency` lotes a la vez sobre la sesión compartida.
+    Devuelve {file_id: None si se borró | mensaje de error}.
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+    if not file_ids:
+        return {}
+    if concurrency is None:
+        concurrency = getattr(settings, 'IMAGEKIT_API_CONCURRENCY', DEFAULT_CONCURRENCY)
+    chunks = [file_ids[i:i + BULK_DELETE_LIMIT] for i in range(0, len(file_ids), BULK_DELETE_LIMIT)]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks))), thread_name_prefix='ik-delete') as pool:
+        for chunk_results in pool.map(_delete_chunk, chunks):
+            results.update(chunk_results)
+    return results
+
+
+def iter_pages(options, page_size, concurrency=None, list_files=safe_list_files, start=0):
+    """
+    Recorre el listado paginado por `skip` (desde `start`) pidiendo hasta `concurrency`
+    ventanas en paralelo.
+
+    Las páginas se devuelven en orden (necesario para el checkpoint de la sincronización).
+    Se detiene en la primera página vacía o incompleta; las ventanas ya lanzadas más allá
+    del final simplemente se descartan.
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, 'IMAGEKIT_API_CONCURRENCY', DEFAULT_CONCURRENCY)
+    concurrency = max(1, concurrency)
+
+    def fetch(skip):
+        return list_files({**options, "limit": page_size, "skip": skip})
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ik-page') as pool:
+        in_flight = []
+        next_skip = start
+        try:
+            while True:
+                while len(in_flight) < concurrency:
+                    in_flight.append(pool.submit(fetch, next_skip))
+                    next_skip += page_size
+
+                batch = in_flight.pop(0).result()
+                if not batch:
+                    break
+                yield batch
+
+                # Si el lote es menor al límite, ya no hay más archivos
+                if len(batch) < page_size:
+                    break
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+class MultipartStream:
+    """
+    Cuerpo multipart/form-data generado sobre la marcha.
+
+    Los campos de texto se codifican en memoria (son pequeños) y el archivo se emite
+    trozo a trozo desde `content.chunks()`, así que la memoria usada no depende del
+    tamaño del archivo. Como se conoce la longitud exacta, requests envía
+    Content-Length en lugar de Transfer-Encoding: chunked.
+    """
+
+    def __init__(self, fields, file_field, file_name, content, size, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.content = content
+        self.chunk_size = chunk_size
+
+        parts = []
+        for key, value in fields.items():
+            parts.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{key}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        parts.append(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{file_name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        )
+        self.head = ''.join(parts).encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self.size = size
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        if hasattr(self.content, 'seek'):
+            self.content.seek(0)
+        for chunk in self.content.chunks(self.chunk_size):
+            yield chunk
+        yield self.tail
+
+
+def upload_stream(content, file_name, size, use_unique_file_name=True, tags=None):
+    """
+    Sube un archivo a ImageKit por streaming (sin materializar sus bytes en memoria).
+    `content` es un File de Django (UploadedFile, TemporaryUploadedFile...) con tamaño conocido.
+    Devuelve la respuesta JSON de la API (name, fileId, size...).
+    """
+    fields = {
+        'fileName': file_name,
+        'useUniqueFileName': 'true' if use_unique_file_name else 'false',
+    }
+    if tags:
+        fields['tags'] = ','.join(tags)
+
+    body = MultipartStream(fields, 'file', file_name, content, size)
+    upload_url = getattr(settings, 'IMAGEKIT_UPLOAD_URL', UPLOAD_URL)
+    try:
+        # Sin reintentos automáticos: un cuerpo en streaming no se puede reenviar
+        response = get_session().post(
+            upload_url,
+            data=body,
+            headers={'Content-Type': body.content_type},
+            timeout=(10, 300),
+        )
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('message', response.text)
+            except json.JSONDecodeError:
+                message = response.text
+            raise Exception(f"{response.status_code}: {message}")
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Error de conexión con ImageKit: {e}")
@@ -0,0 +1,155 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import SyncJob, SyncState
+from .sync import SyncEngine
+
+
+def _stale_after():
+    """Sin latido durante este tiempo, un job 'ejecutando' se considera interrumpido."""
+    return timedelta(minutes=getattr(settings, 'GALLERY_SYNC_STALE_MINUTES', 5))
+
+
+class JobTakenOver(Exception):
+    """Otro worker retomó el job (se dio por interrumpido): esta ejecución debe parar."""
+
+
+def _owned(job):
+    """Filas del job mientras siga siendo de esta ejecución (cada reanudación cambia `reanudaciones`)."""
+    return SyncJob.objects.filter(pk=job.pk, estado=SyncJob.EJECUTANDO, reanudaciones=job.reanudaciones)
+
+
+def _heartbeat(job, stop, interval):
+    """
+    Latido periódico en un hilo aparte: las esperas largas sin páginas nuevas (reintentos
+    con Retry-After, la confirmación de ausentes antes de borrar) no dejan el job sin latir.
+    """
+    try:
+        while not stop.wait(interval):
+            _owned(job).update(actualizado_en=timezone.now())
+    finally:
+        connection.close()
+
+
+def claim_sync_job(full=False):
+    """
+    Reserva la ejecución de una sincronización. Devuelve (job, debe_ejecutarse).
+
+    - Si ya hay una en curso con latido reciente, la devuelve con debe_ejecutarse=False.
+    - Si la que estaba en curso dejó de latir (worker reiniciado, proceso matado...),
+      se retoma ese mismo job: el motor continúa desde la marca de agua persistida
+      (incremental) o desde el offset de la última página guardada (completo).
+    - Si no hay ninguna, crea un job nuevo.
+
+    El bloqueo de la fila SyncState serializa las reservas concurrentes.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        SyncState.objects.select_for_update().get_or_create(clave='imagekit')
+
+        activo = SyncJob.objects.filter(estado=SyncJob.EJECUTANDO).first()
+        if activo:
+            if activo.actualizado_en > now - _stale_after():
+                return activo, False
+
+            # Retomar el job interrumpido. El listado completo sigue desde su offset y
+            # conserva sus páginas; el incremental empieza de nuevo desde la marca de agua
+            # y las vuelve a contar. Los contadores de escrituras se conservan.
+            activo.reanudaciones += 1
+            if not activo.completo:
+                activo.paginas = 0
+                activo.filas = 0
+                activo.siguiente_skip = 0
+            activo.completo = activo.completo or full
+            activo.iniciado_en = now
+            activo.save()
+            return activo, True
+
+        job = SyncJob.objects.create(completo=full, iniciado_en=now)
+        return job, True
+
+
+def run_sync_job(job, echo=None):
+    """Ejecuta el motor de sincronización actualizando el progreso del job en cada página."""
+    base = {
+        'paginas': job.paginas, 'filas': job.filas,
+        'creados': job.creados, 'enlazados': job.enlazados, 'eliminados': job.eliminados,
+    }
+
+    def on_progress(engine):
+        fields = {
+            'completo': engine.full,
+            'paginas': base['paginas'] + engine.pages,
+            'filas': base['filas'] + engine.rows,
+            # Checkpoint con el latido: hasta aquí las páginas están guardadas
+            'siguiente_skip': engine.next_skip if engine.full else 0,
+            'total_estimado': engine.estimated_total,
+            'creados': base['creados'] + engine.created,
+            'enlazados': base['enlazados'] + engine.linked,
+            'eliminados': base['eliminados'] + engine.deleted,
+            'actualizado_en': timezone.now(),
+        }
+        if not _owned(job).update(**fields):
+            raise JobTakenOver(f"Sync #{job.pk} retomado por otro worker")
+        for name, value in fields.items():
+            setattr(job, name, value)
+        if echo:
+            echo(job)
+
+    # Un tercio del plazo de inactividad: varios latidos antes de que otro lo dé por muerto
+    stop = threading.Event()
+    latido = threading.Thread(
+        target=_heartbeat, args=(job, stop, _stale_after().total_seconds() / 3),
+        daemon=True, name=f"sync-{job.pk}-latido",
+    )
+    latido.start()
+    try:
+        stats = SyncEngine(full=job.completo, on_progress=on_progress, start_skip=job.siguiente_skip).run()
+        job.estado = SyncJob.COMPLETADO
+        print(f"Sync #{job.pk}: {stats}")
+    except JobTakenOver as e:
+        # El estado final lo escribirá quien lo retomó
+        print(f"Sync #{job.pk}: {e}; se detiene esta ejecución")
+        return job
+    except Exception as e:
+        job.estado = SyncJob.ERROR
+        job.error = str(e)
+        print(f"Error Sync #{job.pk}: {e}")
+    finally:
+        stop.set()
+        latido.join()
+
+    job.finalizado_en = timezone.now()
+    if not _owned(job).update(
+        estado=job.estado, error=job.error, finalizado_en=job.finalizado_en, actualizado_en=job.finalizado_en,
+    ):
+        print(f"Sync #{job.pk}: retomado por otro worker; no se sobrescribe su estado")
+    return job
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_sync_job(SyncJob.objects.get(pk=job_id))
+    finally:
+        connection.close()
+
+
+def enqueue_sync(full=False):
+    """
+    Encola una sincronización y la ejecuta en un hilo en segundo plano,
+    liberando el worker web de inmediato. Devuelve el job (nuevo o el ya en curso).
+    """
+    job, should_run = claim_sync_job(full)
+    if should_run:
+        # Arrancar el hilo solo cuando la reserva esté confirmada en la BD
+        transaction.on_commit(
+            lambda: threading.Thread(
+                target=_run_in_thread, args=(job.pk,), daemon=True, name=f"sync-{job.pk}"
+            ).start()
+        )
+    return job
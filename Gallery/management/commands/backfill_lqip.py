@@ -0,0 +1,128 @@
+import base64
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from PIL import Image
+
+from Gallery.generation import bump_generation
+from Gallery.ik_api import get_cdn_session
+from Gallery.models import MediaFile, urls_desde_nombre
+from Gallery.optimizer import build_placeholder, dominant_color
+from Gallery.presets import needs_static_frame, preset_url, sign_url
+
+CAMPOS = ['thumbnail_base64', 'color_dominante']
+
+
+class RateLimiter:
+    """Limita las peticiones por segundo entre todos los hilos (huecos regulares de 1/rate s)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def color_desde_lqip(data_uri):
+    """Color predominante de un LQIP ya guardado (sin pedir nada a la red)."""
+    image = Image.open(io.BytesIO(base64.b64decode(data_uri.split(',', 1)[1])))
+    return dominant_color(image)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rellena el placeholder LQIP y el color predominante de los archivos que no lo tienen "
+        "(sincronizados o antiguos) a partir de una versión de 20px transformada por ImageKit. "
+        "Descargas en paralelo y con límite de peticiones/s; se puede interrumpir y relanzar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Descargas en paralelo (por defecto 8).")
+        parser.add_argument('--rate', type=float, default=20,
+                            help="Máximo de peticiones por segundo a la CDN (por defecto 20; 0 = sin límite).")
+        parser.add_argument('--batch', type=int, default=200, help="Filas por lote y bulk_update (por defecto 200).")
+        parser.add_argument('--desde', type=int, default=0, help="Empieza después de este id.")
+        parser.add_argument('--todos', action='store_true', help="Recalcula también las filas que ya tienen LQIP.")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch'])
+        self.limiter = RateLimiter(options['rate'])
+        self.session = get_cdn_session()
+
+        queryset = MediaFile.objects.all()
+        if not options['todos']:
+            # Reanudable: lo ya rellenado sale del filtro, una nueva ejecución sigue con el resto
+            queryset = queryset.filter(
+                Q(thumbnail_base64__isnull=True) | Q(thumbnail_base64='') | Q(color_dominante='')
+            )
+
+        started = time.monotonic()
+        total = actualizados = fallidos = 0
+        last_id = options['desde']
+        with ThreadPoolExecutor(max_workers=max(1, options['workers']), thread_name_prefix='lqip') as pool:
+            while True:
+                # Paginación por id (sin OFFSET); solo las columnas necesarias
+                rows = list(
+                    queryset.filter(id__gt=last_id).order_by('id')
+                    .only('id', 'archivo', 'tipo', 'url_completa', 'thumbnail_base64', 'color_dominante')[:batch_size]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1].id
+
+                listos = []
+                for media, error in zip(rows, pool.map(lambda m: self._rellenar(m, options['todos']), rows)):
+                    if error:
+                        fallidos += 1
+                        self.stderr.write(f"  #{media.id} {media.archivo.name}: {error}")
+                    else:
+                        listos.append(media)
+                if listos:
+                    MediaFile.objects.bulk_update(listos, CAMPOS, batch_size=batch_size)
+                    actualizados += len(listos)
+
+                total += len(rows)
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.stdout.write(f"  {total} archivos hasta el id {last_id} ({total / elapsed:.1f} archivos/s)")
+
+        if actualizados:
+            # bulk_update no dispara señales: las páginas cacheadas deben ver los placeholders
+            bump_generation()
+        style = self.style.SUCCESS if not fallidos else self.style.WARNING
+        self.stdout.write(style(
+            f"Backfill LQIP terminado: {actualizados} actualizados, {fallidos} fallidos "
+            f"en {time.monotonic() - started:.1f} s."
+        ))
+
+    def _rellenar(self, media, todos):
+        """Calcula LQIP y color en un hilo del pool. Devuelve None o el mensaje de error."""
+        try:
+            if media.thumbnail_base64 and not todos:
+                # Solo faltaba el color: sale del LQIP guardado
+                media.color_dominante = color_desde_lqip(media.thumbnail_base64)
+                return None
+
+            name = media.archivo.name
+            full_url = media.url_completa or urls_desde_nombre(name, media.tipo)[0]
+            url = sign_url(preset_url(full_url, 'lqip', needs_static_frame(name, media.tipo)))
+            self.limiter.wait()
+            response = self.session.get(url, timeout=(5, 30))
+            if response.status_code != 200:
+                return f"HTTP {response.status_code}"
+            media.thumbnail_base64, media.color_dominante = build_placeholder(Image.open(io.BytesIO(response.content)))
+            return None
+        except Exception as e:
+            return str(e)
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from Gallery.albums import rellenar_fechas_enlaces
+from Gallery.models import MediaFile, animado_desde_nombre, mime_desde_nombre, urls_desde_nombre
+
+CAMPOS = ['url_completa', 'url_miniatura', 'srcset_miniatura', 'mime', 'animado']
+
+
+class Command(BaseCommand):
+    help = (
+        "Rellena las columnas precalculadas (URLs canónicas, mime, animado) de los archivos "
+        "existentes, por lotes con bulk_update, y la fecha copiada en los enlaces archivo-álbum."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=2000, help="Filas por lote (por defecto 2000).")
+        parser.add_argument('--todos', action='store_true', help="Recalcula también las filas ya rellenadas.")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch'])
+        queryset = MediaFile.objects.all()
+        if not options['todos']:
+            queryset = queryset.filter(Q(url_miniatura='') | Q(url_completa='') | Q(srcset_miniatura=''))
+
+        started = time.monotonic()
+        total = 0
+        last_id = 0
+        while True:
+            # Paginación por id (sin OFFSET); solo las columnas necesarias
+            rows = list(
+                queryset.filter(id__gt=last_id).order_by('id')
+                .only('id', 'archivo', 'tipo', 'mime', 'animado')[:batch_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            for media in rows:
+                name = media.archivo.name
+                media.url_completa, media.url_miniatura, media.srcset_miniatura = urls_desde_nombre(name, media.tipo)
+                media.mime = media.mime or mime_desde_nombre(name)
+                media.animado = media.animado or animado_desde_nombre(name, media.tipo)
+            MediaFile.objects.bulk_update(rows, CAMPOS, batch_size=batch_size)
+
+            total += len(rows)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"  {total} filas ({total / elapsed:.0f} filas/s)")
+
+        enlaces = rellenar_fechas_enlaces()
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfill terminado: {total} archivos actualizados, {enlaces} enlaces de álbum fechados."
+        ))
@@ -0,0 +1,111 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from Gallery.albums import rebuild_album_paths
+from Gallery.models import Album, MediaFile
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide las consultas del árbol de álbumes (subárbol, migas de pan, totales recursivos) "
+        "con la ruta materializada frente al recorrido recursivo por album_padre. "
+        "Crea un árbol sintético dentro de una transacción que se deshace al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--albumes', type=int, default=10000, help="Álbumes del árbol (por defecto 10000).")
+        parser.add_argument('--niveles', type=int, default=10, help="Profundidad del árbol (por defecto 10).")
+        parser.add_argument('--raices', type=int, default=10, help="Álbumes raíz (por defecto 10).")
+        parser.add_argument('--archivos', type=int, default=20000, help="Archivos repartidos en el árbol (por defecto 20000).")
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def _build(self, total, niveles, raices, archivos, rng):
+        niveles_ids = []
+        restantes = max(0, total - raices)
+        por_nivel = max(1, restantes // max(1, niveles - 1))
+        for nivel in range(niveles):
+            cantidad = raices if nivel == 0 else por_nivel
+            padres = niveles_ids[-1] if niveles_ids else None
+            nuevos = Album.objects.bulk_create([
+                Album(nombre=f"bench-{nivel}-{i}", album_padre_id=rng.choice(padres) if padres else None)
+                for i in range(cantidad)
+            ], batch_size=1000)
+            niveles_ids.append([album.pk for album in nuevos])
+
+        started = time.perf_counter()
+        rebuild_album_paths()
+        reconstruccion = (time.perf_counter() - started) * 1000
+
+        medios = MediaFile.objects.bulk_create([
+            MediaFile(archivo=f"bench/{i}.jpg", nombre=f"{i}.jpg", tipo='imagen', tamano=rng.randint(1, 5) * 1024 ** 2)
+            for i in range(archivos)
+        ], batch_size=1000)
+        todos = [pk for ids in niveles_ids for pk in ids]
+        enlaces = MediaFile.albumes.through
+        enlaces.objects.bulk_create([
+            enlaces(mediafile_id=media.pk, album_id=rng.choice(todos), creado_en=media.creado_en) for media in medios
+        ], batch_size=1000)
+        return niveles_ids, reconstruccion
+
+    def _recursivo(self, album_id):
+        """Lo que haría el código sin índice: dos consultas por álbum visitado."""
+        archivos = set(MediaFile.objects.filter(albumes__id=album_id).values_list('id', flat=True))
+        for hijo_id in Album.objects.filter(album_padre_id=album_id).values_list('id', flat=True):
+            archivos |= self._recursivo(hijo_id)
+        return archivos
+
+    def _migas_recursivas(self, album):
+        migas = [album]
+        while migas[0].album_padre_id:
+            migas.insert(0, Album.objects.get(pk=migas[0].album_padre_id))
+        return migas
+
+    def _measure(self, func):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            result = func()
+            elapsed = (time.perf_counter() - started) * 1000
+        return result, elapsed, len(ctx.captured_queries)
+
+    def _report(self, nombre, antes, despues):
+        self.stdout.write(
+            f"  {nombre}: recursivo {antes[1]:.1f} ms / {antes[2]} consultas -> "
+            f"ruta {despues[1]:.1f} ms / {despues[2]} consulta(s)"
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['semilla'])
+        niveles = max(1, options['niveles'])
+
+        with transaction.atomic():
+            niveles_ids, reconstruccion = self._build(
+                options['albumes'], niveles, max(1, options['raices']), max(0, options['archivos']), rng
+            )
+            total = sum(len(ids) for ids in niveles_ids)
+            self.stdout.write(f"Árbol de {total} álbumes en {niveles} niveles; rutas calculadas en {reconstruccion:.1f} ms.")
+
+            raiz = Album.objects.get(pk=niveles_ids[0][0])
+            hoja = Album.objects.get(pk=niveles_ids[-1][0])
+
+            antes = self._measure(lambda: self._recursivo(raiz.pk))
+            despues = self._measure(raiz.totales_recursivos)
+            self._report("totales de una raíz", antes, despues)
+            if len(antes[0]) != despues[0]['archivos']:
+                self.stdout.write(self.style.ERROR(
+                    f"  Discrepancia: {len(antes[0])} archivos (recursivo) frente a {despues[0]['archivos']}"
+                ))
+
+            antes = self._measure(lambda: self._migas_recursivas(hoja))
+            despues = self._measure(lambda: hoja.migas)
+            self._report("migas de pan de una hoja", antes, despues)
+
+            despues = self._measure(lambda: raiz.descendientes().count())
+            self.stdout.write(f"  subárbol de la raíz: {despues[0]} álbumes en {despues[1]:.1f} ms / {despues[2]} consulta(s)")
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("Datos de prueba descartados (rollback)."))
@@ -0,0 +1,46 @@
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Arranque mínimo del proyecto: settings, apps, modelos y URLs (lo que carga cualquier comando)
+SONDA = (
+    "import django, sys; django.setup(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns; "
+    "print('imagekitio' in sys.modules)"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el arranque en frío de 'manage.py check' en procesos nuevos y comprueba que "
+        "cargar el proyecto no importa el SDK de ImageKit (todo va por la API REST de ik_api)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=5, help="Arranques a medir (por defecto 5).")
+
+    def handle(self, *args, **options):
+        manage_py = str(settings.BASE_DIR / 'manage.py')
+        tiempos = []
+        for _ in range(max(1, options['repeticiones'])):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, manage_py, 'check'], cwd=settings.BASE_DIR, check=True,
+                           stdout=subprocess.DEVNULL)
+            tiempos.append((time.perf_counter() - started) * 1000)
+
+        sonda = subprocess.run([sys.executable, '-c', SONDA], cwd=settings.BASE_DIR, check=True,
+                               capture_output=True, text=True)
+        sdk_cargado = sonda.stdout.strip().splitlines()[-1] == 'True'
+
+        self.stdout.write(
+            f"manage.py check: mediana {statistics.median(tiempos):.0f} ms "
+            f"(mín {min(tiempos):.0f} ms, máx {max(tiempos):.0f} ms, {len(tiempos)} arranques)"
+        )
+        if sdk_cargado:
+            self.stdout.write(self.style.WARNING("El arranque importa imagekitio: algún módulo vuelve a usar el SDK."))
+        else:
+            self.stdout.write(self.style.SUCCESS("El arranque no importa imagekitio."))
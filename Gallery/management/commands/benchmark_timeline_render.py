@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+
+from Gallery.models import MediaFile, tipo_desde_nombre
+
+# La cuadrícula real: el mismo parcial para ambas variantes, solo cambia de dónde salen las URLs
+PLANTILLA = "{% for media in items %}{% include 'partials/_media_item.html' %}{% endfor %}"
+
+NOMBRES = ['fotos/playa_{}.jpg', 'fotos/gato_{}.webp', 'gifs/baile_{}.gif', 'videos/viaje_{}.mp4']
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el tiempo de render de una página de la cuadrícula con filas sin backfill "
+        "(URLs calculadas por fila en cada render) frente a columnas precalculadas. No toca la BD."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=60, help="Elementos por página (por defecto 60).")
+        parser.add_argument('--repeticiones', type=int, default=200, help="Renders por variante (por defecto 200).")
+
+    def _items(self, count, precalculado):
+        items = []
+        for i in range(count):
+            name = NOMBRES[i % len(NOMBRES)].format(i)
+            media = MediaFile(id=i + 1, archivo=name, tipo=tipo_desde_nombre(name))
+            if precalculado:
+                media.rellenar_metadatos()
+            items.append(media)
+        return items
+
+    def _measure(self, render, repeticiones):
+        render()  # calentamiento (compilación de la plantilla, cachés)
+        timings = []
+        for _ in range(repeticiones):
+            started = time.perf_counter()
+            render()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1]
+
+    def handle(self, *args, **options):
+        count = max(1, options['items'])
+        repeticiones = max(1, options['repeticiones'])
+
+        plantilla = Template(PLANTILLA)
+        sin_backfill = self._items(count, precalculado=False)
+        antes = self._measure(lambda: plantilla.render(Context({'items': sin_backfill})), repeticiones)
+
+        precalculados = self._items(count, precalculado=True)
+        despues = self._measure(lambda: plantilla.render(Context({'items': precalculados})), repeticiones)
+
+        self.stdout.write(f"Página de {count} elementos, {repeticiones} renders por variante:")
+        self.stdout.write(f"  URLs por fila:         mediana {antes[0]:.2f} ms, p95 {antes[1]:.2f} ms")
+        self.stdout.write(f"  columnas precalculadas: mediana {despues[0]:.2f} ms, p95 {despues[1]:.2f} ms")
+        if despues[0] > 0:
+            self.stdout.write(f"  relación (mediana): {antes[0] / despues[0]:.2f}x")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from Gallery.health import CAIDO, run_probe
+
+
+class Command(BaseCommand):
+    help = (
+        "Sondea la API de ImageKit una vez y publica el estado en la caché "
+        "(lo mismo que hace el hilo de fondo; útil desde cron o para diagnosticar)."
+    )
+
+    def handle(self, *args, **options):
+        status = run_probe()
+        line = f"ImageKit: {status['status']} ({status['latency_ms']} ms)"
+        if status['error']:
+            line += f" — {status['error']}"
+        self.stdout.write(line)
+        if status['p50_ms'] is not None:
+            self.stdout.write(
+                f"  ventana de {status['samples']} muestras: p50 {status['p50_ms']} ms, "
+                f"p95 {status['p95_ms']} ms, p99 {status['p99_ms']} ms, errores {status['error_rate']:.1%}"
+            )
+        if status['status'] == CAIDO:
+            self.stderr.write(self.style.ERROR("La API de ImageKit no responde."))
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Gallery.deletion import delete_media, select_ids
+from Gallery.models import Album
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra archivos de ImageKit y de la galería: por ids, por álbum o por búsqueda. "
+        "Borrado por lotes en la nube, en paralelo; los que fallan en la nube no se borran localmente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Ids de MediaFile.")
+        parser.add_argument('--album', type=int, help="Todos los archivos de este álbum.")
+        parser.add_argument('--subalbumes', action='store_true', help="Con --album, incluye todo su subárbol.")
+        parser.add_argument('--buscar', help="Todos los resultados de esta búsqueda (misma sintaxis que el buscador).")
+        parser.add_argument('--workers', type=int, default=None, help="Lotes de borrado en paralelo en la nube.")
+        parser.add_argument('--lote', type=int, default=1000, help="Archivos por tanda (por defecto 1000).")
+        parser.add_argument('--simular', action='store_true', help="Solo cuenta lo que se borraría.")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help="No pedir confirmación.")
+
+    def _seleccion(self, options):
+        elegidas = [bool(options['ids']), options['album'] is not None, bool(options['buscar'])]
+        if sum(elegidas) != 1:
+            raise CommandError("Indica exactamente una selección: ids, --album o --buscar.")
+        if options['ids']:
+            return select_ids(ids=options['ids'])
+        if options['album'] is not None:
+            album = Album.objects.filter(pk=options['album']).first()
+            if album is None:
+                raise CommandError(f"No existe el álbum {options['album']}.")
+            return select_ids(album=album, subalbumes=options['subalbumes'])
+        return select_ids(consulta=options['buscar'])
+
+    def handle(self, *args, **options):
+        ids = self._seleccion(options)
+        if not ids:
+            self.stdout.write("No hay archivos que coincidan.")
+            return
+        if options['simular']:
+            self.stdout.write(f"Se borrarían {len(ids)} archivos.")
+            return
+        if options['interactive']:
+            respuesta = input(f"Se van a borrar {len(ids)} archivos de ImageKit y de la galería. Escribe 'si' para continuar: ")
+            if respuesta.strip().lower() not in ('si', 'sí'):
+                self.stdout.write("Cancelado.")
+                return
+
+        lote = max(1, options['lote'])
+        started = time.monotonic()
+        eliminados = 0
+        fallidos = []
+        for i in range(0, len(ids), lote):
+            for resultado in delete_media(ids[i:i + lote], concurrency=options['workers']):
+                if resultado['ok']:
+                    eliminados += 1
+                else:
+                    fallidos.append(resultado)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            hechos = min(i + lote, len(ids))
+            self.stdout.write(f"  {hechos}/{len(ids)} procesados ({hechos / elapsed:.0f} archivos/s)")
+
+        for resultado in fallidos:
+            self.stderr.write(f"  #{resultado['id']}: {resultado['error']}")
+        style = self.style.SUCCESS if not fallidos else self.style.WARNING
+        self.stdout.write(style(f"Borrado terminado: {eliminados} eliminados, {len(fallidos)} fallidos."))
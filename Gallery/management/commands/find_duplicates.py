@@ -0,0 +1,111 @@
+import base64
+import io
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from PIL import Image
+
+from Gallery.models import MediaFile
+
+
+def format_bytes(size):
+    power = 2**10
+    n = 0
+    power_labels = {0: 'B', 1: 'KB', 2: 'MB', 3: 'GB', 4: 'TB'}
+    while size > power:
+        size /= power
+        n += 1
+    return f"{size:.2f} {power_labels[n]}"
+
+
+def dhash_from_lqip(data_uri):
+    """
+    Hash perceptual (dHash de 64 bits) calculado a partir del LQIP ya guardado en la BD,
+    sin descargar nada de la nube. Sirve para detectar casi-duplicados
+    (recompresiones, cambios de formato, pequeños reescalados).
+    """
+    try:
+        raw = base64.b64decode(data_uri.split(',', 1)[1])
+        image = Image.open(io.BytesIO(raw)).convert('L').resize((9, 8), Image.LANCZOS)
+    except Exception:
+        return None
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:016x}"
+
+
+class Command(BaseCommand):
+    help = "Informa de los grupos de archivos duplicados y de los bytes que desperdician."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--perceptual', action='store_true',
+            help="Añade casi-duplicados agrupando por hash perceptual del LQIP."
+        )
+        parser.add_argument('--limit', type=int, default=50, help="Grupos a listar (por defecto 50).")
+
+    def handle(self, *args, **options):
+        groups = self._exact_groups()
+        self._print_groups("Duplicados exactos (BLAKE2b)", groups, options['limit'])
+
+        if options['perceptual']:
+            groups = self._perceptual_groups()
+            self._print_groups("Casi-duplicados (dHash del LQIP)", groups, options['limit'])
+
+    def _exact_groups(self):
+        hashes = list(
+            MediaFile.objects.exclude(hash_contenido__isnull=True).exclude(hash_contenido='')
+            .values('hash_contenido').annotate(n=Count('id')).filter(n__gt=1)
+            .values_list('hash_contenido', flat=True)
+        )
+        groups = defaultdict(list)
+        for i in range(0, len(hashes), 1000):
+            rows = MediaFile.objects.filter(hash_contenido__in=hashes[i:i + 1000]).values(
+                'id', 'nombre', 'file_id', 'tamano', 'hash_contenido'
+            )
+            for row in rows:
+                groups[row['hash_contenido']].append(row)
+        return groups
+
+    def _perceptual_groups(self):
+        groups = defaultdict(list)
+        rows = (
+            MediaFile.objects.filter(tipo__in=['imagen', 'gif'])
+            .exclude(thumbnail_base64__isnull=True).exclude(thumbnail_base64='')
+            .values('id', 'nombre', 'file_id', 'tamano', 'thumbnail_base64')
+        )
+        for row in rows.iterator(chunk_size=2000):
+            phash = dhash_from_lqip(row.pop('thumbnail_base64'))
+            if phash:
+                groups[phash].append(row)
+        return {key: rows for key, rows in groups.items() if len(rows) > 1}
+
+    def _wasted_bytes(self, rows):
+        """
+        Bytes desperdiciados: todos los assets distintos del grupo menos uno.
+        Filas deduplicadas que comparten file_id no cuentan (ya usan un único asset).
+        """
+        assets = {}
+        for row in rows:
+            assets.setdefault(row['file_id'] or f"local-{row['id']}", row['tamano'])
+        sizes = sorted(assets.values())
+        return sum(sizes[:-1]) if len(sizes) > 1 else 0
+
+    def _print_groups(self, title, groups, limit):
+        ranked = sorted(
+            ((self._wasted_bytes(rows), key, rows) for key, rows in groups.items()),
+            key=lambda item: item[0], reverse=True,
+        )
+        total_waste = sum(waste for waste, _, _ in ranked)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        self.stdout.write(f"{len(ranked)} grupos, {format_bytes(total_waste)} desperdiciados.")
+        for waste, key, rows in ranked[:limit]:
+            ids = ", ".join(f"#{row['id']} {row['nombre'] or ''}".strip() for row in rows)
+            self.stdout.write(f"  {key[:16]}  {len(rows)} archivos, {format_bytes(waste)}: {ids}")
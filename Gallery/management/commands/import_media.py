@@ -0,0 +1,311 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from Gallery.models import (
+    VIDEO_EXTENSIONS, Album, MediaFile, animado_desde_nombre, mime_desde_nombre, tipo_desde_nombre,
+    urls_desde_nombre,
+)
+from Gallery.generation import bump_generation
+from Gallery.optimizer import FORMAT_BY_EXT
+from Gallery.search import index_media
+from Gallery.timeline import invalidate_timeline
+from Gallery.stats import apply_delta, delta_from_rows
+
+MEDIA_EXTENSIONS = tuple(FORMAT_BY_EXT) + VIDEO_EXTENSIONS
+MANIFEST_NAME = '.import_manifest.jsonl'
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa un directorio local a la galería subiendo en paralelo a ImageKit. "
+        "Reanudable mediante un manifiesto JSONL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directorio', help="Directorio raíz a importar.")
+        parser.add_argument('--workers', type=int, default=4, help="Subidas en paralelo (por defecto 4).")
+        parser.add_argument(
+            '--albumes', action='store_true',
+            help="Convierte cada subcarpeta en un Álbum (anidados mediante album_padre)."
+        )
+        parser.add_argument('--manifest', help=f"Ruta del manifiesto (por defecto <directorio>/{MANIFEST_NAME}).")
+        parser.add_argument('--batch', type=int, default=200, help="Filas por bulk_create (por defecto 200).")
+
+    def handle(self, *args, **options):
+        root = Path(options['directorio']).resolve()
+        if not root.is_dir():
+            raise CommandError(f"No existe el directorio: {root}")
+
+        self.root = root
+        self.use_albums = options['albumes']
+        self.batch_size = max(1, options['batch'])
+        self.storage = MediaFile._meta.get_field('archivo').storage
+        self.album_cache = {}
+        self.pending = []
+        # Deduplicación dentro de la ejecución: _find_duplicate solo ve filas ya guardadas
+        # (tras _flush), así que dos copias del mismo archivo se subirían dos veces
+        self.dedupe = getattr(settings, 'GALLERY_DEDUPLICATE', True)
+        self.by_hash = {}
+        self.hash_lock = threading.Lock()
+
+        manifest_path = Path(options['manifest']) if options['manifest'] else root / MANIFEST_NAME
+        done = self._load_manifest(manifest_path)
+
+        files = [p for p in self._walk(root) if str(p.relative_to(root)) not in done]
+        self.stdout.write(f"{len(done)} ya importados según el manifiesto, {len(files)} por subir.")
+
+        self.uploaded = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.started = time.monotonic()
+
+        workers = max(1, options['workers'])
+        queue = iter(files)
+        in_flight = {}
+        with open(manifest_path, 'a', encoding='utf-8') as manifest, \
+                ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                # Ventana acotada: como mucho 2 subidas por worker encoladas a la vez
+                # (no un future por archivo del directorio desde el principio)
+                for path in queue:
+                    in_flight[pool.submit(self._upload, path)] = path
+                    if len(in_flight) >= workers * 2:
+                        break
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        self.failed += 1
+                        self.stderr.write(f"Error subiendo {path}: {e}")
+                        continue
+
+                    # El manifiesto se escribe en cuanto el archivo está en la nube:
+                    # si el proceso muere antes del bulk_create, la fila se crea al reanudar.
+                    manifest.write(json.dumps(record) + '\n')
+                    manifest.flush()
+
+                    self.pending.append(record)
+                    self.uploaded += 1
+                    if not record.get('duplicado'):
+                        self.bytes_sent += record['tamano_original'] or record['tamano']
+                    if len(self.pending) >= self.batch_size:
+                        self._flush()
+                        self._report()
+
+        self._flush()
+        self._report(final=True)
+
+    # --- Recorrido y manifiesto ---
+
+    def _walk(self, root):
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.lower().endswith(MEDIA_EXTENSIONS):
+                    yield Path(dirpath) / filename
+
+    def _load_manifest(self, manifest_path):
+        """
+        Devuelve las rutas ya subidas. Las que están en el manifiesto pero no en la BD
+        (corte entre la subida y el bulk_create) se encolan para crear su fila sin resubir.
+
+        Con deduplicación varias rutas comparten file_id y nombre guardado, así que se
+        cuentan filas por nombre guardado: si hay menos filas que registros, faltan los
+        últimos del manifiesto (las filas se crean en el mismo orden en que se escribe).
+        """
+        if not manifest_path.exists():
+            return set()
+
+        records = {}
+        with open(manifest_path, encoding='utf-8') as manifest:
+            for line in manifest:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    records[record['path']] = record
+
+        by_name = defaultdict(list)
+        for r in records.values():
+            if r.get('file_id'):
+                by_name[r['name']].append(r)
+        # Filas anteriores a la importación que sirvieron de original a un duplicado
+        originals = {r['duplicado_de'] for r in records.values() if r.get('duplicado_de')}
+
+        saved = Counter()
+        names = list(by_name)
+        for i in range(0, len(names), 1000):
+            for name, pk in MediaFile.objects.filter(archivo__in=names[i:i + 1000]).values_list('archivo', 'id'):
+                # Un nombre recién subido en esta importación solo lo tienen filas suyas
+                fresh = any(not r.get('duplicado_de') for r in by_name[name])
+                if fresh or pk not in originals:
+                    saved[name] += 1
+
+        missing = [r for name, group in by_name.items() for r in group[saved[name]:]]
+        if missing:
+            self.stdout.write(f"Recuperando {len(missing)} filas subidas pero no guardadas...")
+            self.pending.extend(missing)
+            self._flush()
+        return set(records)
+
+    # --- Subida (en los hilos del pool) ---
+
+    def _upload(self, path):
+        rel = str(path.relative_to(self.root))
+        with open(path, 'rb') as fh:
+            content = File(fh, name=path.name)
+            if not self.dedupe:
+                return self._record(rel, path, self.storage.save(path.name, content), content)
+
+            content.content_hash = self.storage._content_hash(content)
+            with self.hash_lock:
+                first = self.by_hash.get(content.content_hash)
+                owner = first is None
+                if owner:
+                    first = self.by_hash[content.content_hash] = {'done': threading.Event(), 'record': None}
+            if not owner:
+                # Misma copia subida (o subiéndose) en otro hilo: se reutiliza su asset
+                first['done'].wait()
+                if first['record']:
+                    # duplicado_de se hereda: si la primera enlazó una fila anterior, esta también
+                    return {**first['record'], 'path': rel, 'duplicado': True, 'cpu_ms': None}
+                # La primera falló: esta lo intenta por su cuenta
+
+            record = None
+            try:
+                record = self._record(rel, path, self.storage.save(path.name, content), content)
+            finally:
+                if owner:
+                    first['record'] = record
+                    first['done'].set()
+            return record
+
+    def _record(self, rel, path, name, content):
+        info = getattr(content, 'optimization_stats', None) or {}
+        return {
+            'path': rel,
+            'name': name,
+            'file_id': getattr(content, 'imagekit_file_id', None),
+            # duplicado: no se subió (asset de otra fila); duplicado_de: fila ya guardada de la BD
+            'duplicado': bool(getattr(content, 'duplicate_of', None)),
+            'duplicado_de': getattr(content, 'duplicate_of', None),
+            'hash': getattr(content, 'content_hash', None),
+            'tamano': info.get('final_size', path.stat().st_size),
+            'tamano_original': info.get('original_size', 0),
+            'cpu_ms': info.get('cpu_ms'),
+            'ancho': info.get('width'),
+            'alto': info.get('height'),
+            'lqip': info.get('lqip'),
+            'color': info.get('color'),
+            'mime': info.get('mime') or mime_desde_nombre(name),
+            'animado': bool(info.get('animated')),
+        }
+
+    # --- Escritura en BD (solo en el hilo principal) ---
+
+    def _album_for(self, rel_dir):
+        """Crea (o reutiliza) la cadena de álbumes anidados para una carpeta relativa."""
+        if rel_dir in ('', '.'):
+            return None
+        if rel_dir in self.album_cache:
+            return self.album_cache[rel_dir]
+
+        parent_dir, nombre = os.path.split(rel_dir)
+        padre = self._album_for(parent_dir)
+        album = Album.objects.filter(nombre=nombre, album_padre=padre).first()
+        if album is None:
+            album = Album.objects.create(nombre=nombre, album_padre=padre)
+        self.album_cache[rel_dir] = album
+        return album
+
+    def _flush(self):
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+
+        rows = []
+        for r in records:
+            tipo = tipo_desde_nombre(r['name'])
+            url_completa, url_miniatura, srcset_miniatura = urls_desde_nombre(r['name'], tipo)
+            rows.append(MediaFile(
+                archivo=r['name'],
+                nombre=os.path.basename(r['path']),
+                tipo=tipo,
+                file_id=r.get('file_id'),
+                hash_contenido=r.get('hash'),
+                tamano=r['tamano'],
+                tamano_original=r.get('tamano_original') or 0,
+                optimizacion_cpu_ms=r.get('cpu_ms'),
+                ancho=r.get('ancho'),
+                alto=r.get('alto'),
+                thumbnail_base64=r.get('lqip'),
+                color_dominante=r.get('color') or '',
+                url_completa=url_completa,
+                url_miniatura=url_miniatura,
+                srcset_miniatura=srcset_miniatura,
+                mime=r.get('mime') or mime_desde_nombre(r['name']),
+                animado=r.get('animado') or animado_desde_nombre(r['name'], tipo),
+            ))
+
+        with transaction.atomic():
+            last_id = MediaFile.objects.aggregate(last=Max('id'))['last'] or 0
+            MediaFile.objects.bulk_create(rows, batch_size=self.batch_size)
+            # Un duplicado comparte el asset del original: cuenta como archivo, no como bytes
+            apply_delta(delta_from_rows(
+                (row.tipo, 0 if r.get('duplicado') or r.get('duplicado_de') else row.tamano)
+                for row, r in zip(rows, records)
+            ))
+
+            if any(row.pk is None for row in rows):
+                # bulk_create no devuelve PKs en MySQL. Con deduplicación varias filas comparten
+                # file_id y nombre guardado: se toman las filas nuevas (id > last_id) de cada
+                # nombre en orden de inserción, que es el orden de `records`
+                new_ids = defaultdict(list)
+                for name, pk in MediaFile.objects.filter(
+                    id__gt=last_id, archivo__in={r['name'] for r in records}
+                ).order_by('id').values_list('archivo', 'id'):
+                    new_ids[name].append(pk)
+                for row, r in zip(rows, records):
+                    row.pk = new_ids[r['name']].pop(0) if new_ids[r['name']] else None
+
+            if self.use_albums:
+                through = MediaFile.albumes.through
+                links = []
+                for row, r in zip(rows, records):
+                    album = self._album_for(os.path.dirname(r['path']))
+                    if album and row.pk:
+                        links.append(through(mediafile_id=row.pk, album_id=album.id, creado_en=row.creado_en))
+                through.objects.bulk_create(links, batch_size=self.batch_size, ignore_conflicts=True)
+
+        # Índice de búsqueda: bulk_create no dispara señales
+        index_media(MediaFile.objects.filter(pk__in=[row.pk for row in rows if row.pk]))
+        invalidate_timeline()
+        bump_generation()
+
+    def _report(self, final=False):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        files_s = self.uploaded / elapsed
+        mb_s = self.bytes_sent / (1024 ** 2) / elapsed
+        msg = (
+            f"{self.uploaded} subidos, {self.failed} errores en {elapsed:.1f}s "
+            f"({files_s:.1f} archivos/s, {mb_s:.2f} MB/s)"
+        )
+        if final:
+            self.stdout.write(self.style.SUCCESS(f"Importación terminada: {msg}"))
+        else:
+            self.stdout.write(f"  {msg}")
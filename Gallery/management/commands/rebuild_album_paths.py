@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from Gallery.albums import rebuild_album_paths
+
+
+class Command(BaseCommand):
+    help = "Recalcula la ruta materializada (árbol por album_padre) de todos los álbumes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help="Tamaño de lote del bulk_update (por defecto 1000).")
+
+    def handle(self, *args, **options):
+        actualizados, ciclos = rebuild_album_paths(batch_size=max(1, options['batch']))
+        self.stdout.write(self.style.SUCCESS(f"Rutas recalculadas: {actualizados} álbumes actualizados."))
+        if ciclos:
+            self.stdout.write(self.style.WARNING(
+                f"{ciclos} ciclo(s) en album_padre: los álbumes afectados se han tratado como raíz."
+            ))
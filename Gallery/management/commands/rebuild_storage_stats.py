@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from Gallery.stats import rebuild_storage_stats
+
+
+class Command(BaseCommand):
+    help = "Recalcula desde cero los contadores de almacenamiento (StorageStats) e invalida su caché."
+
+    def handle(self, *args, **options):
+        stats = rebuild_storage_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Contadores reconstruidos: {stats.archivos} archivos, {stats.albumes} álbumes, "
+            f"{stats.bytes_total} bytes (imágenes {stats.bytes_imagen}, videos {stats.bytes_video})."
+        ))
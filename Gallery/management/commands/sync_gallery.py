@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from Gallery.jobs import claim_sync_job, run_sync_job
+from Gallery.models import SyncJob
+
+
+class Command(BaseCommand):
+    help = "Sincroniza la galería con ImageKit fuera del servidor web (incremental por defecto)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Listado completo con limpieza de archivos borrados en la nube."
+        )
+
+    def handle(self, *args, **options):
+        job, should_run = claim_sync_job(full=options['full'])
+        if not should_run:
+            self.stdout.write(self.style.WARNING(
+                f"Ya hay una sincronización en curso (#{job.pk}). No se inicia otra."
+            ))
+            return
+
+        if job.reanudaciones:
+            self.stdout.write(f"Retomando sincronización interrumpida #{job.pk}...")
+        else:
+            self.stdout.write(f"Sincronización #{job.pk} iniciada.")
+
+        def echo(job):
+            self.stdout.write(
+                f"  páginas={job.paginas} filas={job.filas} "
+                f"nuevos={job.creados} enlazados={job.enlazados} eliminados={job.eliminados}"
+            )
+
+        job = run_sync_job(job, echo=echo)
+
+        if job.estado == SyncJob.ERROR:
+            self.stderr.write(self.style.ERROR(f"Error de sincronización: {job.error}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Sincronización #{job.pk} completada: {job.creados} nuevos, "
+                f"{job.enlazados} enlazados, {job.eliminados} eliminados localmente."
+            ))
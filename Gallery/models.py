@@ -1,8 +1,47 @@
+import mimetypes
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+from .presets import GRID_SRCSET, needs_static_frame, preset_srcset, preset_url
 from .storage import ImageKitStorage
-import base64
-import io
-from PIL import Image
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.webm', '.mkv')
+
+
+def tipo_desde_nombre(name):
+    """Deduce el campo `tipo` a partir de la extensión del archivo."""
+    name = str(name).lower()
+    if name.endswith(VIDEO_EXTENSIONS):
+        return 'video'
+    # AQUI EL CAMBIO: Agregamos .webp a la detección de "animaciones"
+    # Esto ayuda a que lógica interna considere que puede moverse
+    if name.endswith(('.gif', '.webp')):
+        return 'gif'
+    return 'imagen'
+
+
+def urls_desde_nombre(name, tipo):
+    """
+    URLs canónicas (completa, miniatura 'grid', srcset de la cuadrícula) de un archivo de ImageKit.
+    Videos, GIF y WebP usan /ik-thumbnail.jpg (primer frame) para que la miniatura sea estática.
+    """
+    if not name:
+        return '', '', ''
+    endpoint = settings.IMAGEKIT_URL_ENDPOINT.rstrip('/')
+    full = f"{endpoint}/{name}"
+    static_frame = needs_static_frame(name, tipo)
+    return full, preset_url(full, 'grid', static_frame), preset_srcset(full, GRID_SRCSET, static_frame)
+
+
+def mime_desde_nombre(name):
+    return mimetypes.guess_type(str(name))[0] or ''
+
+
+def animado_desde_nombre(name, tipo):
+    """Sin decodificar: los GIF se consideran animados; los WebP solo si la ingesta lo detectó."""
+    return tipo == 'gif' and not str(name).lower().endswith('.webp')
+
 
 class Album(models.Model):
     nombre = models.CharField(max_length=100, help_text="Nombre del álbum.")
@@ -30,6 +69,10 @@ class Album(models.Model):
         help_text="Álbumes incluidos dentro de este álbum."
     )
 
+    # --- ÁRBOL (ruta materializada por album_padre, ver albums.py) ---
+    ruta = models.CharField(max_length=255, blank=True, default='', editable=False, db_index=True)
+    profundidad = models.PositiveSmallIntegerField(default=0, editable=False)
+
     class Meta:
         verbose_name = "Álbum"
         verbose_name_plural = "Álbumes"
@@ -38,6 +81,30 @@ class Album(models.Model):
     def __str__(self):
         return self.nombre
 
+    def clean(self):
+        from .albums import validar_padre
+        validar_padre(self)
+
+    def save(self, *args, **kwargs):
+        from .albums import completar_ruta, preparar_ruta
+        anterior = preparar_ruta(self)
+        super().save(*args, **kwargs)
+        completar_ruta(self, anterior)
+
+    def descendientes(self, incluir_propio=False):
+        from .albums import descendientes
+        return descendientes(self, incluir_propio)
+
+    @property
+    def migas(self):
+        """Migas de pan: ancestros de la raíz al padre y el propio álbum."""
+        from .albums import ancestros
+        return ancestros(self) + [self]
+
+    def totales_recursivos(self):
+        from .albums import totales_recursivos
+        return totales_recursivos(self)
+
     def cantidad_archivos(self):
         return self.archivos.count()
 
@@ -47,7 +114,7 @@ class Album(models.Model):
     @property
     def preview_url(self):
         if self.imagen_preview:
-            return self.imagen_preview.miniatura_url
+            return self.imagen_preview.url_preset('album-cover')
         return None
 
 class MediaFile(models.Model):
@@ -59,76 +126,128 @@ class MediaFile(models.Model):
     tamano = models.BigIntegerField(default=0, editable=False)
     
     creado_en = models.DateTimeField(auto_now_add=True)
-    albumes = models.ManyToManyField(Album, related_name='archivos', blank=True)
+    albumes = models.ManyToManyField(Album, related_name='archivos', blank=True, through='AlbumArchivo')
 
     # --- NUEVO CAMPO PARA LQIP ---
     thumbnail_base64 = models.TextField(blank=True, null=True, editable=False)
+    # Color predominante (#rrggbb): fondo de la celda mientras llega el LQIP o la miniatura
+    color_dominante = models.CharField(max_length=7, blank=True, default='', editable=False)
+
+    # --- ESTADÍSTICAS DE OPTIMIZACIÓN EN LA SUBIDA ---
+    tamano_original = models.BigIntegerField(default=0, editable=False)
+    optimizacion_cpu_ms = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    # --- DEDUPLICACIÓN: BLAKE2b del contenido original ---
+    hash_contenido = models.CharField(max_length=64, blank=True, null=True, editable=False, db_index=True)
+
+    # --- DIMENSIONES (se obtienen en la ingesta, sin volver a decodificar) ---
+    ancho = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    alto = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    # --- METADATOS PRECALCULADOS (ingesta / sync / backfill_media_metadata) ---
+    # Las plantillas leen estas columnas tal cual, sin construir URLs por fila.
+    url_completa = models.CharField(max_length=500, blank=True, default='', editable=False)
+    url_miniatura = models.CharField(max_length=600, blank=True, default='', editable=False)
+    srcset_miniatura = models.CharField(max_length=1300, blank=True, default='', editable=False)
+    mime = models.CharField(max_length=100, blank=True, default='', editable=False)
+    duracion = models.FloatField(null=True, blank=True, editable=False, help_text="Segundos (videos).")
+    animado = models.BooleanField(default=False, editable=False)
     
     class Meta:
         verbose_name = "Archivo Multimedia"
         verbose_name_plural = "Archivos Multimedia"
         ordering = ['-creado_en']
+        indexes = [
+            # Paginación por cursor de la línea de tiempo: ORDER BY creado_en DESC, id DESC
+            models.Index(fields=['-creado_en', '-id'], name='mediafile_timeline_idx'),
+        ]
 
     def __str__(self):
         return self.nombre or str(self.archivo.name)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Foto de tipo/tamaño al cargar: las señales calculan el delta de StorageStats
+        instance._stats_snapshot = (instance.__dict__.get('tipo'), instance.__dict__.get('tamano'))
+        return instance
+
     def save(self, *args, **kwargs):
-        # 1. DETECCIÓN DE TIPO CORREGIDA
+        # 1. SUBIDA + INGESTA antes del INSERT
+        # ImageKitStorage decodifica la imagen una sola vez (en el pool) y deja en el
+        # contenido subido la versión optimizada, el LQIP y las dimensiones. Subimos aquí
+        # en lugar de dejarlo al pre_save del FileField para que todo vaya en un único INSERT.
+        if self.archivo and not self.archivo._committed:
+            content = self.archivo.file
+            if self.tamano == 0:
+                self.tamano = getattr(content, 'size', 0) or 0
+            self.archivo.save(self.archivo.name, content, save=False)
+            if self.tamano == 0:
+                # Tamaño confirmado por la respuesta de la subida (sin otra petición a ImageKit)
+                self.tamano = getattr(content, 'uploaded_size', None) or 0
+            self.aplicar_ingesta(getattr(content, 'optimization_stats', None))
+            if not self.file_id:
+                self.file_id = getattr(content, 'imagekit_file_id', None)
+            self.hash_contenido = getattr(content, 'content_hash', None) or self.hash_contenido
+            if getattr(content, 'duplicate_of', None):
+                self.copiar_de_duplicado(content.duplicate_of)
+
+        # 2. DETECCIÓN DE TIPO CORREGIDA
         if self.archivo and not self.tipo:
-            name = str(self.archivo.name).lower()
-            if name.endswith(('.mp4', '.mov', '.avi', '.webm', '.mkv')):
-                self.tipo = 'video'
-            # AQUI EL CAMBIO: Agregamos .webp a la detección de "animaciones"
-            # Esto ayuda a que lógica interna considere que puede moverse
-            elif name.endswith(('.gif', '.webp')):
-                self.tipo = 'gif' 
-            else:
-                self.tipo = 'imagen'
+            self.tipo = tipo_desde_nombre(self.archivo.name)
         
-        if self.archivo and self.tamano == 0:
+        if self.archivo and self.tamano == 0 and self.pk is None:
+            # Último recurso (archivo asignado por nombre, sin subida): metadatos de ImageKit.
+            # ik_api envuelve los errores de red en Exception; FileNotFoundError si no existe.
             try:
-                self.tamano = self.archivo.size
-            except: pass
+                self.tamano = self.archivo.size or 0
+            except Exception as e:
+                print(f"Advertencia: no se pudo obtener el tamaño de {self.archivo.name}: {e}")
+
+        # 3. Metadatos precalculados para las plantillas
+        self.rellenar_metadatos()
 
         super().save(*args, **kwargs)
 
-        # 2. GENERACIÓN DE LQIP (Base64 borroso)
-        # La lógica de Pillow seek(0) funciona para WebP animados también
-        if self.archivo and (self.tipo == 'imagen' or self.tipo == 'gif') and not self.thumbnail_base64:
-            try:
-                if hasattr(self.archivo, 'seek'):
-                    self.archivo.seek(0)
-                
-                img = Image.open(self.archivo)
-                
-                # Aseguramos el primer frame si es animado
-                try:
-                    img.seek(0)
-                except:
-                    pass
-
-                # Convertimos a RGB
-                if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                    img = img.convert('RGB')
-                
-                img.thumbnail((20, 20))
-                
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=60)
-                
-                img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                self.thumbnail_base64 = f"data:image/jpeg;base64,{img_str}"
-                
-                if hasattr(self.archivo, 'seek'):
-                    self.archivo.seek(0)
-                    
-            except Exception as e:
-                print(f"Error generando LQIP para {self.nombre}: {e}")
-                # Si falla, guardar cambio de tipo al menos
-                pass
+    def rellenar_metadatos(self):
+        """Calcula URLs canónicas, mime y bandera de animación a partir del nombre y el tipo."""
+        if not self.archivo:
+            return
+        name = self.archivo.name
+        self.url_completa, self.url_miniatura, self.srcset_miniatura = urls_desde_nombre(name, self.tipo)
+        if not self.mime:
+            self.mime = mime_desde_nombre(name)
+        if animado_desde_nombre(name, self.tipo):
+            self.animado = True
 
-        # Guardamos de nuevo para persistir el thumbnail_base64
-        super().save(*args, **kwargs)
+    def copiar_de_duplicado(self, original_id):
+        """Una subida deduplicada comparte el asset del original: reutiliza sus metadatos."""
+        original = (
+            MediaFile.objects.filter(id=original_id)
+            .values('tamano', 'tamano_original', 'ancho', 'alto', 'thumbnail_base64', 'color_dominante', 'mime', 'duracion', 'animado')
+            .first()
+        )
+        if not original:
+            return
+        for field, value in original.items():
+            if value:
+                setattr(self, field, value)
+
+    def aplicar_ingesta(self, info):
+        """Copia al modelo los resultados de la etapa de ingesta (optimizer.process_image)."""
+        if not info:
+            return
+        self.tamano_original = info['original_size']
+        self.tamano = info.get('final_size', self.tamano)
+        self.optimizacion_cpu_ms = info.get('cpu_ms')
+        self.ancho = info.get('width')
+        self.alto = info.get('height')
+        self.mime = info.get('mime') or self.mime
+        self.animado = bool(info.get('animated'))
+        if info.get('lqip') and not self.thumbnail_base64:
+            self.thumbnail_base64 = info['lqip']
+        if info.get('color') and not self.color_dominante:
+            self.color_dominante = info['color']
 
     def is_image(self): return self.tipo == 'imagen'
     def is_video(self): return self.tipo == 'video'
@@ -142,23 +261,178 @@ class MediaFile(models.Model):
     @property
     def miniatura_url(self):
         """
-        Genera URL optimizada de 200px ESTÁTICA.
-        Usa /ik-thumbnail.jpg para GIFs y WebP animados (extrae el primer frame).
+        URL de la miniatura de 200px ESTÁTICA (columna url_miniatura).
+        Filas aún sin backfill: se calcula al vuelo.
         """
         if not self.archivo:
             return ""
+        return self.url_miniatura or urls_desde_nombre(self.archivo.name, self.tipo)[1]
+
+    @property
+    def completa_url(self):
+        """URL completa (columna url_completa); filas aún sin backfill: se calcula al vuelo."""
+        if not self.archivo:
+            return ""
+        return self.url_completa or urls_desde_nombre(self.archivo.name, self.tipo)[0]
+
+    @property
+    def miniatura_srcset(self):
+        """srcset de la cuadrícula (columna srcset_miniatura), con el mismo respaldo."""
+        if not self.archivo:
+            return ""
+        return self.srcset_miniatura or urls_desde_nombre(self.archivo.name, self.tipo)[2]
+
+    def url_preset(self, preset):
+        """URL de cualquier preset del registro (admin, portadas...)."""
+        static_frame = needs_static_frame(self.archivo.name, self.tipo)
+        return preset_url(self.url_completa or self.archivo.url, preset, static_frame)
+
+class AlbumArchivo(models.Model):
+    """
+    Tabla intermedia de MediaFile.albumes (misma tabla que la automática).
+    Guarda una copia de MediaFile.creado_en para que la cuadrícula de un álbum
+    se pagine por cursor sobre el índice (album, -creado_en, -mediafile) sin
+    unir ni ordenar todos los archivos del álbum.
+    """
+    mediafile = models.ForeignKey(MediaFile, on_delete=models.CASCADE, related_name='enlaces_album')
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='enlaces_archivo')
+    # Se rellena al enlazar (señal m2m_changed / bulk_create); backfill_media_metadata la completa
+    creado_en = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        db_table = 'Gallery_mediafile_albumes'
+        verbose_name = "Archivo del álbum"
+        verbose_name_plural = "Archivos del álbum"
+        constraints = [
+            models.UniqueConstraint(fields=['mediafile', 'album'], name='albumarchivo_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['album', '-creado_en', '-mediafile'], name='album_timeline_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.album_id} <- {self.mediafile_id}"
+
+    def save(self, *args, **kwargs):
+        # Altas sueltas (inlines del admin); .add() usa bulk_create y lo cubre la señal m2m_changed
+        if self.creado_en is None and self.mediafile_id:
+            self.creado_en = MediaFile.objects.filter(pk=self.mediafile_id).values_list('creado_en', flat=True).first()
+        super().save(*args, **kwargs)
+
+
+class SyncState(models.Model):
+    """
+    Estado persistente de la sincronización con ImageKit.
+    Guarda la marca de agua (último updatedAt procesado) para que cada
+    ejecución solo pida a la API los archivos que cambiaron desde entonces.
+    """
+    clave = models.CharField(max_length=50, unique=True, default='imagekit')
+    marca_agua = models.DateTimeField(null=True, blank=True)
+    ultima_completa = models.DateTimeField(null=True, blank=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Estado de sincronización"
+        verbose_name_plural = "Estados de sincronización"
+
+    def __str__(self):
+        return f"{self.clave} ({self.marca_agua or 'sin marca'})"
 
-        url_original = self.archivo.url
-        url_base = url_original.split("?")[0]
-        params = "?tr=w-200,h-200,c-at_max,f-auto,q-70"
 
-        es_webp_animado = str(self.archivo.name).lower().endswith('.webp')
+class SyncJob(models.Model):
+    """
+    Ejecución de la sincronización en segundo plano.
+    Sirve de cola (solo una activa a la vez), de checkpoint para retomar
+    ejecuciones interrumpidas y de fuente para el endpoint de progreso.
+    """
+    EJECUTANDO = 'ejecutando'
+    COMPLETADO = 'completado'
+    ERROR = 'error'
+    ESTADOS = [
+        (EJECUTANDO, 'Ejecutando'),
+        (COMPLETADO, 'Completado'),
+        (ERROR, 'Error'),
+    ]
 
-        if self.is_video():
-            # /ik-thumbnail.jpg extrae frame del video
-            return f"{url_base}/ik-thumbnail.jpg{params}"
-        elif self.is_gif() or es_webp_animado:
-            # /ik-thumbnail.jpg extrae el primer frame del GIF/WebP animado
-            return f"{url_original}/ik-thumbnail.jpg{params}"
-        else:
-            return f"{url_base}{params}"
\ No newline at end of file
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=EJECUTANDO)
+    completo = models.BooleanField(default=False, help_text="Listado completo con limpieza inversa.")
+
+    paginas = models.PositiveIntegerField(default=0)
+    filas = models.PositiveIntegerField(default=0)
+    total_estimado = models.PositiveIntegerField(null=True, blank=True)
+    creados = models.PositiveIntegerField(default=0)
+    enlazados = models.PositiveIntegerField(default=0)
+    eliminados = models.PositiveIntegerField(default=0)
+    reanudaciones = models.PositiveIntegerField(default=0)
+    # Offset (skip) del listado completo hasta el que ya están guardadas las páginas
+    siguiente_skip = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    creado_en = models.DateTimeField(auto_now_add=True)
+    iniciado_en = models.DateTimeField(null=True, blank=True)
+    finalizado_en = models.DateTimeField(null=True, blank=True)
+    # Latido: se actualiza en cada página; si se detiene, el job se considera interrumpido
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Tarea de sincronización"
+        verbose_name_plural = "Tareas de sincronización"
+        ordering = ['-creado_en']
+
+    def __str__(self):
+        return f"Sync #{self.pk} ({self.estado})"
+
+    @property
+    def eta_segundos(self):
+        """Tiempo restante estimado (solo en modo completo, donde hay un total aproximado)."""
+        if self.estado != self.EJECUTANDO or not self.total_estimado or not self.filas or not self.iniciado_en:
+            return None
+        elapsed = (timezone.now() - self.iniciado_en).total_seconds()
+        restantes = max(0, self.total_estimado - self.filas)
+        return round(restantes / (self.filas / max(elapsed, 1e-6)), 1)
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'estado': self.estado,
+            'completo': self.completo,
+            'paginas': self.paginas,
+            'filas': self.filas,
+            'total_estimado': self.total_estimado,
+            'creados': self.creados,
+            'enlazados': self.enlazados,
+            'eliminados': self.eliminados,
+            'reanudaciones': self.reanudaciones,
+            'eta_segundos': self.eta_segundos,
+            'error': self.error,
+            'iniciado_en': self.iniciado_en.isoformat() if self.iniciado_en else None,
+            'finalizado_en': self.finalizado_en.isoformat() if self.finalizado_en else None,
+        }
+
+
+class StorageStats(models.Model):
+    """
+    Contadores de almacenamiento desnormalizados (una sola fila).
+    Se mantienen incrementalmente con señales y desde las operaciones masivas,
+    para que los dashboards no tengan que agregar toda la tabla MediaFile.
+    Reconstruible con `manage.py rebuild_storage_stats`.
+    """
+    clave = models.CharField(max_length=20, unique=True, default='global')
+    bytes_total = models.BigIntegerField(default=0)
+    bytes_imagen = models.BigIntegerField(default=0)
+    bytes_video = models.BigIntegerField(default=0)
+    archivos = models.BigIntegerField(default=0)
+    albumes = models.BigIntegerField(default=0)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    # Generación de la biblioteca: sube con cada escritura en MediaFile/Album.
+    # Es la base de los ETag / Last-Modified y de las claves de la caché de páginas.
+    generacion = models.BigIntegerField(default=1)
+    modificado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Estadísticas de almacenamiento"
+        verbose_name_plural = "Estadísticas de almacenamiento"
+
+    def __str__(self):
+        return f"{self.archivos} archivos, {self.bytes_total} bytes"
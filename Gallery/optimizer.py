@@ -0,0 +1,236 @@
+import base64
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from PIL import Image
+
+# Presupuestos por formato:
+#   seconds -> tiempo máximo que la petición ESPERA al pool antes de subir el original.
+#              Es un límite de espera, no de ejecución: un worker que ya empezó sigue
+#              hasta terminar (ocupando su plaza del pool) y su resultado se descarta.
+#   max_mb  -> memoria estimada del bitmap decodificado (ancho*alto*canales*frames);
+#              si se supera, ni siquiera se intenta (evita picos de cientos de MB en GIFs largos)
+DEFAULT_BUDGETS = {
+    'JPEG': {'seconds': 5, 'max_mb': 256},
+    'PNG': {'seconds': 8, 'max_mb': 256},
+    'WEBP': {'seconds': 10, 'max_mb': 256},
+    'GIF': {'seconds': 10, 'max_mb': 192},
+}
+
+FORMAT_BY_EXT = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.jfif': 'JPEG',
+    '.png': 'PNG',
+    '.webp': 'WEBP',
+    '.gif': 'GIF',
+}
+
+# Lado máximo del placeholder LQIP (blur-up)
+LQIP_SIZE = 20
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_budget(img_format):
+    overrides = getattr(settings, 'GALLERY_OPTIMIZE_BUDGETS', {})
+    return {**DEFAULT_BUDGETS.get(img_format, {'seconds': 5, 'max_mb': 256}), **overrides.get(img_format, {})}
+
+
+def build_placeholder(image):
+    """
+    Placeholder borroso (data URI JPEG de ~20px) y color predominante (#rrggbb)
+    a partir de una imagen ya abierta. Devuelve (lqip, color).
+    La lógica de Pillow seek(0) funciona para WebP animados también.
+    """
+    # Aseguramos el primer frame si es animado
+    try:
+        image.seek(0)
+    except EOFError:
+        pass
+
+    # Convertimos a RGB (JPEG no admite alfa ni paleta)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    else:
+        image = image.copy()
+
+    image.thumbnail((LQIP_SIZE, LQIP_SIZE))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=60)
+    img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return f"data:image/jpeg;base64,{img_str}", dominant_color(image)
+
+
+def dominant_color(image):
+    """Color más frecuente (#rrggbb) de una imagen pequeña, tras reducirla a 4 colores."""
+    rgb = image if image.mode == 'RGB' else image.convert('RGB')
+    quantized = rgb.quantize(colors=4)
+    _, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def process_image(file_content, img_format, max_mb, recompress=True):
+    """
+    Etapa de ingesta de una imagen (se ejecuta dentro del pool de procesos).
+
+    Decodifica UNA sola vez y produce a la vez: la versión recomprimida, el LQIP
+    y las dimensiones. Devuelve (bytes_optimizados | None, info).
+    """
+    cpu_start = time.process_time()
+    info = {'format': img_format, 'original_size': len(file_content), 'skipped': None}
+
+    image = Image.open(io.BytesIO(file_content))
+
+    # Detectar formato (Pillow a veces pierde el formato al abrir desde bytes)
+    img_format = image.format or img_format
+    info['format'] = img_format
+    info['width'], info['height'] = image.size
+    info['mime'] = Image.MIME.get(img_format)
+    info['animated'] = getattr(image, 'is_animated', False)
+
+    # Estimación de memoria antes de decodificar nada (Image.open es perezoso)
+    frames = getattr(image, 'n_frames', 1)
+    bands = len(image.getbands())
+    estimated_mb = image.width * image.height * bands * frames / (1024 ** 2)
+    too_big = estimated_mb > max_mb
+    if too_big:
+        info['skipped'] = f"memoria estimada {estimated_mb:.0f} MB > {max_mb} MB"
+
+    if too_big or not recompress:
+        # Sin recomprimir: para JPEG, draft() decodifica directamente a 1/2..1/8 de
+        # escala con el escalado DCT, así que el LQIP sale casi gratis.
+        if img_format == 'JPEG':
+            image.draft('RGB', (LQIP_SIZE * 4, LQIP_SIZE * 4))
+        if not too_big or img_format == 'JPEG':
+            info['lqip'], info['color'] = build_placeholder(image)
+        info['cpu_ms'] = int((time.process_time() - cpu_start) * 1000)
+        return None, info
+
+    # Configuración de optimización base
+    save_kwargs = {
+        'format': img_format,
+        'optimize': True,
+        'quality': 85
+    }
+
+    # MANEJO ESPECIAL PARA ANIMACIONES (GIF / WEBP)
+    if getattr(image, 'is_animated', False):
+        save_kwargs['save_all'] = True
+        # loop=0 asegura que el GIF se repita infinitamente como el original
+        save_kwargs['loop'] = 0
+
+    # Caso especial: JPG no soporta transparencia (RGBA), convertir a RGB
+    if img_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    output_buffer = io.BytesIO()
+    image.save(output_buffer, **save_kwargs)
+    compressed_content = output_buffer.getvalue()
+
+    # LQIP desde el bitmap ya decodificado (thumbnail() usa reduce() internamente)
+    info['lqip'], info['color'] = build_placeholder(image)
+    info['cpu_ms'] = int((time.process_time() - cpu_start) * 1000)
+
+    # SOLO usamos la versión comprimida si realmente pesa menos
+    if len(compressed_content) >= len(file_content):
+        info['skipped'] = "compresión inefectiva"
+        return None, info
+    return compressed_content, info
+
+
+def read_header(file_content, img_format):
+    """
+    Dimensiones y mime leyendo solo la cabecera (Image.open es perezoso: no decodifica
+    el bitmap). Para cuando no hay tiempo de procesar la imagen.
+    """
+    info = {'format': img_format, 'original_size': len(file_content), 'cpu_ms': None}
+    try:
+        image = Image.open(io.BytesIO(file_content))
+        info['format'] = image.format or img_format
+        info['width'], info['height'] = image.size
+        info['mime'] = Image.MIME.get(info['format'])
+    except Exception as e:
+        print(f"Advertencia: cabecera ilegible ({e})")
+    return info
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = getattr(settings, 'GALLERY_OPTIMIZE_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+                _pool = ProcessPoolExecutor(max_workers=workers)
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def optimize_upload(name, file_content):
+    """
+    Etapa de ingesta/optimización de subidas.
+
+    Según GALLERY_IMAGE_OPTIMIZER:
+      'pool'   (por defecto) -> procesa en un ProcessPoolExecutor y espera como mucho
+                              el presupuesto de tiempo del formato; si se pasa, sube el original
+                              con las dimensiones de la cabecera y sin LQIP (backfill_lqip lo rellena).
+      'inline' -> procesa en el mismo proceso (útil en desarrollo).
+      'off'    -> no recomprime (sí calcula LQIP y dimensiones, en el mismo proceso).
+
+    Devuelve (bytes_a_subir, info | None). info incluye tamaños, ahorro, tiempo de CPU,
+    dimensiones y el LQIP en base64.
+    """
+    img_format = FORMAT_BY_EXT.get(os.path.splitext(name)[1].lower())
+    if not img_format:
+        return file_content, None
+
+    mode = getattr(settings, 'GALLERY_IMAGE_OPTIMIZER', 'pool')
+    budget = get_budget(img_format)
+    wall_start = time.monotonic()
+    try:
+        if mode in ('inline', 'off'):
+            optimized, info = process_image(
+                file_content, img_format, budget['max_mb'], recompress=(mode == 'inline')
+            )
+        else:
+            future = _get_pool().submit(process_image, file_content, img_format, budget['max_mb'])
+            try:
+                optimized, info = future.result(timeout=budget['seconds'])
+            except FutureTimeoutError:
+                # cancel() solo quita la tarea si seguía en cola; si ya corre, el worker
+                # termina por su cuenta y el resultado se ignora
+                future.cancel()
+                # Nada de decodificar aquí (sin draft(), un PNG/GIF se leería entero): solo la
+                # cabecera. El LQIP queda vacío y lo rellena backfill_lqip desde la CDN.
+                optimized, info = None, read_header(file_content, img_format)
+                info['skipped'] = f"superó {budget['seconds']}s de espera"
+    except BrokenProcessPool as e:
+        # Un worker murió (p.ej. OOM): se recrea el pool y se sube el original
+        _reset_pool()
+        print(f"Advertencia optimización {name}: pool reiniciado ({e})")
+        return file_content, None
+    except Exception as e:
+        # Si falla la compresión (ej: archivo corrupto), usamos el original
+        print(f"Advertencia optimización {name}: {e}")
+        return file_content, None
+
+    final_content = optimized if optimized is not None else file_content
+    info['final_size'] = len(final_content)
+    info['saved_bytes'] = len(file_content) - len(final_content)
+    info['wall_ms'] = int((time.monotonic() - wall_start) * 1000)
+    return final_content, info
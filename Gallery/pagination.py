@@ -0,0 +1,122 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+# Elementos por página de la línea de tiempo
+PAGE_SIZE = 60
+
+
+def encode_cursor(obj):
+    """Cursor opaco (base64 url-safe) con la clave de orden (creado_en, id) de un elemento."""
+    raw = json.dumps([obj.creado_en.isoformat(), obj.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Devuelve (creado_en, id) o None si el cursor no es válido."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        creado_en, pk = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        creado_en = parse_datetime(creado_en)
+        if creado_en is None:
+            return None
+        return creado_en, int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def older_than(creado_en, pk, pk_field='id'):
+    """Elementos posteriores en el orden (-creado_en, -id): la "siguiente" página."""
+    return Q(creado_en__lt=creado_en) | Q(creado_en=creado_en, **{f'{pk_field}__lt': pk})
+
+
+def newer_than(creado_en, pk, pk_field='id'):
+    """Elementos anteriores en el orden (-creado_en, -id): la página "previa"."""
+    return Q(creado_en__gt=creado_en) | Q(creado_en=creado_en, **{f'{pk_field}__gt': pk})
+
+
+class KeysetPage:
+    """
+    Página obtenida por búsqueda (seek) sobre el índice (creado_en, id).
+    A diferencia de Paginator no hace COUNT(*) ni OFFSET: el coste es el mismo
+    en la página 1 que en la 1000. Expone la interfaz que usan las plantillas
+    (has_next, has_previous, has_other_pages) más los cursores.
+    """
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next_page else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous_page else None
+
+
+def paginate_keyset(queryset, after=None, before=None, per_page=PAGE_SIZE):
+    """
+    Pagina `queryset` en orden (-creado_en, -id).
+    `after` / `before` son cursores opacos (ver encode_cursor).
+    """
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+
+    if before_key:
+        # Hacia atrás: se recorre en orden ascendente y se invierte
+        rows = list(
+            queryset.filter(newer_than(*before_key))
+            .order_by('creado_en', 'id')[:per_page + 1]
+        )
+        if rows:
+            has_previous = len(rows) > per_page
+            rows = rows[:per_page]
+            rows.reverse()
+            return KeysetPage(rows, has_next=True, has_previous=has_previous)
+        # Nada más reciente que el cursor: se sirve la primera página
+
+    if after_key:
+        queryset = queryset.filter(older_than(*after_key))
+
+    rows = list(queryset.order_by('-creado_en', '-id')[:per_page + 1])
+    has_next = len(rows) > per_page
+    return KeysetPage(rows[:per_page], has_next=has_next, has_previous=bool(after_key))
+
+
+def neighbours(queryset, obj, prefetch=0):
+    """
+    Vecinos de `obj` en el orden (creado_en, id) con dos búsquedas indexadas.
+    Devuelve (mas_recientes, mas_antiguos): listas de hasta 1 + prefetch elementos,
+    ordenadas desde el más cercano a `obj`.
+    """
+    key = (obj.creado_en, obj.id)
+    fields = ('id', 'archivo', 'tipo', 'creado_en', 'url_completa', 'url_miniatura')
+    newer = list(
+        queryset.filter(newer_than(*key)).only(*fields).order_by('creado_en', 'id')[:1 + prefetch]
+    )
+    older = list(
+        queryset.filter(older_than(*key)).only(*fields).order_by('-creado_en', '-id')[:1 + prefetch]
+    )
+    return newer, older
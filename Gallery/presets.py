@@ -0,0 +1,92 @@
+import hashlib
+import hmac
+import time
+
+from django.conf import settings
+
+# Registro central de transformaciones de ImageKit. Todas las URLs de imágenes
+# derivadas salen de aquí: mismas cadenas `tr` en todas partes => mismas claves
+# en la CDN y en la caché del service worker.
+PRESETS = {
+    'grid': {'width': 200, 'tr': 'w-200,h-200,c-at_max,f-auto,q-70'},
+    'grid@2x': {'width': 400, 'tr': 'w-400,h-400,c-at_max,f-auto,q-60'},
+    'album-cover': {'width': 400, 'tr': 'w-400,h-300,fo-auto,f-auto,q-70'},
+    'admin-list': {'width': 50, 'tr': 'w-50,h-50,fo-auto,f-auto,q-70'},
+    'admin-detail': {'width': 300, 'tr': 'w-300,h-300,fo-auto,f-auto,q-80'},
+    'viewer-800': {'width': 800, 'tr': 'w-800,f-auto,q-80'},
+    'viewer-1200': {'width': 1200, 'tr': 'w-1200,f-auto,q-80'},
+    'viewer': {'width': 1600, 'tr': 'w-1600,f-auto,q-80'},
+    # Origen del LQIP de backfill_lqip: JPEG fijo (Pillow lo decodifica siempre)
+    'lqip': {'width': 20, 'tr': 'w-20,h-20,c-at_max,f-jpg,q-50'},
+}
+
+GRID_SRCSET = ('grid', 'grid@2x')
+VIEWER_SRCSET = ('viewer-800', 'viewer-1200', 'viewer')
+
+# Ancho real de una celda: 3 columnas en móvil, ~200-260px en escritorio
+GRID_SIZES = '(max-width: 768px) 33vw, 260px'
+
+
+def needs_static_frame(name, tipo):
+    """Videos, GIF y WebP: la miniatura sale del primer frame (/ik-thumbnail.jpg)."""
+    return tipo in ('video', 'gif') or str(name).lower().endswith('.webp')
+
+
+def preset_url(full_url, preset, static_frame=False):
+    if not full_url:
+        return ''
+    base = full_url.split('?', 1)[0]
+    if static_frame:
+        base = f"{base}/ik-thumbnail.jpg"
+    return f"{base}?tr={PRESETS[preset]['tr']}"
+
+
+def preset_srcset(full_url, presets, static_frame=False):
+    """Atributo srcset ('url 200w, url 400w') para una lista de presets."""
+    if not full_url:
+        return ''
+    return ', '.join(
+        f"{preset_url(full_url, name, static_frame)} {PRESETS[name]['width']}w" for name in presets
+    )
+
+
+def viewer_transforms():
+    """{ancho: tr} de los presets del visor, para que el JS elija sin inventar anchos."""
+    return {PRESETS[name]['width']: PRESETS[name]['tr'] for name in VIEWER_SRCSET}
+
+
+# --- URLs firmadas (opcional: GALLERY_SIGNED_URLS = True) ---
+
+def _signature_expiry():
+    # La expiración se redondea a un intervalo fijo: la URL firmada no cambia en cada
+    # render y la CDN/el navegador pueden seguir reutilizándola hasta el siguiente tramo.
+    ttl = getattr(settings, 'GALLERY_SIGNED_URL_TTL', 7 * 24 * 3600)
+    now = int(time.time())
+    return (now // ttl + 2) * ttl
+
+
+def sign_url(url):
+    """Firma una URL de ImageKit (ik-t / ik-s) si las URLs firmadas están activadas."""
+    if not url or not getattr(settings, 'GALLERY_SIGNED_URLS', False):
+        return url
+    endpoint = settings.IMAGEKIT_URL_ENDPOINT.rstrip('/') + '/'
+    if not url.startswith(endpoint):
+        return url
+    expiry = _signature_expiry()
+    signature = hmac.new(
+        settings.IMAGEKIT_PRIVATE_KEY.encode('utf-8'),
+        (url[len(endpoint):] + str(expiry)).encode('utf-8'),
+        hashlib.sha1,
+    ).hexdigest()
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}ik-t={expiry}&ik-s={signature}"
+
+
+def sign_srcset(srcset):
+    if not srcset or not getattr(settings, 'GALLERY_SIGNED_URLS', False):
+        return srcset
+    parts = []
+    for candidate in srcset.split(', '):
+        url, _, descriptor = candidate.rpartition(' ')
+        parts.append(f"{sign_url(url)} {descriptor}")
+    return ', '.join(parts)
@@ -0,0 +1,258 @@
+import calendar
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+# Índice de búsqueda: SQLite FTS5 en un archivo aparte (sidecar), mantenido
+# incrementalmente desde las señales de MediaFile/Album y reconstruible con
+# `manage.py rebuild_search_index`. La BD principal (MySQL) solo recibe el
+# filtro final por id y/o rango de fechas.
+
+MESES = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+    'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
+}
+NOMBRE_MES = {num: nombre for nombre, num in MESES.items() if nombre != 'setiembre'}
+
+# Sinónimos que se indexan junto al tipo para que "foto" o "vídeo" encuentren resultados
+TIPO_SINONIMOS = {
+    'imagen': 'imagen foto',
+    'gif': 'gif animado animacion',
+    'video': 'video',
+}
+
+# Máximo de coincidencias que se trasladan a la consulta de la línea de tiempo
+# (el borrado por búsqueda no tiene tope: usa limit=None)
+MAX_MATCHES = 5000
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+_unbuilt_warned = set()
+
+
+def _index_path():
+    return str(getattr(settings, 'GALLERY_SEARCH_INDEX_PATH', settings.BASE_DIR / 'data' / 'search_index.sqlite3'))
+
+
+def _connection():
+    """Una conexión SQLite por hilo (WAL: lectores concurrentes mientras se escribe)."""
+    path = _index_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != path:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn, _local.path = conn, path
+    if path not in _schema_ready:
+        with _schema_lock:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5("
+                "nombre, albumes, tipo, fecha, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            # Marca de "índice completo": la pone rebuild_search_index al terminar
+            conn.execute("CREATE TABLE IF NOT EXISTS media_fts_estado (clave TEXT PRIMARY KEY, valor TEXT)")
+            conn.commit()
+            _schema_ready.add(path)
+    return conn
+
+
+# --- Indexación ---
+
+def _document(media, album_texts):
+    fecha = timezone.localtime(media.creado_en) if media.creado_en else None
+    nombre = ' '.join(filter(None, [media.nombre, str(media.archivo.name or '').rsplit('/', 1)[-1]]))
+    return (
+        media.id,
+        nombre,
+        ' '.join(album_texts),
+        TIPO_SINONIMOS.get(media.tipo, media.tipo or ''),
+        f"{NOMBRE_MES[fecha.month]} {fecha.year}" if fecha else '',
+    )
+
+
+def index_media(queryset, batch_size=1000):
+    """(Re)indexa los MediaFile del queryset. Devuelve cuántos se indexaron."""
+    from .models import MediaFile
+
+    conn = _connection()
+    through = MediaFile.albumes.through
+    total = 0
+    batch = []
+
+    def flush(batch):
+        ids = [media.id for media in batch]
+        albums = {}
+        rows = (
+            through.objects.filter(mediafile_id__in=ids)
+            .values_list('mediafile_id', 'album__nombre', 'album__descripcion')
+        )
+        for media_id, nombre, descripcion in rows:
+            albums.setdefault(media_id, []).extend(filter(None, [nombre, descripcion]))
+
+        docs = [_document(media, albums.get(media.id, [])) for media in batch]
+        conn.executemany('DELETE FROM media_fts WHERE rowid = ?', [(i,) for i in ids])
+        conn.executemany(
+            'INSERT INTO media_fts (rowid, nombre, albumes, tipo, fecha) VALUES (?, ?, ?, ?, ?)', docs
+        )
+        conn.commit()
+
+    fields = ('id', 'nombre', 'archivo', 'tipo', 'creado_en')
+    for media in queryset.only(*fields).order_by().iterator(chunk_size=batch_size):
+        batch.append(media)
+        if len(batch) >= batch_size:
+            flush(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        total += len(batch)
+    return total
+
+
+def remove_ids(ids):
+    conn = _connection()
+    conn.executemany('DELETE FROM media_fts WHERE rowid = ?', [(i,) for i in ids])
+    conn.commit()
+
+
+def clear_index():
+    """Vacía el índice y lo marca como incompleto hasta el siguiente mark_built()."""
+    conn = _connection()
+    conn.execute('DELETE FROM media_fts')
+    conn.execute("DELETE FROM media_fts_estado WHERE clave = 'construido'")
+    conn.commit()
+
+
+def mark_built():
+    """Marca el índice como completo (tras indexar toda la biblioteca)."""
+    conn = _connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO media_fts_estado (clave, valor) VALUES ('construido', ?)",
+        (timezone.now().isoformat(),),
+    )
+    conn.commit()
+
+
+def index_built():
+    """
+    True si el índice se ha construido entero. Tras actualizar (o si se borra el
+    archivo) solo tiene lo indexado por las señales: el buscador usa el LIKE.
+    """
+    try:
+        row = _connection().execute("SELECT 1 FROM media_fts_estado WHERE clave = 'construido'").fetchone()
+    except sqlite3.Error as e:
+        print(f"Índice de búsqueda no disponible: {e}")
+        return False
+    return row is not None
+
+
+# --- Consultas ---
+
+def _month_range(year, month):
+    start = datetime(year, month, 1)
+    days = calendar.monthrange(year, month)[1]
+    return start, start + timedelta(days=days)
+
+
+def parse_query(query):
+    """
+    Separa del texto las expresiones de fecha. Reconoce:
+      25/12/2023, 2023-12-25, 2023-12, "diciembre 2023", "diciembre de 2023" y 2023.
+    Devuelve (texto_restante, (inicio, fin) | None) con fechas conscientes de zona horaria.
+    """
+    text = f" {query.lower()} "
+    date_range = None
+
+    patterns = [
+        (r'\s(\d{1,2})/(\d{1,2})/(\d{4})\s', lambda d, m, y: (datetime(int(y), int(m), int(d)), 1)),
+        (r'\s(\d{4})-(\d{1,2})-(\d{1,2})\s', lambda y, m, d: (datetime(int(y), int(m), int(d)), 1)),
+        (r'\s(\d{4})-(\d{1,2})\s', lambda y, m: _month_range(int(y), int(m))),
+        (r'\s(' + '|'.join(MESES) + r')\s+(?:de\s+)?(\d{4})\s', lambda mes, y: _month_range(int(y), MESES[mes])),
+        (r'\s((?:19|20)\d{2})\s', lambda y: (datetime(int(y), 1, 1), datetime(int(y) + 1, 1, 1))),
+    ]
+    for pattern, build in patterns:
+        match = re.search(pattern, text)
+        if not match:
+            continue
+        try:
+            start, end = build(*match.groups())
+        except ValueError:
+            continue
+        if isinstance(end, int):
+            end = start + timedelta(days=end)
+        tz = timezone.get_current_timezone()
+        date_range = (timezone.make_aware(start, tz), timezone.make_aware(end, tz))
+        text = text[:match.start()] + ' ' + text[match.end():]
+        break
+
+    return ' '.join(text.split()), date_range
+
+
+def _fts_expression(text):
+    """Cada palabra como prefijo entre comillas ("pla"* encuentra "playa"): typeahead seguro."""
+    terms = re.findall(r'\w+', text)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_matches(text, limit=MAX_MATCHES):
+    """
+    Ids de MediaFile que coinciden con `text`, ordenados por relevancia (bm25;
+    el nombre pesa más que los álbumes), y si se han recortado a `limit`
+    (None = todos). Devuelve (None, False) si el índice no está disponible o
+    aún no se ha construido.
+    """
+    expression = _fts_expression(text)
+    if not expression:
+        return [], False
+    if not index_built():
+        path = _index_path()
+        if path not in _unbuilt_warned:
+            # Una vez por proceso, no en cada búsqueda
+            _unbuilt_warned.add(path)
+            print("Índice de búsqueda sin construir: se busca por nombre (rebuild_search_index)")
+        return None, False
+    try:
+        rows = _connection().execute(
+            'SELECT rowid FROM media_fts WHERE media_fts MATCH ? '
+            'ORDER BY bm25(media_fts, 10.0, 4.0, 1.0, 2.0) LIMIT ?',
+            (expression, -1 if limit is None else limit + 1),
+        ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Índice de búsqueda no disponible: {e}")
+        return None, False
+    truncated = limit is not None and len(rows) > limit
+    return [row[0] for row in rows[:limit]], truncated
+
+
+def search_ids(text, limit=MAX_MATCHES):
+    """Ids que coinciden con `text` (como search_matches, sin el aviso de recorte)."""
+    return search_matches(text, limit)[0]
+
+
+def apply_search(queryset, query, limit=MAX_MATCHES):
+    """
+    Aplica la búsqueda del usuario a un queryset de MediaFile: rango de fechas en la BD
+    y texto vía FTS. Si el índice falla o está sin construir, recurre al LIKE por nombre
+    de siempre. Devuelve (queryset, recortado): recortado indica que el texto coincide
+    con más de `limit` archivos y solo se han trasladado los `limit` más relevantes.
+    """
+    text, date_range = parse_query(query)
+    truncated = False
+    if date_range:
+        queryset = queryset.filter(creado_en__gte=date_range[0], creado_en__lt=date_range[1])
+    if text:
+        ids, truncated = search_matches(text, limit)
+        if ids is None:
+            queryset = queryset.filter(nombre__icontains=text)
+        else:
+            queryset = queryset.filter(id__in=ids)
+    return queryset, truncated
+
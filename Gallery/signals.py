@@ -0,0 +1,199 @@
+import sqlite3
+
+from django.core.exceptions import ValidationError
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import search
+from .albums import crea_ciclo, rellenar_fechas_enlaces
+from .generation import bump_generation
+from .models import Album, AlbumArchivo, MediaFile
+from .stats import apply_delta, delta_from_rows, empty_delta, merge_deltas, signals_active
+from .timeline import invalidate_month
+
+
+@receiver(post_save, sender=MediaFile)
+def mediafile_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or not signals_active():
+        return
+
+    current = (instance.tipo, instance.tamano)
+    if created:
+        # Subida deduplicada: el asset (y sus bytes) ya estaba contado con el original
+        shared = instance.file_id and MediaFile.objects.filter(file_id=instance.file_id).exclude(pk=instance.pk).exists()
+        apply_delta(delta_from_rows([(instance.tipo, 0 if shared else instance.tamano)]))
+    else:
+        previous = getattr(instance, '_stats_snapshot', None)
+        # Sin foto completa (campos diferidos) no se puede calcular el delta
+        if previous and None not in previous and previous != current:
+            apply_delta(merge_deltas(
+                delta_from_rows([previous], sign=-1),
+                delta_from_rows([current]),
+            ))
+    instance._stats_snapshot = current
+    invalidate_month(instance.creado_en)
+
+
+def _bytes_liberados(instance, origin):
+    """Un asset compartido (deduplicado) solo libera sus bytes al borrar su última fila."""
+    if not instance.file_id:
+        return instance.tamano
+    if MediaFile.objects.filter(file_id=instance.file_id).exists():
+        return 0
+    # Varias filas del mismo asset borradas en la misma operación: se descuenta una vez
+    liberados = getattr(origin, '_assets_liberados', None)
+    if liberados is None:
+        liberados = set()
+        try:
+            origin._assets_liberados = liberados
+        except AttributeError:
+            pass
+    if instance.file_id in liberados:
+        return 0
+    liberados.add(instance.file_id)
+    return instance.tamano
+
+
+@receiver(post_delete, sender=MediaFile)
+def mediafile_deleted(sender, instance, origin=None, **kwargs):
+    if signals_active():
+        apply_delta(delta_from_rows([(instance.tipo, _bytes_liberados(instance, origin))], sign=-1))
+        invalidate_month(instance.creado_en)
+
+
+@receiver(post_save, sender=Album)
+def album_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and signals_active():
+        apply_delta({**empty_delta(), 'albumes': 1})
+
+
+@receiver(post_delete, sender=Album)
+def album_deleted(sender, instance, **kwargs):
+    if signals_active():
+        apply_delta({**empty_delta(), 'albumes': -1})
+
+
+# --- Índice de búsqueda (las rutas masivas lo actualizan por su cuenta) ---
+
+def _reindex(ids):
+    try:
+        if ids:
+            search.index_media(MediaFile.objects.filter(pk__in=list(ids)))
+    except sqlite3.Error as e:
+        print(f"No se pudo actualizar el índice de búsqueda: {e}")
+
+
+def _unindex(ids):
+    try:
+        search.remove_ids(ids)
+    except sqlite3.Error as e:
+        print(f"No se pudo actualizar el índice de búsqueda: {e}")
+
+
+@receiver(post_save, sender=MediaFile)
+def mediafile_search_saved(sender, instance, raw=False, **kwargs):
+    if not raw and signals_active():
+        _reindex([instance.pk])
+
+
+@receiver(post_delete, sender=MediaFile)
+def mediafile_search_deleted(sender, instance, **kwargs):
+    if signals_active():
+        _unindex([instance.pk])
+
+
+@receiver(post_save, sender=Album)
+def album_search_saved(sender, instance, created, raw=False, **kwargs):
+    # Un álbum nuevo aún no tiene archivos; uno renombrado cambia el texto de todos
+    if not created and not raw and signals_active():
+        _reindex(instance.archivos.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Album)
+def album_search_deleting(sender, instance, **kwargs):
+    instance._search_ids = list(instance.archivos.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Album)
+def album_search_deleted(sender, instance, **kwargs):
+    if signals_active():
+        _reindex(getattr(instance, '_search_ids', None))
+
+
+@receiver(m2m_changed, sender=MediaFile.albumes.through)
+def albumes_search_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not signals_active():
+        return
+    if reverse:
+        # instance es un Album; pk_set son archivos (None en clear)
+        if action == 'pre_clear':
+            instance._search_ids = list(instance.archivos.values_list('id', flat=True))
+        elif action in ('post_add', 'post_remove'):
+            _reindex(pk_set)
+        elif action == 'post_clear':
+            _reindex(getattr(instance, '_search_ids', None))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        _reindex([instance.pk])
+
+
+# --- Generación de la biblioteca (ETag / caché de páginas) ---
+
+@receiver(post_save, sender=MediaFile)
+@receiver(post_delete, sender=MediaFile)
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+def library_changed(sender, raw=False, **kwargs):
+    if not raw and signals_active():
+        bump_generation()
+
+
+@receiver(m2m_changed, sender=MediaFile.albumes.through)
+@receiver(m2m_changed, sender=Album.subalbumes.through)
+def library_links_changed(sender, action, **kwargs):
+    if action.startswith('post_') and signals_active():
+        bump_generation()
+
+
+# --- Enlaces editados como filas (inline del admin): no pasan por m2m_changed ---
+
+@receiver(post_save, sender=AlbumArchivo)
+def album_link_saved(sender, instance, raw=False, **kwargs):
+    # add() de la relación usa bulk_create (sin post_save) y ya lo cubre m2m_changed
+    if not raw and signals_active():
+        _reindex([instance.mediafile_id])
+        bump_generation()
+
+
+@receiver(post_delete, sender=AlbumArchivo)
+def album_link_deleted(sender, instance, origin=None, **kwargs):
+    # Solo el borrado de un enlace concreto: remove()/clear() los notifica m2m_changed y
+    # las cascadas de MediaFile/Album sus propias señales (sin trabajo por fila aquí)
+    if isinstance(origin, AlbumArchivo) and signals_active():
+        _reindex([instance.mediafile_id])
+        bump_generation()
+
+
+# --- Enlaces archivo-álbum: fecha copiada para paginar el álbum por índice ---
+
+@receiver(m2m_changed, sender=MediaFile.albumes.through)
+def album_links_dated(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        enlaces = AlbumArchivo.objects.filter(album_id=instance.pk, mediafile_id__in=pk_set)
+    else:
+        enlaces = AlbumArchivo.objects.filter(mediafile_id=instance.pk, album_id__in=pk_set)
+    rellenar_fechas_enlaces(enlaces)
+
+
+# --- Árbol de álbumes: subalbumes no puede cerrar ciclos ---
+
+@receiver(m2m_changed, sender=Album.subalbumes.through)
+def subalbumes_cycle_guard(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'pre_add' or not pk_set:
+        return
+    # Directo: instance contiene a pk_set. Inverso (contenedor_de): pk_set contiene a instance.
+    pares = [(pk, instance.pk) for pk in pk_set] if reverse else [(instance.pk, pk) for pk in pk_set]
+    for padre_id, hijo_id in pares:
+        if crea_ciclo(padre_id, hijo_id):
+            raise ValidationError("Un álbum no puede contener a sí mismo ni a uno de sus ancestros.")
@@ -38,15 +38,19 @@ btnAddToAlbum.addEventListener('click', () => {
 });
 
 // --- OPTIMIZACIÓN 1: URLs INTELIGENTES ---
+// Solo los anchos del registro de presets del visor (VIEWER_TRANSFORMS): pocas variantes
+// por imagen => más aciertos en la CDN y la misma URL que en la vista de detalle.
+function viewerTransform() {
+    const widths = Object.keys(VIEWER_TRANSFORMS).map(Number).sort((a, b) => a - b);
+    const needed = window.innerWidth * Math.min(window.devicePixelRatio || 1, 2);
+    const width = widths.find(w => w >= needed) || widths[widths.length - 1];
+    return VIEWER_TRANSFORMS[width];
+}
+
 function getOptimizedUrl(fullUrl, isVideo = false) {
     const separator = fullUrl.includes('?') ? '&' : '?';
     if (isVideo) return `${fullUrl}${separator}tr=orig-true`;
-    
-    // Limitar a 1600px máximo — suficiente para cualquier pantalla
-    // y usar calidad 80 fija para consistencia de caché
-    const width = Math.min(window.innerWidth, 1600);
-    const roundedWidth = Math.ceil(width / 200) * 200; 
-    return `${fullUrl}${separator}tr=w-${roundedWidth},f-auto,q-80`; 
+    return `${fullUrl}${separator}tr=${viewerTransform()}`;
 }
 
 // --- FUNCIÓN PRINCIPAL: ABRIR MODAL ---
@@ -230,9 +234,11 @@ function updateProgressBar(percent, text) {
 }
 
 // --- EVENTOS DE NAVEGACIÓN ---
-mediaItems.forEach((item, index) => {
-    item.addEventListener('click', () => openModal(index));
-});
+// El índice se resuelve al hacer click: el array crece con el scroll infinito y encoge al borrar
+function bindMediaItem(item) {
+    item.addEventListener('click', () => openModal(mediaItems.indexOf(item)));
+}
+mediaItems.forEach(bindMediaItem);
 
 function nextImage() { openModal(currentIndex + 1); }
 function prevImage() { openModal(currentIndex - 1); }
@@ -334,4 +340,216 @@ document.addEventListener('keydown', (e) => {
 
 if ('serviceWorker' in navigator) {
     window.addEventListener('load', () => navigator.serviceWorker.register('/sw.js').catch(console.error));
-}
\ No newline at end of file
+}
+
+// --- SCROLL INFINITO (paginación por cursor) ---
+(function () {
+    const sentinel = document.getElementById('timelineSentinel');
+    if (!sentinel || !('IntersectionObserver' in window)) return;
+
+    let nextCursor = sentinel.dataset.nextCursor;
+    let loading = false;
+
+    // Totales por mes de la barra de meses (agregados en la BD)
+    const scrubber = document.getElementById('timelineScrubber');
+    const monthCounts = {};
+    if (scrubber) {
+        scrubber.querySelectorAll('[data-month]').forEach(link => {
+            monthCounts[link.dataset.month] = Number(link.dataset.count);
+        });
+    }
+
+    // Con JS activo, el scroll infinito sustituye a los botones de paginación
+    const pager = document.getElementById('timelinePager');
+    if (pager && !new URLSearchParams(window.location.search).has('before')) pager.remove();
+
+    function buildItem(data) {
+        const item = document.createElement('div');
+        item.className = 'photo-item open-media';
+        item.dataset.fullUrl = data.full_url;
+        item.dataset.id = data.id;
+        if (data.color) item.style.backgroundColor = data.color;
+
+        const img = document.createElement('img');
+        img.alt = 'Media';
+        img.decoding = 'async';
+        img.sizes = sentinel.dataset.sizes;
+        if (data.lqip) {
+            img.src = data.lqip;
+            img.dataset.src = data.thumb_url;
+            if (data.thumb_srcset) img.dataset.srcset = data.thumb_srcset;
+            img.className = 'blur-up';
+        } else {
+            if (data.thumb_srcset) img.srcset = data.thumb_srcset;
+            img.src = data.thumb_url;
+            img.loading = 'lazy';
+        }
+        item.appendChild(img);
+
+        if (data.is_video) {
+            item.insertAdjacentHTML('beforeend',
+                '<div class="position-absolute top-0 end-0 m-2 text-white" style="text-shadow: 0 1px 2px black;">' +
+                '<i class="fas fa-play-circle fs-5"></i></div>');
+        }
+        if (data.is_gif) {
+            item.insertAdjacentHTML('beforeend',
+                '<div class="position-absolute top-0 end-0 m-2">' +
+                '<span class="badge bg-dark border border-secondary" style="font-size: 9px;">GIF</span></div>');
+        }
+        return item;
+    }
+
+    function gridForMonth(key, label) {
+        const groups = document.querySelectorAll('.timeline-group');
+        const last = groups[groups.length - 1];
+        if (last && last.dataset.month === key) return last.querySelector('.photo-grid');
+
+        // Nuevo mes: nueva cabecera antes del sentinel
+        const group = document.createElement('div');
+        group.className = 'timeline-group fade-in-up';
+        group.dataset.month = key;
+        group.id = `mes-${key}`;
+        const header = document.createElement('div');
+        header.className = 'date-header';
+        const span = document.createElement('span');
+        span.textContent = label;
+        header.appendChild(span);
+        const count = monthCounts[key];
+        if (count) {
+            const badge = document.createElement('span');
+            badge.className = 'date-header__count';
+            badge.textContent = `${count} elemento${count === 1 ? '' : 's'}`;
+            header.appendChild(badge);
+        }
+        const grid = document.createElement('div');
+        grid.className = 'photo-grid';
+        group.appendChild(header);
+        group.appendChild(grid);
+        sentinel.parentNode.insertBefore(group, sentinel);
+        return grid;
+    }
+
+    function appendItems(items) {
+        items.forEach(itemData => {
+            const item = buildItem(itemData);
+            gridForMonth(itemData.month_key, itemData.month).appendChild(item);
+            mediaItems.push(item);
+            bindMediaItem(item);
+            const img = item.querySelector('img');
+            if (window.GalleryLazyLoad) window.GalleryLazyLoad.observe(img);
+        });
+    }
+
+    // Página siguiente ya descargada en un momento ocioso (ver precacheNextPage)
+    let prefetched = null;
+
+    function fetchPage(cursor) {
+        if (prefetched && prefetched.cursor === cursor) return prefetched.promise;
+        const params = new URLSearchParams({ after: cursor });
+        if (sentinel.dataset.query) params.set('q', sentinel.dataset.query);
+        return fetch(`${sentinel.dataset.apiUrl}?${params}`, { headers: { 'Accept': 'application/json' } })
+            .then(r => r.json());
+    }
+
+    // Candidato del srcset que el navegador elegirá para esta pantalla (200w o 400w)
+    function thumbForScreen(item) {
+        if (!item.thumb_srcset || (window.devicePixelRatio || 1) < 1.5) return item.thumb_url;
+        const candidates = item.thumb_srcset.split(', ');
+        return candidates[candidates.length - 1].split(' ')[0];
+    }
+
+    // Con el dispositivo ocioso: se descarga el JSON de la página siguiente y el
+    // service worker guarda sus miniaturas, así el próximo scroll sale de caché.
+    function precacheNextPage() {
+        const connection = navigator.connection || {};
+        if (!nextCursor || connection.saveData || /2g/.test(connection.effectiveType || '')) return;
+        if (!navigator.serviceWorker || !navigator.serviceWorker.controller) return;
+
+        const cursor = nextCursor;
+        const idle = window.requestIdleCallback || ((cb) => setTimeout(cb, 1000));
+        idle(() => {
+            if (cursor !== nextCursor || (prefetched && prefetched.cursor === cursor)) return;
+            const promise = fetchPage(cursor);
+            prefetched = { cursor, promise };
+            promise.then(data => {
+                navigator.serviceWorker.controller.postMessage({
+                    type: 'precache',
+                    urls: data.items.map(thumbForScreen).filter(Boolean),
+                });
+            }).catch(() => { prefetched = null; });
+        });
+    }
+
+    function loadMore() {
+        if (loading || !nextCursor) return;
+        loading = true;
+
+        fetchPage(nextCursor)
+            .then(data => {
+                prefetched = null;
+                appendItems(data.items);
+                nextCursor = data.next_cursor;
+                if (!nextCursor) observer.disconnect();
+                precacheNextPage();
+            })
+            .catch(console.error)
+            .finally(() => { loading = false; });
+    }
+
+    // Salto a un mes: si ya está en la página se hace scroll; si no, se piden solo
+    // los primeros elementos de ese mes y el scroll infinito continúa desde ahí.
+    function jumpToMonth(link) {
+        const key = link.dataset.month;
+        const existing = document.getElementById(`mes-${key}`);
+        if (existing) {
+            existing.scrollIntoView({ behavior: 'smooth', block: 'start' });
+            return;
+        }
+
+        const params = new URLSearchParams();
+        if (sentinel.dataset.query) params.set('q', sentinel.dataset.query);
+        const url = scrubber.dataset.apiUrl.replace('0000-00', key);
+
+        loading = true;
+        fetch(`${url}?${params}`, { headers: { 'Accept': 'application/json' } })
+            .then(r => r.json())
+            .then(data => {
+                document.querySelectorAll('.timeline-group').forEach(group => group.remove());
+                const pager = document.getElementById('timelinePager');
+                if (pager) pager.remove();
+                mediaItems.length = 0;
+                appendItems(data.items);
+                nextCursor = data.next_cursor;
+                prefetched = null;
+                observer.observe(sentinel);
+                precacheNextPage();
+
+                const state = new URLSearchParams(window.location.search);
+                state.delete('after');
+                state.delete('before');
+                state.delete('page');
+                state.set('mes', key);
+                history.replaceState(null, '', `?${state}`);
+                window.scrollTo({ top: 0 });
+            })
+            .catch(() => { window.location.href = link.href; })
+            .finally(() => { loading = false; });
+    }
+
+    if (scrubber) {
+        scrubber.addEventListener('click', e => {
+            const link = e.target.closest('[data-month]');
+            if (!link) return;
+            e.preventDefault();
+            scrubber.querySelectorAll('.is-active').forEach(el => el.classList.remove('is-active'));
+            link.classList.add('is-active');
+            jumpToMonth(link);
+        });
+    }
+
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) loadMore();
+    }, { rootMargin: '800px 0px' });
+    observer.observe(sentinel);
+    window.addEventListener('load', precacheNextPage);
+})();
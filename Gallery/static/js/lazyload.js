@@ -6,22 +6,26 @@
     const ROOT_MARGIN = '400px 0px';
 
     /**
-     * Intercambia el LQIP (src actual) por la imagen de alta calidad (data-src).
+     * Intercambia el LQIP (src actual) por la imagen de alta calidad (data-src / data-srcset).
      * Usa un Image() auxiliar para esperar a que la HQ esté lista antes de mostrarla,
-     * evitando el parpadeo del placeholder al swappear.
+     * evitando el parpadeo del placeholder al swappear. Con srcset, el auxiliar recibe
+     * los mismos sizes para que el navegador elija (y descargue) el mismo candidato.
      */
     function loadImage(img) {
         const hqSrc = img.dataset.src;
         if (!hqSrc) return;
+        const hqSrcset = img.dataset.srcset;
 
         const loader = new Image();
 
         loader.onload = function () {
+            if (hqSrcset) img.srcset = hqSrcset;
             img.src = hqSrc;
             // Transición suave: quitar blur
             img.classList.add('loaded');
             img.classList.remove('blur-up');
             delete img.dataset.src;
+            delete img.dataset.srcset;
         };
 
         loader.onerror = function () {
@@ -30,15 +34,32 @@
             delete img.dataset.src;
         };
 
+        if (hqSrcset) {
+            loader.sizes = img.sizes;
+            loader.srcset = hqSrcset;
+        }
         loader.src = hqSrc;
     }
 
-    function init() {
-        const targets = Array.from(document.querySelectorAll('img.blur-up[data-src]'));
-        if (!targets.length) return;
+    let io = null;
+
+    /**
+     * Registra una imagen blur-up para carga diferida.
+     * Expuesta en window.GalleryLazyLoad para las tarjetas que llegan por scroll infinito.
+     */
+    function observe(img) {
+        if (!img.dataset.src) return;
+        if (io) {
+            io.observe(img);
+        } else {
+            // Fallback para navegadores sin IntersectionObserver
+            loadImage(img);
+        }
+    }
 
+    function init() {
         if ('IntersectionObserver' in window) {
-            const io = new IntersectionObserver(function (entries, observer) {
+            io = new IntersectionObserver(function (entries, observer) {
                 entries.forEach(function (entry) {
                     if (entry.isIntersecting) {
                         loadImage(entry.target);
@@ -46,15 +67,13 @@
                     }
                 });
             }, { rootMargin: ROOT_MARGIN });
-
-            targets.forEach(function (img) { io.observe(img); });
-
-        } else {
-            // Fallback para navegadores sin IntersectionObserver
-            targets.forEach(loadImage);
         }
+
+        document.querySelectorAll('img.blur-up[data-src]').forEach(observe);
     }
 
+    window.GalleryLazyLoad = { observe: observe };
+
     // Ejecutar cuando el DOM esté listo
     if (document.readyState === 'loading') {
         document.addEventListener('DOMContentLoaded', init);
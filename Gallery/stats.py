@@ -0,0 +1,134 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+
+from .models import Album, MediaFile, StorageStats
+
+CACHE_KEY = 'gallery:storage_stats'
+IMAGE_TIPOS = ('imagen', 'gif')
+
+_local = threading.local()
+
+
+def _cache_timeout():
+    # La caché por defecto (locmem) es por proceso: el TTL acota cuánto puede
+    # tardar otro worker en ver un cambio que invalidó este.
+    return getattr(settings, 'GALLERY_STATS_CACHE_TIMEOUT', 60)
+
+
+def _as_dict(stats):
+    return {
+        'total_bytes': stats.bytes_total,
+        'image_bytes': stats.bytes_imagen,
+        'video_bytes': stats.bytes_video,
+        'file_count': stats.archivos,
+        'album_count': stats.albumes,
+    }
+
+
+def get_storage_stats():
+    """Contadores de almacenamiento en O(1): caché -> fila StorageStats -> reconstrucción."""
+    data = cache.get(CACHE_KEY)
+    if data is None:
+        stats = StorageStats.objects.filter(clave='global').first() or rebuild_storage_stats()
+        data = _as_dict(stats)
+        cache.set(CACHE_KEY, data, _cache_timeout())
+    return data
+
+
+def rebuild_storage_stats():
+    """Recalcula los contadores desde cero (una pasada de agregación sobre cada tabla)."""
+    delta = delta_from_queryset(MediaFile.objects.all())
+    stats, _ = StorageStats.objects.update_or_create(
+        clave='global',
+        defaults={
+            'bytes_total': delta['bytes_total'],
+            'bytes_imagen': delta['bytes_imagen'],
+            'bytes_video': delta['bytes_video'],
+            'archivos': delta['archivos'],
+            'albumes': Album.objects.count(),
+        },
+    )
+    cache.delete(CACHE_KEY)
+    return stats
+
+
+def empty_delta():
+    return {'bytes_total': 0, 'bytes_imagen': 0, 'bytes_video': 0, 'archivos': 0, 'albumes': 0}
+
+
+def delta_from_rows(rows, sign=1):
+    """Delta a partir de pares (tipo, tamano) ya en memoria."""
+    delta = empty_delta()
+    for tipo, tamano in rows:
+        tamano = tamano or 0
+        delta['archivos'] += sign
+        delta['bytes_total'] += sign * tamano
+        if tipo in IMAGE_TIPOS:
+            delta['bytes_imagen'] += sign * tamano
+        elif tipo == 'video':
+            delta['bytes_video'] += sign * tamano
+    return delta
+
+
+def delta_from_queryset(queryset, sign=1, shared_file_ids=()):
+    """
+    Delta agregado en la BD (una consulta agrupada por tipo).
+    Los bytes de un asset compartido por varias filas (deduplicado) cuentan una sola
+    vez: solo suma la fila de menor id de cada file_id. `shared_file_ids` son assets
+    que siguen usando filas fuera del queryset: sus filas cuentan como archivo, sin bytes.
+    """
+    delta = empty_delta()
+    queryset = queryset.order_by()
+    counted = Q(file_id__isnull=True) | Q(file_id='') | ~Exists(
+        queryset.filter(file_id=OuterRef('file_id'), id__lt=OuterRef('id'))
+    )
+    if shared_file_ids:
+        counted &= ~Q(file_id__in=list(shared_file_ids))
+    for row in queryset.values('tipo').annotate(n=Count('id'), b=Sum('tamano', filter=counted)):
+        partial = delta_from_rows([(row['tipo'], row['b'])], sign)
+        partial['archivos'] = sign * row['n']
+        for key, value in partial.items():
+            delta[key] += value
+    return delta
+
+
+def merge_deltas(*deltas):
+    merged = empty_delta()
+    for delta in deltas:
+        for key, value in delta.items():
+            merged[key] += value
+    return merged
+
+
+def apply_delta(delta):
+    """Suma el delta a la fila de contadores (UPDATE atómico con F()) e invalida la caché."""
+    changes = {key: F(key) + value for key, value in delta.items() if value}
+    if not changes:
+        return
+    updated = StorageStats.objects.filter(clave='global').update(**changes)
+    if not updated:
+        # Primera vez: se reconstruye desde la BD (ya incluye este cambio)
+        rebuild_storage_stats()
+    cache.delete(CACHE_KEY)
+
+
+@contextmanager
+def signals_suspended():
+    """
+    Desactiva las señales de contadores en este hilo. Las operaciones masivas
+    (sync, borrados en lote) calculan y aplican un único delta agregado.
+    """
+    previous = getattr(_local, 'suspended', False)
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = previous
+
+
+def signals_active():
+    return not getattr(_local, 'suspended', False)
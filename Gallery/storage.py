@@ -1,129 +1,342 @@
+from collections import OrderedDict
+from datetime import datetime
+from django.apps import apps
+from django.core.files.base import ContentFile, File
 from django.core.files.storage import Storage
 from django.conf import settings
 from django.utils.deconstruct import deconstructible
-from imagekitio import ImageKit
+import hashlib
 import os
-import io
-from PIL import Image, ImageSequence
+import threading
+import time
+from .ik_api import find_file, get_cdn_session, get_file_details, safe_delete_file, upload_stream
+from .optimizer import FORMAT_BY_EXT, optimize_upload
+from .presets import sign_url
+
+# Imágenes por encima de este tamaño no se recomprimen: se suben por streaming
+STREAM_IMAGE_THRESHOLD = 20 * 1024 * 1024
+
+# Caché de metadatos: entradas, vida de un acierto y de un "no existe" (segundos)
+METADATA_CACHE_SIZE = 4096
+METADATA_CACHE_TTL = 300
+METADATA_MISS_TTL = 30
+
+# Trozo por defecto al leer un asset remoto en streaming
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class MetadataCache:
+    """
+    LRU con caducidad para los metadatos de ImageKit (name, filePath, fileId, size, url...).
+    Cada entrada se guarda por ruta y por fileId, así que exists/size/_open repetidos
+    (o los de un comando que recorre miles de archivos) no vuelven a pedir la API.
+    """
+
+    def __init__(self, max_entries, ttl, miss_ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Devuelve (encontrado, metadatos). Un "no existe" cacheado es (True, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, meta = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, meta
+
+    def put(self, path, meta):
+        expires = time.monotonic() + (self.ttl if meta else self.miss_ttl)
+        keys = [('path', path.lstrip('/'))]
+        if meta:
+            if meta.get('filePath'):
+                keys.append(('path', meta['filePath'].lstrip('/')))
+            if meta.get('fileId'):
+                keys.append(('id', meta['fileId']))
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (expires, meta)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path=None, file_id=None):
+        with self._lock:
+            if path:
+                self._entries.pop(('path', path.lstrip('/')), None)
+            if file_id:
+                self._entries.pop(('id', file_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+metadata_cache = MetadataCache(
+    getattr(settings, 'GALLERY_STORAGE_CACHE_SIZE', METADATA_CACHE_SIZE),
+    getattr(settings, 'GALLERY_STORAGE_CACHE_TTL', METADATA_CACHE_TTL),
+    getattr(settings, 'GALLERY_STORAGE_MISS_TTL', METADATA_MISS_TTL),
+)
+
+
+class ImageKitFile(File):
+    """
+    Asset de ImageKit abierto en lectura, sin descargarlo entero:
+    - read(n) / seek() piden solo ese tramo a la CDN (cabecera Range).
+    - chunks() hace una única descarga en streaming desde la posición actual.
+    """
+
+    def __init__(self, name, url, size):
+        super().__init__(None, name)
+        self.url = url
+        self.mode = 'rb'
+        self._remote_size = size
+        self._pos = 0
+        self._closed = False
+
+    @property
+    def size(self):
+        # File.size mira self.file, que aquí no existe: el tamaño viene de los metadatos
+        return self._remote_size
+
+    def __len__(self):
+        return self._remote_size or 0
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def open(self, mode=None):
+        self._closed = False
+        self.seek(0)
+        return self
+
+    def close(self):
+        self._closed = True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def _get(self, start, end=None, stream=False):
+        headers = {'Range': f"bytes={start}-{'' if end is None else end}"} if start or end is not None else {}
+        response = get_cdn_session().get(self.url, headers=headers, stream=stream, timeout=(10, 300))
+        if response.status_code not in (200, 206, 416):
+            response.close()
+            raise OSError(f"ImageKit respondió {response.status_code} al leer {self.name}")
+        return response
+
+    def read(self, size=-1):
+        if self.size is not None and self._pos >= self.size:
+            return b''
+        end = None if size is None or size < 0 else self._pos + size - 1
+        if end is not None and end < self._pos:
+            return b''
+        response = self._get(self._pos, end)
+        if response.status_code == 416:
+            return b''
+        data = response.content
+        if response.status_code == 200 and (self._pos or end is not None):
+            # La CDN ignoró el Range: recortamos aquí
+            data = data[self._pos:None if end is None else end + 1]
+        self._pos += len(data)
+        return data
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or READ_CHUNK_SIZE
+        if self.size is not None and self._pos >= self.size:
+            return
+        with self._get(self._pos, stream=True) as response:
+            if response.status_code == 416:
+                return
+            skip = self._pos if response.status_code == 200 else 0
+            for chunk in response.iter_content(chunk_size):
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk, skip = chunk[dropped:], skip - dropped
+                    if not chunk:
+                        continue
+                self._pos += len(chunk)
+                yield chunk
+
+    def multiple_chunks(self, chunk_size=None):
+        return self.size is None or self.size > (chunk_size or READ_CHUNK_SIZE)
+
 
 @deconstructible
 class ImageKitStorage(Storage):
-    def __init__(self):
-        # Configuración por entorno
-        os.environ['IMAGEKIT_PUBLIC_KEY'] = settings.IMAGEKIT_PUBLIC_KEY
-        os.environ['IMAGEKIT_PRIVATE_KEY'] = settings.IMAGEKIT_PRIVATE_KEY
-        os.environ['IMAGEKIT_URL_ENDPOINT'] = settings.IMAGEKIT_URL_ENDPOINT
-        
-        self.imagekit = ImageKit()
+    # Sin estado propio: instanciarla (p. ej. al importar models.py) no crea clientes
+    # ni toca os.environ. Todas las llamadas van por la sesión compartida de ik_api.
+
+    def _file_id_for(self, name):
+        """fileId guardado en la BD para esta ruta (evita buscar en el listado de ImageKit)."""
+        MediaFile = apps.get_model('Gallery', 'MediaFile')
+        return (
+            MediaFile.objects.filter(archivo=name)
+            .exclude(file_id__isnull=True).exclude(file_id='')
+            .values_list('file_id', flat=True)
+            .first()
+        )
+
+    def metadata(self, name):
+        """
+        Metadatos de ImageKit del asset (dict de la API) o None si no existe.
+        Primero la caché; si no, files/{fileId}/details con el fileId de la BD y,
+        para archivos sin enlazar, una búsqueda por ruta.
+        """
+        found, meta = metadata_cache.get(('path', name.lstrip('/')))
+        if found:
+            return meta
+        file_id = self._file_id_for(name)
+        meta = get_file_details(file_id) if file_id else None
+        if meta is None:
+            meta = find_file(name)
+        metadata_cache.put(name, meta)
+        return meta
+
+    def metadata_by_id(self, file_id):
+        found, meta = metadata_cache.get(('id', file_id))
+        if found:
+            return meta
+        meta = get_file_details(file_id)
+        if meta:
+            metadata_cache.put(meta.get('filePath') or meta.get('name') or '', meta)
+        return meta
+
+    def _require(self, name):
+        meta = self.metadata(name)
+        if meta is None:
+            raise FileNotFoundError(f"{name} no existe en ImageKit")
+        return meta
 
     def _open(self, name, mode='rb'):
-        return None 
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError("ImageKitStorage solo abre archivos en lectura")
+        meta = self._require(name)
+        return ImageKitFile(name, sign_url(meta.get('url') or self.url(name)), meta.get('size'))
+
+    def get_available_name(self, name, max_length=None):
+        # ImageKit ya evita colisiones (useUniqueFileName): sin exists() por subida
+        return name
+
+    def _should_stream(self, name, size):
+        """
+        Videos y demás archivos no optimizables (y las imágenes muy grandes) se envían
+        por streaming desde los chunks del UploadedFile: memoria constante sin importar el tamaño.
+        """
+        if size is None:
+            return False
+        ext = os.path.splitext(name)[1].lower()
+        threshold = getattr(settings, 'GALLERY_STREAM_IMAGE_THRESHOLD', STREAM_IMAGE_THRESHOLD)
+        return ext not in FORMAT_BY_EXT or size > threshold
+
+    def _remember_file_id(self, content, file_id):
+        """Deja el fileId de ImageKit en el contenido subido para que el modelo lo guarde."""
+        if file_id:
+            try:
+                content.imagekit_file_id = file_id
+            except AttributeError:
+                pass
+
+    def _content_hash(self, content):
+        """BLAKE2b (256 bits) del contenido ORIGINAL, leído por chunks (memoria constante)."""
+        hasher = hashlib.blake2b(digest_size=32)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return hasher.hexdigest()
+
+    def _find_duplicate(self, content_hash):
+        """Devuelve (id, name, file_id) de un archivo ya subido con el mismo contenido."""
+        if not getattr(settings, 'GALLERY_DEDUPLICATE', True):
+            return None
+        MediaFile = apps.get_model('Gallery', 'MediaFile')
+        return (
+            MediaFile.objects.filter(hash_contenido=content_hash)
+            .exclude(file_id__isnull=True).exclude(file_id='')
+            .values_list('id', 'archivo', 'file_id')
+            .first()
+        )
+
+    def _uploaded(self, content, name, upload):
+        """Registra la respuesta de la subida (fileId y tamaño en el contenido, metadatos en la caché)."""
+        self._remember_file_id(content, upload.get('fileId'))
+        if upload.get('size'):
+            try:
+                content.uploaded_size = upload['size']
+            except AttributeError:
+                pass
+        stored_name = upload.get('name', name)
+        metadata_cache.put(stored_name, upload)
+        return stored_name
 
     def _save(self, name, content):
         try:
+            # 0. Deduplicación: si el mismo contenido ya está en la nube, se enlaza sin resubir.
+            # Quien ya calculó el hash (import_media) lo deja en el contenido: no se relee.
+            content_hash = getattr(content, 'content_hash', None) or self._content_hash(content)
+            try:
+                content.content_hash = content_hash
+            except AttributeError:
+                pass
+            duplicate = self._find_duplicate(content_hash)
+            if duplicate:
+                dup_id, dup_name, dup_file_id = duplicate
+                try:
+                    content.duplicate_of = dup_id
+                except AttributeError:
+                    pass
+                self._remember_file_id(content, dup_file_id)
+                print(f"Duplicado de #{dup_id}: {name} -> {dup_name} (no se resube)")
+                return dup_name
+
+            # Archivos grandes / no-imagen: subida en streaming sin leerlos a memoria
+            size = getattr(content, 'size', None)
+            if self._should_stream(name, size):
+                upload = upload_stream(content, name, size, tags=["gallery-django"])
+                return self._uploaded(content, name, upload)
+
             # 1. Leemos el contenido original en bytes
             file_content = content.read()
-            original_size = len(file_content)
-            
-            # --- LÓGICA DE COMPRESIÓN / OPTIMIZACIÓN ---
-            try:
-                ext = os.path.splitext(name)[1].lower()
-                
-                # AHORA INCLUIMOS .gif EN LA LISTA
-                valid_extensions = ['.jpg', '.jpeg', '.png', '.webp', '.jfif', '.gif']
-                
-                if ext in valid_extensions:
-                    # Cargar imagen desde memoria
-                    image = Image.open(io.BytesIO(file_content))
-                    
-                    output_buffer = io.BytesIO()
-                    
-                    # Detectar formato (Pillow a veces pierde el formato al abrir desde bytes)
-                    img_format = image.format
-                    if not img_format:
-                         if 'jpg' in ext or 'jpeg' in ext: img_format = 'JPEG'
-                         elif 'png' in ext: img_format = 'PNG'
-                         elif 'webp' in ext: img_format = 'WEBP'
-                         elif 'gif' in ext: img_format = 'GIF'
-
-                    # Configuración de optimización base
-                    save_kwargs = {
-                        'format': img_format,
-                        'optimize': True,
-                        'quality': 85
-                    }
-
-                    # MANEJO ESPECIAL PARA ANIMACIONES (GIF / WEBP)
-                    if getattr(image, 'is_animated', False):
-                        save_kwargs['save_all'] = True
-                        # loop=0 asegura que el GIF se repita infinitamente como el original
-                        save_kwargs['loop'] = 0 
-                    
-                    # Caso especial: JPG no soporta transparencia (RGBA), convertir a RGB
-                    if img_format == 'JPEG' and image.mode != 'RGB':
-                        image = image.convert('RGB')
-                    
-                    # INTENTAR COMPRIMIR
-                    image.save(output_buffer, **save_kwargs)
-                    
-                    compressed_content = output_buffer.getvalue()
-                    new_size = len(compressed_content)
-                    
-                    # SOLO usamos la versión comprimida si realmente pesa menos
-                    if new_size < original_size:
-                        file_content = compressed_content
-                        # print(f"Optimizado {name}: {original_size/1024:.1f}KB -> {new_size/1024:.1f}KB")
-                    else:
-                        pass
-                        # print(f"Compresión inefectiva para {name}, usando original.")
-
-            except Exception as e:
-                # Si falla la compresión (ej: archivo corrupto), usamos el original
-                print(f"Advertencia optimización {name}: {e}")
-
-            # --- FIN LÓGICA DE COMPRESIÓN ---
-
-            # Configuración de subida a ImageKit
-            upload_params = {
-                "use_unique_file_name": True,
-                "tags": ["gallery-django"]
-            }
-
-            # Selección del método de carga (Compatibilidad versiones SDK)
-            upload_method = None
-            if hasattr(self.imagekit, 'files') and hasattr(self.imagekit.files, 'upload'):
-                upload_method = self.imagekit.files.upload
-            elif hasattr(self.imagekit, 'upload_file'):
-                upload_method = self.imagekit.upload_file
-            elif hasattr(self.imagekit, 'upload'):
-                upload_method = self.imagekit.upload
-            
-            if not upload_method:
-                raise Exception("No se encontró método upload compatible en SDK ImageKit.")
-
-            # EJECUTAR CARGA
-            try:
-                upload = upload_method(
-                    file=file_content, 
-                    file_name=name,
-                    **upload_params 
-                )
-            except TypeError:
-                # Reintento simple si fallan los parámetros extra
-                upload = upload_method(file=file_content, file_name=name)
-
-            # PROCESAR RESPUESTA
-            if isinstance(upload, dict):
-                if 'error' in upload and upload['error']:
-                    raise Exception(upload['error']['message'])
-                return upload.get('name', name)
-            
-            if hasattr(upload, 'error') and upload.error:
-                msg = getattr(upload.error, 'message', str(upload.error))
-                raise Exception(msg)
-            
-            return getattr(upload, 'name', name)
-            
+
+            # 2. Ingesta en el pool de procesos: una sola decodificación (optimización + LQIP)
+            file_content, stats = optimize_upload(name, file_content)
+            if stats:
+                # MediaFile.aplicar_ingesta recoge ahorro, CPU, LQIP y dimensiones tras la subida
+                try:
+                    content.optimization_stats = stats
+                except AttributeError:
+                    pass
+                if stats.get('skipped'):
+                    print(f"Optimización omitida {name}: {stats['skipped']}")
+
+            # 3. Subida por la sesión HTTP compartida (misma API que el streaming)
+            upload = upload_stream(ContentFile(file_content), name, len(file_content), tags=["gallery-django"])
+            return self._uploaded(content, name, upload)
+
         except Exception as e:
             print(f"!!! ERROR IMAGEKIT !!!: {str(e)}")
             raise Exception(f"Error subiendo a ImageKit: {str(e)}")
@@ -133,4 +346,38 @@ class ImageKitStorage(Storage):
         return f"{endpoint}/{name}"
 
     def exists(self, name):
-        return False
\ No newline at end of file
+        return self.metadata(name) is not None
+
+    def size(self, name):
+        return self._require(name).get('size', 0)
+
+    def get_modified_time(self, name):
+        return self._parse_time(self._require(name).get('updatedAt'))
+
+    def get_created_time(self, name):
+        return self._parse_time(self._require(name).get('createdAt'))
+
+    def _parse_time(self, value):
+        if not value:
+            raise NotImplementedError("ImageKit no devolvió la fecha")
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+    def delete(self, name):
+        """
+        Borra el asset de la nube (si ya no existe, no hace nada).
+        No comprueba si otro registro deduplicado lo comparte: eso lo decide quien llama.
+        """
+        meta = self.metadata(name)
+        if meta is None:
+            return
+        file_id = meta.get('fileId')
+        metadata_cache.invalidate(name, file_id)
+        metadata_cache.invalidate(meta.get('filePath'))
+        if file_id:
+            try:
+                safe_delete_file(file_id)
+            except Exception:
+                # Los metadatos podían estar caducados: si ya no está en la nube, no es un error
+                if get_file_details(file_id) is not None:
+                    raise
+        metadata_cache.put(name, None)
@@ -0,0 +1,301 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .generation import bump_generation
+from .ik_api import get_file_details, iter_pages, safe_list_files
+from .models import MediaFile, SyncState, animado_desde_nombre, urls_desde_nombre
+from .search import index_media, remove_ids
+from .stats import apply_delta, delta_from_queryset, delta_from_rows, merge_deltas, signals_suspended
+from .timeline import invalidate_timeline
+
+# Tamaño de página de la API de ImageKit (máximo permitido: 1000)
+PAGE_SIZE = 100
+
+# Tamaño de lote para bulk_create / bulk_update / delete
+BATCH_SIZE = 500
+
+# Comprobaciones en paralelo de los ausentes antes de la limpieza inversa
+CHECK_CONCURRENCY = 8
+# Latido durante la confirmación de ausentes (cada consulta puede reintentar con Retry-After)
+CHECK_NOTIFY_SECONDS = 30
+
+
+def _existe_en_nube(file_id):
+    return get_file_details(file_id) is not None
+
+
+def tipo_desde_imagekit(name, file_type):
+    """Traduce el fileType de ImageKit al campo `tipo` local."""
+    if file_type == 'image':
+        return 'gif' if name.lower().endswith('.gif') else 'imagen'
+    return 'video'
+
+
+def metadatos_desde_imagekit(name, tipo, file_data):
+    """Columnas precalculadas (URLs, dimensiones, mime, duración) a partir de la respuesta de la API."""
+    url_completa, url_miniatura, srcset_miniatura = urls_desde_nombre(name, tipo)
+    return {
+        'url_completa': url_completa,
+        'url_miniatura': url_miniatura,
+        'srcset_miniatura': srcset_miniatura,
+        'ancho': file_data.get('width') or None,
+        'alto': file_data.get('height') or None,
+        'mime': file_data.get('mime') or '',
+        'duracion': file_data.get('duration') or None,
+        'animado': animado_desde_nombre(name, tipo),
+    }
+
+
+# Columnas que la sync escribe en los archivos enlazados
+CAMPOS_ENLACE = [
+    'file_id', 'tamano', 'tipo', 'url_completa', 'url_miniatura', 'srcset_miniatura',
+    'ancho', 'alto', 'mime', 'duracion', 'animado',
+]
+
+
+def _marca_de(file_data):
+    """Devuelve el datetime updatedAt (o createdAt) de un archivo de la API."""
+    raw = file_data.get('updatedAt') or file_data.get('createdAt')
+    return parse_datetime(raw) if raw else None
+
+
+class SyncEngine:
+    """
+    Motor de sincronización incremental ImageKit -> Local.
+
+    - Incremental: usa una marca de agua persistida (SyncState) para pedir solo los
+      archivos con updatedAt >= marca, ordenados por updatedAt. La marca avanza al final
+      de cada página, de modo que una ejecución interrumpida continúa donde se quedó.
+    - Compara cada página contra un set de file_id precargado (0 consultas por archivo).
+    - Escribe con bulk_create / bulk_update.
+    - La limpieza inversa (borrar locales que ya no existen en la nube) necesita el
+      listado completo, así que solo se hace en modo completo: la primera vez, cuando
+      se pide explícitamente o cuando la última completa es más vieja que
+      GALLERY_SYNC_FULL_INTERVAL_HOURS. El listado completo va por createdAt: un asset
+      editado mientras se lista no cambia de posición, así que ninguna ventana `skip`
+      se lo salta (y no se borra por error). Antes de borrar, cada ausente se confirma
+      con la API.
+    - Un listado completo interrumpido se retoma desde `start_skip` (el offset de la
+      última página guardada). Como no se han visto las páginas anteriores, esa pasada
+      no hace la limpieza inversa ni cuenta como completa: queda para la siguiente.
+    """
+
+    def __init__(self, full=False, list_files=safe_list_files, page_size=PAGE_SIZE,
+                 on_progress=None, concurrency=None, file_exists=None, start_skip=0):
+        self.list_files = list_files
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.on_progress = on_progress
+        self.file_exists = file_exists or _existe_en_nube
+        self.state, _ = SyncState.objects.get_or_create(clave='imagekit')
+        self.full = full or self._full_due()
+        # Solo el listado completo (por createdAt) tiene offsets estables entre ejecuciones
+        self.start_skip = start_skip if self.full else 0
+        self.next_skip = self.start_skip
+
+        self.created = 0
+        self.linked = 0
+        self.deleted = 0
+        self.pages = 0
+        self.rows = 0
+        self.estimated_total = None
+
+    def _full_due(self):
+        if self.state.marca_agua is None or self.state.ultima_completa is None:
+            return True
+        hours = getattr(settings, 'GALLERY_SYNC_FULL_INTERVAL_HOURS', 24)
+        return timezone.now() - self.state.ultima_completa > timedelta(hours=hours)
+
+    def _options(self):
+        # Se calcula una sola vez por ejecución: la marca avanza página a página,
+        # pero la consulta debe ser estable para que los `skip` sean coherentes.
+        if self.full:
+            return {"sort": "ASC_CREATED"}
+        options = {"sort": "ASC_UPDATED"}
+        if self.state.marca_agua:
+            marca = self.state.marca_agua.astimezone(dt_timezone.utc)
+            iso = marca.strftime('%Y-%m-%dT%H:%M:%S.') + f"{marca.microsecond // 1000:03d}Z"
+            options["searchQuery"] = f'updatedAt >= "{iso}"'
+        return options
+
+    def _load_local_index(self):
+        """
+        Precarga en memoria los file_id conocidos y los archivos locales sin enlazar
+        (indexados por nombre y por último segmento de la ruta).
+        """
+        self.known_ids = set(
+            MediaFile.objects.exclude(file_id__isnull=True).exclude(file_id='')
+            .values_list('file_id', flat=True)
+        )
+        self.unlinked = {}
+        self.unlinked_names = {}
+        sin_enlazar = MediaFile.objects.filter(Q(file_id__isnull=True) | Q(file_id=''))
+        for pk, archivo in sin_enlazar.values_list('id', 'archivo').iterator():
+            if not archivo:
+                continue
+            self.unlinked_names[pk] = archivo
+            self.unlinked.setdefault(archivo, pk)
+            self.unlinked.setdefault(archivo.rsplit('/', 1)[-1], pk)
+
+    def _process_page(self, batch):
+        nuevos = []
+        enlazados = []
+        marca = self.state.marca_agua
+
+        for file_data in batch:
+            file_id = file_data.get('fileId')
+            if not file_id:
+                continue
+
+            self.seen_ids.add(file_id)
+            fecha = _marca_de(file_data)
+            if fecha and (marca is None or fecha > marca):
+                marca = fecha
+            if fecha and (self.max_seen is None or fecha > self.max_seen):
+                self.max_seen = fecha
+
+            # A. ¿Ya tenemos este ID?
+            if file_id in self.known_ids:
+                continue
+
+            name = file_data.get('name') or ''
+            size = file_data.get('size', 0)
+            tipo = tipo_desde_imagekit(name, file_data.get('fileType', 'image'))
+
+            # B. ¿Existe por nombre (subido manual)? Enlazamos.
+            pk = self.unlinked.pop(name, None)
+            if pk is not None:
+                archivo = self.unlinked_names.get(pk, name)
+                enlazados.append(MediaFile(
+                    pk=pk, file_id=file_id, tamano=size, tipo=tipo,
+                    **metadatos_desde_imagekit(archivo, tipo, file_data)
+                ))
+            else:
+                # C. Crear nuevo
+                nuevos.append(MediaFile(
+                    nombre=name, archivo=name, file_id=file_id, tamano=size, tipo=tipo,
+                    **metadatos_desde_imagekit(name, tipo, file_data)
+                ))
+            self.known_ids.add(file_id)
+
+        with transaction.atomic():
+            # Contadores de almacenamiento: un único delta por página
+            delta = delta_from_rows((m.tipo, m.tamano) for m in nuevos)
+            if nuevos:
+                MediaFile.objects.bulk_create(nuevos, batch_size=BATCH_SIZE)
+            if enlazados:
+                delta = merge_deltas(
+                    delta,
+                    delta_from_queryset(MediaFile.objects.filter(pk__in=[m.pk for m in enlazados]), sign=-1),
+                    delta_from_rows((m.tipo, m.tamano) for m in enlazados),
+                )
+                MediaFile.objects.bulk_update(enlazados, CAMPOS_ENLACE, batch_size=BATCH_SIZE)
+            apply_delta(delta)
+            # Checkpoint: la marca avanza solo cuando la página está persistida.
+            # En el listado completo (por createdAt) la marca se fija al terminar.
+            if not self.full and marca != self.state.marca_agua:
+                self.state.marca_agua = marca
+                self.state.save(update_fields=['marca_agua', 'actualizado_en'])
+
+        # bulk_create no dispara señales ni devuelve PKs en MySQL: se indexa por file_id
+        tocados = [m.file_id for m in nuevos] + [m.file_id for m in enlazados]
+        if tocados:
+            index_media(MediaFile.objects.filter(file_id__in=tocados))
+            invalidate_timeline()
+            bump_generation()
+
+        self.created += len(nuevos)
+        self.linked += len(enlazados)
+        self.rows += len(batch)
+        self.pages += 1
+        self.next_skip += self.page_size
+        self._notify()
+
+    def _notify(self):
+        if self.on_progress:
+            self.on_progress(self)
+
+    def _delete_missing(self, local_ids):
+        """Borra localmente los archivos enlazados que ya no aparecen en la nube (confirmado con la API)."""
+        candidatos = list(local_ids - self.seen_ids)
+        ids_a_eliminar = []
+        ultimo_latido = time.monotonic()
+        with ThreadPoolExecutor(max_workers=CHECK_CONCURRENCY, thread_name_prefix='sync-check') as pool:
+            futuros = {pool.submit(self.file_exists, file_id): file_id for file_id in candidatos}
+            for futuro in as_completed(futuros):
+                if not futuro.result():
+                    ids_a_eliminar.append(futuros[futuro])
+                if time.monotonic() - ultimo_latido >= CHECK_NOTIFY_SECONDS:
+                    self._notify()
+                    ultimo_latido = time.monotonic()
+        if len(ids_a_eliminar) < len(candidatos):
+            print(f"Sync: {len(candidatos) - len(ids_a_eliminar)} ausentes del listado siguen en la nube; no se borran.")
+        for i in range(0, len(ids_a_eliminar), BATCH_SIZE):
+            chunk = ids_a_eliminar[i:i + BATCH_SIZE]
+            # 0 peticiones a la API; contadores con un delta agregado por lote
+            archivos_a_borrar = MediaFile.objects.filter(file_id__in=chunk)
+            with transaction.atomic():
+                delta = delta_from_queryset(archivos_a_borrar, sign=-1)
+                pks = list(archivos_a_borrar.values_list('id', flat=True))
+                with signals_suspended():
+                    archivos_a_borrar.delete()
+                apply_delta(delta)
+            remove_ids(pks)
+        if ids_a_eliminar:
+            invalidate_timeline()
+            bump_generation()
+        self.deleted = len(ids_a_eliminar)
+        self._notify()
+
+    def run(self):
+        started = time.monotonic()
+        pass_started = timezone.now()
+        self._load_local_index()
+        self.seen_ids = set()
+        self.max_seen = None
+        local_ids = set(self.known_ids) if self.full else None
+        if self.full:
+            # Aproximación para el ETA: la nube debería tener al menos lo que hay en local
+            self.estimated_total = len(self.known_ids) + len(set(self.unlinked.values()))
+
+        pages = iter_pages(
+            self._options(), self.page_size,
+            concurrency=self.concurrency, list_files=self.list_files, start=self.start_skip,
+        )
+        for batch in pages:
+            self._process_page(batch)
+
+        if self.full and self.start_skip:
+            print(f"Sync: listado completo retomado desde {self.start_skip}; la limpieza inversa queda para la siguiente completa.")
+        elif self.full:
+            self._delete_missing(local_ids)
+            self.state.ultima_completa = timezone.now()
+            # Lo editado durante el listado (updatedAt > inicio) lo recoge la siguiente incremental
+            if self.max_seen:
+                marca = min(self.max_seen, pass_started)
+                if self.state.marca_agua is None or marca > self.state.marca_agua:
+                    self.state.marca_agua = marca
+            self.state.save(update_fields=['marca_agua', 'ultima_completa', 'actualizado_en'])
+
+        return self.report(time.monotonic() - started)
+
+    def report(self, elapsed):
+        elapsed = max(elapsed, 1e-6)
+        return {
+            'full': self.full,
+            'created': self.created,
+            'linked': self.linked,
+            'deleted': self.deleted,
+            'pages': self.pages,
+            'rows': self.rows,
+            'seconds': round(elapsed, 2),
+            'rows_per_second': round(self.rows / elapsed, 1),
+            'pages_per_second': round(self.pages / elapsed, 2),
+        }
@@ -1,44 +1,259 @@
-const CACHE_NAME = 'catbox-galeria-cache-v1';
+{% load gallery_presets %}const CACHE_PREFIX = 'catbox-galeria-cache-';
+const CACHE_NAME = `${CACHE_PREFIX}{% sw_cache_version %}`;
 
 // Lista de dominios que queremos cachear (ImageKit)
 const TARGET_DOMAINS = [
-    'ik.imagekit.io', 
+    'ik.imagekit.io',
     'cdn.jsdelivr.net' // Opcional: para cachear bootstrap/iconos también
 ];
 
+// Transformaciones del registro de presets (Gallery/presets.py)
+const PRESET_TRANSFORMS = new Set({% preset_transforms_json %});
+
+// Presupuesto (GALLERY_SW_CACHE_BUDGET): entradas, bytes y fracción máxima de la cuota del origen
+const BUDGET = {% sw_cache_budget_json %};
+
+// Tras desalojar se baja hasta este porcentaje del presupuesto (evita desalojar en cada put)
+const LOW_WATER = 0.9;
+// Cada cuántas escrituras se vuelve a consultar navigator.storage.estimate()
+const ESTIMATE_EVERY = 50;
+// Las lecturas solo actualizan lastAccess si el dato tiene más de este tiempo
+const TOUCH_INTERVAL_MS = 60 * 1000;
+
+
+/* ══════════════════════════════════════════════════════════════════
+   ÍNDICE LRU EN INDEXEDDB
+   Una entrada por URL cacheada: { url, size, lastAccess }, con índice por lastAccess.
+   Los totales (entradas y bytes) se guardan en la store "meta".
+   ══════════════════════════════════════════════════════════════════ */
+
+const DB_NAME = 'catbox-galeria-lru';
+const DB_VERSION = 1;
+let dbPromise = null;
+
+function openDb() {
+    if (!dbPromise) {
+        dbPromise = new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, DB_VERSION);
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                const entries = db.createObjectStore('entries', { keyPath: 'url' });
+                entries.createIndex('lastAccess', 'lastAccess');
+                db.createObjectStore('meta');
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+    return dbPromise;
+}
+
+function promisify(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function txDone(tx) {
+    return new Promise((resolve, reject) => {
+        tx.oncomplete = () => resolve();
+        tx.onerror = tx.onabort = () => reject(tx.error);
+    });
+}
+
+async function readTotals(meta) {
+    return (await promisify(meta.get('totals'))) || { entries: 0, bytes: 0, version: CACHE_NAME };
+}
+
+async function recordPut(url, size) {
+    const db = await openDb();
+    const tx = db.transaction(['entries', 'meta'], 'readwrite');
+    const entries = tx.objectStore('entries');
+    const meta = tx.objectStore('meta');
+
+    const previous = await promisify(entries.get(url));
+    const totals = await readTotals(meta);
+    if (previous) {
+        totals.bytes -= previous.size;
+    } else {
+        totals.entries += 1;
+    }
+    totals.bytes += size;
+    entries.put({ url, size, lastAccess: Date.now() });
+    meta.put(totals, 'totals');
+    await txDone(tx);
+    return totals;
+}
+
+async function touch(url) {
+    const db = await openDb();
+    const tx = db.transaction('entries', 'readwrite');
+    const entries = tx.objectStore('entries');
+    const entry = await promisify(entries.get(url));
+    if (entry && Date.now() - entry.lastAccess > TOUCH_INTERVAL_MS) {
+        entry.lastAccess = Date.now();
+        entries.put(entry);
+    }
+    await txDone(tx);
+}
+
+
+/* ══════════════════════════════════════════════════════════════════
+   PRESUPUESTO Y DESALOJO
+   ══════════════════════════════════════════════════════════════════ */
+
+let byteBudget = BUDGET.maxBytes;
+let putsSinceEstimate = ESTIMATE_EVERY;
+let evicting = null;
+
+// El presupuesto efectivo nunca supera una fracción de la cuota que el navegador nos da
+async function refreshBudget() {
+    putsSinceEstimate = 0;
+    if (!self.navigator.storage || !self.navigator.storage.estimate) return;
+    try {
+        const { quota } = await self.navigator.storage.estimate();
+        if (quota) byteBudget = Math.min(BUDGET.maxBytes, Math.floor(quota * BUDGET.quotaFraction));
+    } catch (e) { /* sin estimación: se mantiene maxBytes */ }
+}
+
+function overBudget(totals) {
+    return totals.entries > BUDGET.maxEntries || totals.bytes > byteBudget;
+}
+
+async function evict() {
+    const db = await openDb();
+    const cache = await caches.open(CACHE_NAME);
+    const tx = db.transaction(['entries', 'meta'], 'readwrite');
+    const entries = tx.objectStore('entries');
+    const meta = tx.objectStore('meta');
+    const totals = await readTotals(meta);
+
+    const targetEntries = Math.floor(BUDGET.maxEntries * LOW_WATER);
+    const targetBytes = Math.floor(byteBudget * LOW_WATER);
+    const victims = [];
+
+    // Recorrido por lastAccess ascendente: primero las menos usadas recientemente
+    await new Promise((resolve, reject) => {
+        const cursorRequest = entries.index('lastAccess').openCursor();
+        cursorRequest.onerror = () => reject(cursorRequest.error);
+        cursorRequest.onsuccess = () => {
+            const cursor = cursorRequest.result;
+            if (!cursor || (totals.entries <= targetEntries && totals.bytes <= targetBytes)) {
+                resolve();
+                return;
+            }
+            victims.push(cursor.value.url);
+            totals.entries -= 1;
+            totals.bytes -= cursor.value.size;
+            cursor.delete();
+            cursor.continue();
+        };
+    });
+    meta.put(totals, 'totals');
+    await txDone(tx);
+    await Promise.all(victims.map(url => cache.delete(url)));
+}
+
+async function storeInCache(cacheKey, response) {
+    const cache = await caches.open(CACHE_NAME);
+    // Las respuestas opacas no exponen su tamaño (y cuentan mucho más en la cuota): se estima
+    const size = response.type === 'opaque'
+        ? 64 * 1024
+        : (await response.clone().blob()).size;
+    await cache.put(cacheKey, response);
+
+    if (++putsSinceEstimate >= ESTIMATE_EVERY) await refreshBudget();
+    const totals = await recordPut(cacheKey, size);
+    if (overBudget(totals) && !evicting) {
+        evicting = evict().finally(() => { evicting = null; });
+    }
+}
+
+
+/* ══════════════════════════════════════════════════════════════════
+   CICLO DE VIDA
+   ══════════════════════════════════════════════════════════════════ */
+
 self.addEventListener('install', (event) => {
     self.skipWaiting();
 });
 
 self.addEventListener('activate', (event) => {
-    event.waitUntil(clients.claim());
+    event.waitUntil((async () => {
+        // Versiones antiguas de la caché (despliegue o cambio de presets): fuera
+        const names = await caches.keys();
+        await Promise.all(
+            names.filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME)
+                 .map(name => caches.delete(name))
+        );
+
+        // El índice LRU describe solo la versión actual
+        const db = await openDb();
+        const tx = db.transaction(['entries', 'meta'], 'readwrite');
+        const totals = await readTotals(tx.objectStore('meta'));
+        if (totals.version !== CACHE_NAME) {
+            tx.objectStore('entries').clear();
+            tx.objectStore('meta').put({ entries: 0, bytes: 0, version: CACHE_NAME }, 'totals');
+        }
+        await txDone(tx);
+
+        await refreshBudget();
+        await clients.claim();
+    })());
 });
 
+
+/* ══════════════════════════════════════════════════════════════════
+   FETCH
+   ══════════════════════════════════════════════════════════════════ */
+
+// Clave de caché canónica: origen + ruta + preset. Se descartan los demás parámetros
+// (firma ik-t/ik-s, orden distinto...) para que una misma miniatura ocupe una sola entrada.
+function presetCacheKey(url) {
+    const tr = url.searchParams.get('tr');
+    if (!tr || !PRESET_TRANSFORMS.has(tr)) return null;
+    return `${url.origin}${url.pathname}?tr=${tr}`;
+}
+
+// Se pide en modo CORS (ImageKit lo permite) para conocer el tamaño real y no pagar
+// el relleno de cuota de las respuestas opacas; si falla, la petición original.
+async function fetchForCache(request) {
+    try {
+        const response = await fetch(request.url, { mode: 'cors', credentials: 'omit' });
+        if (response.ok) return response;
+    } catch (e) { /* sin CORS: se usa la petición original */ }
+    return fetch(request);
+}
+
+async function cacheFirst(request, cacheKey) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(cacheKey);
+    if (cached) {
+        touch(cacheKey).catch(() => {});
+        return cached;
+    }
+    const response = await fetchForCache(request);
+    if (response.ok || response.type === 'opaque') {
+        storeInCache(cacheKey, response.clone()).catch(console.error);
+    }
+    return response;
+}
+
 self.addEventListener('fetch', (event) => {
     const url = new URL(event.request.url);
 
     if (event.request.method !== 'GET') return;
-    
+
     // Solo cachear assets de ImageKit y CDNs
     if (!TARGET_DOMAINS.some(domain => url.hostname.includes(domain))) return;
 
-    // THUMBNAILS (tienen ?tr=) → Cache-first, expiración larga
-    // ORIGINALES (sin ?tr= o con tr=orig) → Network-first
-    const isThumbnail = url.search.includes('tr=w-') && !url.search.includes('orig-true');
+    // PRESETS (miniaturas, portadas, visor) → Cache-first con LRU acotado
+    // ORIGINALES y transformaciones fuera del registro → Network-first
+    const cacheKey = presetCacheKey(url);
 
-    if (isThumbnail) {
-        // Cache-first para thumbnails (raramente cambian)
-        event.respondWith(
-            caches.open(CACHE_NAME).then(cache => 
-                cache.match(event.request).then(cached => {
-                    if (cached) return cached;
-                    return fetch(event.request).then(response => {
-                        cache.put(event.request, response.clone());
-                        return response;
-                    });
-                })
-            )
-        );
+    if (cacheKey) {
+        event.respondWith(cacheFirst(event.request, cacheKey));
     } else {
         // Network-first para originales (no llenar el caché con archivos pesados)
         event.respondWith(
@@ -46,3 +261,31 @@ self.addEventListener('fetch', (event) => {
         );
     }
 });
+
+
+/* ══════════════════════════════════════════════════════════════════
+   PRECARGA DE LA SIGUIENTE PÁGINA
+   La página envía { type: 'precache', urls } cuando el dispositivo está ocioso.
+   ══════════════════════════════════════════════════════════════════ */
+
+async function precache(urls) {
+    const cache = await caches.open(CACHE_NAME);
+    for (const raw of urls) {
+        const url = new URL(raw, self.location.origin);
+        const cacheKey = presetCacheKey(url);
+        if (!cacheKey || await cache.match(cacheKey)) continue;
+        try {
+            const response = await fetchForCache(new Request(url.href));
+            if (response.ok || response.type === 'opaque') await storeInCache(cacheKey, response);
+        } catch (e) {
+            return; // sin red: se deja para otra ocasión
+        }
+    }
+}
+
+self.addEventListener('message', (event) => {
+    const data = event.data || {};
+    if (data.type === 'precache' && Array.isArray(data.urls)) {
+        event.waitUntil(precache(data.urls.slice(0, 120)));
+    }
+});
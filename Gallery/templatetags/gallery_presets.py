@@ -0,0 +1,61 @@
+import hashlib
+import json
+
+from django import template
+from django.conf import settings
+from django.utils.safestring import mark_safe
+
+from Gallery.presets import GRID_SIZES, PRESETS, sign_srcset, sign_url, viewer_transforms
+
+register = template.Library()
+
+
+@register.filter
+def firmar(url):
+    """Firma la URL si GALLERY_SIGNED_URLS está activo (no-op en caso contrario)."""
+    return sign_url(url)
+
+
+@register.filter
+def firmar_srcset(srcset):
+    return sign_srcset(srcset)
+
+
+@register.simple_tag
+def grid_sizes():
+    return GRID_SIZES
+
+
+@register.simple_tag
+def viewer_transforms_json():
+    """{ancho: tr} de los presets del visor como literal JS."""
+    return mark_safe(json.dumps(viewer_transforms()))
+
+
+@register.simple_tag
+def preset_transforms_json():
+    """Lista de cadenas `tr` del registro (clave de la caché del service worker)."""
+    return mark_safe(json.dumps(sorted({preset['tr'] for preset in PRESETS.values()})))
+
+
+@register.simple_tag
+def sw_cache_version():
+    """
+    Versión de la caché del service worker: GALLERY_SW_CACHE_VERSION más un hash del
+    registro de presets, así un cambio de presets (o un despliegue que suba la versión)
+    invalida las entradas viejas en el activate.
+    """
+    digest = hashlib.sha1(json.dumps(PRESETS, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    return f"{getattr(settings, 'GALLERY_SW_CACHE_VERSION', 'v2')}-{digest}"
+
+
+@register.simple_tag
+def sw_cache_budget_json():
+    """Presupuesto de la caché de miniaturas: entradas, bytes y fracción máxima de la cuota."""
+    budget = {
+        'maxEntries': 4000,
+        'maxBytes': 150 * 1024 * 1024,
+        'quotaFraction': 0.5,
+    }
+    budget.update(getattr(settings, 'GALLERY_SW_CACHE_BUDGET', {}))
+    return mark_safe(json.dumps(budget))
@@ -1,3 +1,781 @@
-from django.test import TestCase
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Album, AlbumArchivo, MediaFile
+
+
+class StubImageKit:
+    """
+    Servidor HTTP local que imita lo que la galería usa de ImageKit: listado, detalles y
+    borrado (API), subida multipart y descarga con Range (CDN). Sin red ni credenciales.
+    """
+
+    def __init__(self, latency=0):
+        self.files = {}          # fileId -> metadatos como los devuelve la API
+        self.content = {}        # fileId -> bytes
+        self.calls = []          # (método, ruta) de cada petición
+        self.uploaded_bytes = 0
+        self.latency = latency
+        self.fail_next = 0       # respuestas 429 antes de atender la siguiente petición
+        self.on_list = None      # gancho(skip) antes de responder un listado
+        self._lock = threading.Lock()
+        self._seq = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub._handle(self, 'GET')
+
+            def do_POST(self):
+                stub._handle(self, 'POST')
+
+            def do_DELETE(self):
+                stub._handle(self, 'DELETE')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def settings(self):
+        return {
+            'IMAGEKIT_API_BASE': f"{self.url}/v1",
+            'IMAGEKIT_UPLOAD_URL': f"{self.url}/upload",
+            'IMAGEKIT_URL_ENDPOINT': f"{self.url}/cdn",
+        }
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _stamp(self):
+        self._seq += 1
+        return f"2024-01-01T00:{self._seq // 60:02d}:{self._seq % 60:02d}.000Z"
+
+    def add_file(self, name, data=b'', file_id=None):
+        with self._lock:
+            file_id = file_id or f"f{len(self.files) + 1}"
+            stamp = self._stamp()
+            self.files[file_id] = {
+                'fileId': file_id, 'name': name.rsplit('/', 1)[-1], 'filePath': f"/{name}",
+                'url': f"{self.url}/cdn/{name}", 'size': len(data), 'fileType': 'image',
+                'createdAt': stamp, 'updatedAt': stamp,
+            }
+            self.content[file_id] = data
+        return file_id
+
+    def touch(self, file_id):
+        """Simula una edición en la consola: el asset pasa a ser el más reciente por updatedAt."""
+        with self._lock:
+            self.files[file_id]['updatedAt'] = self._stamp()
+
+    def _send(self, handler, status, body=b'', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+            headers = {'Content-Type': 'application/json', **(headers or {})}
+        handler.send_response(status)
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _handle(self, handler, method):
+        parsed = urlparse(handler.path)
+        path = unquote(parsed.path)
+        with self._lock:
+            self.calls.append((method, path))
+            throttled = self.fail_next > 0
+            self.fail_next -= throttled
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            return self._send(handler, 429, {'message': 'Too many requests'}, {'Retry-After': '0'})
+
+        if method == 'POST' and path == '/upload':
+            return self._upload(handler)
+        if method == 'GET' and path.startswith('/cdn/'):
+            return self._download(handler, path[len('/cdn/'):])
+        if method == 'GET' and path == '/v1/files':
+            return self._list(handler, {k: v[0] for k, v in parse_qs(parsed.query).items()})
+        match = re.fullmatch(r'/v1/files/([^/]+)(/details)?', path)
+        if match and match.group(1) in self.files:
+            if method == 'DELETE':
+                with self._lock:
+                    self.files.pop(match.group(1))
+                return self._send(handler, 204)
+            return self._send(handler, 200, self.files[match.group(1)])
+        return self._send(handler, 404, {'message': 'Not found'})
+
+    def _list(self, handler, params):
+        skip = int(params.get('skip', 0))
+        if self.on_list:
+            self.on_list(skip)
+        with self._lock:
+            items = list(self.files.values())
+        query = params.get('searchQuery', '')
+        since = re.search(r'updatedAt >= "([^"]+)"', query)
+        if since:
+            items = [f for f in items if f['updatedAt'] >= since.group(1)]
+        name = re.search(r'name = "([^"]+)"', query)
+        if name:
+            items = [f for f in items if f['name'] == name.group(1)]
+        campo = 'updatedAt' if params.get('sort') == 'ASC_UPDATED' else 'createdAt'
+        items.sort(key=lambda f: (f[campo], f['fileId']))
+        limit = int(params.get('limit', 1000))
+        return self._send(handler, 200, items[skip:skip + limit])
+
+    def _upload(self, handler):
+        # Se consume en trozos sin guardarlo: memoria constante en el servidor de prueba
+        remaining = int(handler.headers['Content-Length'])
+        head = handler.rfile.read(min(remaining, 64 * 1024))
+        remaining -= len(head)
+        total = len(head)
+        while remaining:
+            chunk = handler.rfile.read(min(remaining, 64 * 1024))
+            remaining -= len(chunk)
+            total += len(chunk)
+        with self._lock:
+            self.uploaded_bytes += total
+        name = re.search(rb'name="fileName"\r\n\r\n([^\r]+)', head).group(1).decode('utf-8')
+        file_id = self.add_file(name)
+        with self._lock:
+            self.files[file_id]['size'] = total
+        return self._send(handler, 200, self.files[file_id])
+
+    def _download(self, handler, name):
+        file_id = next((fid for fid, f in self.files.items() if f['filePath'] == f"/{name}"), None)
+        if file_id is None:
+            return self._send(handler, 404)
+        data = self.content[file_id]
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', handler.headers.get('Range', ''))
+        if not match:
+            return self._send(handler, 200, data)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        if start >= len(data):
+            return self._send(handler, 416)
+        end = min(end, len(data) - 1)
+        return self._send(handler, 206, data[start:end + 1], {
+            'Content-Range': f"bytes {start}-{end}/{len(data)}",
+        })
+
+
+class StubImageKitMixin:
+    """Arranca un StubImageKit por test y apunta los settings de ImageKit a él."""
+    stub_latency = 0
+
+    def setUp(self):
+        super().setUp()
+        from . import ik_api
+        from .storage import metadata_cache
+        self.stub = StubImageKit(latency=self.stub_latency)
+        self.addCleanup(self.stub.close)
+        overrides = override_settings(**self.stub.settings())
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        metadata_cache.clear()
+        self.addCleanup(metadata_cache.clear)
+        # Sesiones nuevas por test (la de la API guarda la clave al crearse)
+        ik_api._session = ik_api._cdn_session = None
+
+
+class IkApiPaginasTest(StubImageKitMixin, TestCase):
+    """Cliente REST compartido de ik_api: sesión única, reintentos y páginas en paralelo."""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(9):
+            self.stub.add_file(f'foto{i}.jpg')
+
+    def _ids(self, pages):
+        return [f['fileId'] for page in pages for f in page]
+
+    def test_paginas_en_orden_con_concurrencia(self):
+        from .ik_api import iter_pages
+        pages = list(iter_pages({'sort': 'ASC_CREATED'}, page_size=2, concurrency=3))
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 2, 1])
+        self.assertEqual(self._ids(pages), [f'f{i}' for i in range(1, 10)])
+
+    def test_reintenta_429_en_la_sesion_compartida(self):
+        from .ik_api import get_session, safe_list_files
+        self.assertIs(get_session(), get_session())
+        self.stub.fail_next = 2
+        self.assertEqual(len(safe_list_files({'limit': 100})), 9)
+        self.assertEqual(self.stub.calls.count(('GET', '/v1/files')), 3)
+
+    def test_benchmark_paginas_por_segundo(self):
+        from .ik_api import iter_pages
+        self.stub.latency = 0.05
+        ritmos = {}
+        for concurrency in (1, 4):
+            started = time.perf_counter()
+            pages = list(iter_pages({}, page_size=1, concurrency=concurrency))
+            ritmos[concurrency] = len(pages) / (time.perf_counter() - started)
+            self.assertEqual(self._ids(pages), [f'f{i}' for i in range(1, 10)])
+        # 50 ms por petición: en serie ~20 páginas/s, con 4 ventanas en vuelo bastante más
+        self.assertGreater(ritmos[4], 2 * ritmos[1])
+
+
+class AdminChangelistQueriesTest(TestCase):
+    """Los listados del admin hacen las mismas consultas con 5 filas que con 40 (sin N+1)."""
+
+    def setUp(self):
+        # La generación de la biblioteca (context processor) se cachea en la primera petición
+        cache.clear()
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'clave')
+        self.client.force_login(user)
+        self.creados = 0
+
+    def _crear(self, cantidad):
+        # bulk_create: sin subidas a ImageKit ni señales
+        inicio = self.creados
+        self.creados += cantidad
+        albumes = Album.objects.bulk_create([
+            Album(nombre=f'album-{i}') for i in range(inicio, self.creados)
+        ])
+        Album.objects.bulk_create([
+            Album(nombre=f'sub-{album.pk}', album_padre=album) for album in albumes
+        ])
+        medios = MediaFile.objects.bulk_create([
+            MediaFile(archivo=f'test/{i}.jpg', nombre=f'{i}.jpg', tipo='imagen') for i in range(inicio, self.creados)
+        ])
+        AlbumArchivo.objects.bulk_create([
+            AlbumArchivo(mediafile=media, album=album, creado_en=media.creado_en)
+            for media, album in zip(medios, albumes)
+        ])
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def _assert_constante(self, url):
+        self._crear(5)
+        self._consultas(url)  # calentamiento: cachés por proceso (generación, sesión)
+        pocas = self._consultas(url)
+        self._crear(35)
+        self.assertEqual(self._consultas(url), pocas)
+
+    def test_album_changelist(self):
+        self._assert_constante(reverse('admin:Gallery_album_changelist'))
+
+    def test_mediafile_changelist(self):
+        self._assert_constante(reverse('admin:Gallery_mediafile_changelist'))
+
+
+class ArbolSinRutaMixin:
+    """Dos árboles de álbumes creados sin rutas, con un archivo en cada álbum."""
+
+    def setUp(self):
+        # bulk_create no pasa por Album.save: las rutas quedan vacías, como en una BD antigua
+        self.raiz, self.otro = Album.objects.bulk_create([Album(nombre='raiz'), Album(nombre='otro')])
+        (self.hijo,) = Album.objects.bulk_create([Album(nombre='hijo', album_padre=self.raiz)])
+        medios = MediaFile.objects.bulk_create([
+            MediaFile(archivo=f'test/{i}.jpg', nombre=f'{i}.jpg', tipo='imagen', tamano=10) for i in range(3)
+        ])
+        AlbumArchivo.objects.bulk_create([
+            AlbumArchivo(mediafile=medios[0], album=self.raiz, creado_en=medios[0].creado_en),
+            AlbumArchivo(mediafile=medios[1], album=self.hijo, creado_en=medios[1].creado_en),
+            AlbumArchivo(mediafile=medios[2], album=self.otro, creado_en=medios[2].creado_en),
+        ])
+        self.medios = medios
+
+
+class ArbolSinRutaTest(ArbolSinRutaMixin, TestCase):
+    """Álbumes anteriores al árbol (ruta vacía): las consultas por subárbol no abarcan toda la biblioteca."""
+
+    def test_totales_y_subarbol(self):
+        self.assertEqual(self.raiz.totales_recursivos(), {'archivos': 2, 'bytes': 20})
+        self.assertEqual(list(self.raiz.descendientes()), [self.hijo])
+        self.assertEqual([a.pk for a in Album.objects.get(pk=self.hijo.pk).migas], [self.raiz.pk, self.hijo.pk])
+
+    def test_listado_con_totales(self):
+        from .albums import con_totales_recursivos
+        totales = dict(con_totales_recursivos(Album.objects.all()).values_list('nombre', 'total_archivos'))
+        self.assertEqual(totales, {'raiz': 2, 'hijo': 1, 'otro': 1})
+
+
+class BorradoMasivoTest(ArbolSinRutaMixin, TestCase):
+    """Selección del borrado masivo por subárbol y permiso de la vista."""
+
+    def test_subarbol_sin_rutas_no_selecciona_otros_albumes(self):
+        from .deletion import select_ids
+        self.assertEqual(
+            sorted(select_ids(album=self.raiz, subalbumes=True)), [self.medios[0].pk, self.medios[1].pk]
+        )
+
+    def test_vista_exige_staff(self):
+        response = self.client.post(reverse('eliminar_archivos'), {'album_id': self.raiz.pk, 'subalbumes': '1'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(MediaFile.objects.count(), 3)
+
+
+class ImageKitStorageTest(StubImageKitMixin, TestCase):
+    """exists/size/open de ImageKitStorage contra el servidor de prueba."""
+
+    def setUp(self):
+        super().setUp()
+        self.data = bytes(range(256)) * 6000
+        file_id = self.stub.add_file('fotos/playa.jpg', self.data)
+        MediaFile.objects.bulk_create([MediaFile(archivo='fotos/playa.jpg', file_id=file_id, tipo='imagen')])
+        self.storage = MediaFile._meta.get_field('archivo').storage
+
+    def test_open_size_y_chunks(self):
+        with self.storage.open('fotos/playa.jpg') as remoto:
+            self.assertEqual(remoto.size, len(self.data))
+            self.assertEqual(len(remoto), len(self.data))
+            self.assertTrue(remoto.multiple_chunks(64 * 1024))
+            self.assertEqual(b''.join(remoto.chunks(64 * 1024)), self.data)
+            remoto.seek(1000)
+            self.assertEqual(remoto.read(10), self.data[1000:1010])
+            self.assertEqual(remoto.tell(), 1010)
+
+    def test_metadatos_cacheados(self):
+        self.assertTrue(self.storage.exists('fotos/playa.jpg'))
+        self.assertEqual(self.storage.size('fotos/playa.jpg'), len(self.data))
+        self.assertEqual(MediaFile.objects.get().archivo.size, len(self.data))
+        detalles = [c for c in self.stub.calls if c[1].endswith('/details')]
+        self.assertEqual(len(detalles), 1)
+        self.assertFalse(self.storage.exists('fotos/no-existe.jpg'))
+
+
+class SubidaStreamingTest(StubImageKitMixin, TestCase):
+    """Los videos se suben por streaming: la memoria no crece con el tamaño del archivo."""
+
+    def test_pico_de_memoria_constante(self):
+        import tempfile
+        import tracemalloc
+        from django.core.files import File
+        from .storage import ImageKitStorage
+        size = 32 * 1024 * 1024
+        with tempfile.TemporaryFile() as fh:
+            for _ in range(size // (1024 * 1024)):
+                fh.write(b'\x00' * (1024 * 1024))
+            fh.seek(0)
+            content = File(fh, name='clip.mp4')
+
+            # Pico de memoria de Python (tracemalloc): el RSS del proceso no se puede reiniciar por test
+            tracemalloc.start()
+            try:
+                name = ImageKitStorage().save('clip.mp4', content)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertEqual(name, 'clip.mp4')
+        self.assertGreater(self.stub.uploaded_bytes, size)
+        # Unos pocos trozos de UPLOAD_CHUNK_SIZE (1 MB), no los 32 MB del archivo
+        self.assertLess(peak, 8 * 1024 * 1024)
+
+
+class TamanoAlGuardarTest(StubImageKitMixin, TestCase):
+    """MediaFile.save toma el tamaño de la subida; ImageKit solo se consulta como último recurso."""
+
+    def test_subida_sin_consultas_a_la_api(self):
+        from django.core.files.base import ContentFile
+        media = MediaFile(nombre='clip.mp4')
+        media.archivo = ContentFile(b'v' * 1000, name='clip.mp4')
+        media.save()
+        self.assertEqual(media.tamano, 1000)
+        self.assertEqual([call for call in self.stub.calls if call[0] == 'GET'], [])
+
+    def test_archivo_por_nombre(self):
+        self.stub.add_file('remoto.jpg', b'r' * 300)
+        self.assertEqual(MediaFile.objects.create(archivo='remoto.jpg', nombre='remoto.jpg').tamano, 300)
+        # Si no existe en la nube, la fila se guarda igualmente con tamaño 0
+        self.assertEqual(MediaFile.objects.create(archivo='falta.jpg', nombre='falta.jpg').tamano, 0)
+
+
+class SyncEngineTest(StubImageKitMixin, TestCase):
+    """Sincronización contra el servidor de prueba."""
+
+    def setUp(self):
+        super().setUp()
+        ids = [self.stub.add_file(f'fotos/{i}.jpg', b'x') for i in range(5)]
+        MediaFile.objects.bulk_create(
+            [MediaFile(archivo=f'{i}.jpg', nombre=f'{i}.jpg', file_id=fid, tipo='imagen') for i, fid in enumerate(ids)]
+            + [MediaFile(archivo='borrado.jpg', nombre='borrado.jpg', file_id='borrado', tipo='imagen')]
+        )
+        self.ids = ids
+
+    def _sync(self, **kwargs):
+        from .sync import SyncEngine
+        return SyncEngine(page_size=2, concurrency=1, **kwargs).run()
+
+    def test_completa_no_borra_lo_editado_durante_el_listado(self):
+        # Al pedir la segunda página, se edita un asset ya listado: por updatedAt
+        # todo se desplazaría una posición y la ventana skip=2 se saltaría uno.
+        def editar(skip):
+            if skip == 2:
+                self.stub.on_list = None
+                self.stub.touch(self.ids[0])
+        self.stub.on_list = editar
+
+        # Sin la comprobación previa al borrado: el listado por sí solo no debe perder nada
+        report = self._sync(full=True, file_exists=lambda file_id: False)
+
+        self.assertEqual(report['deleted'], 1)
+        self.assertEqual(sorted(MediaFile.objects.values_list('file_id', flat=True)), sorted(self.ids))
+
+    def test_ausente_del_listado_pero_en_la_nube_no_se_borra(self):
+        self._sync(full=True, file_exists=lambda file_id: file_id == 'borrado')
+        self.assertTrue(MediaFile.objects.filter(file_id='borrado').exists())
+
+    def test_latido_durante_la_confirmacion(self):
+        from unittest import mock
+        comprobados, latidos = [], []
+
+        def existe(file_id):
+            comprobados.append(file_id)
+            return False
+
+        def on_progress(engine):
+            latidos.append((len(comprobados), MediaFile.objects.filter(file_id='borrado').exists()))
+
+        with mock.patch('Gallery.sync.CHECK_NOTIFY_SECONDS', 0):
+            self._sync(full=True, file_exists=existe, on_progress=on_progress)
+        # Latido con la comprobación hecha y antes de borrar
+        self.assertIn((1, True), latidos)
+        self.assertEqual(latidos[-1], (1, False))
+
+    def test_incremental_tras_la_completa(self):
+        self._sync(full=True)
+        nuevo = self.stub.add_file('fotos/nuevo.jpg', b'y')
+        report = self._sync()
+        self.assertFalse(report['full'])
+        self.assertEqual(report['created'], 1)
+        self.assertTrue(MediaFile.objects.filter(file_id=nuevo).exists())
+
+
+class SyncJobReanudacionTest(StubImageKitMixin, TestCase):
+    """Un job de sincronización completa interrumpido sigue desde el offset de su último latido."""
+
+    def setUp(self):
+        super().setUp()
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import SyncJob
+        ids = [self.stub.add_file(f'fotos/{i}.jpg', b'x') for i in range(205)]
+        # La primera página (100 archivos) ya se guardó antes del corte
+        MediaFile.objects.bulk_create(
+            [MediaFile(archivo=f'{i}.jpg', nombre=f'{i}.jpg', file_id=fid, tipo='imagen') for i, fid in enumerate(ids[:100])]
+            + [MediaFile(archivo='borrado.jpg', nombre='borrado.jpg', file_id='borrado', tipo='imagen')]
+        )
+        self.job = SyncJob.objects.create(completo=True, paginas=1, filas=100, creados=100, siguiente_skip=100)
+        SyncJob.objects.filter(pk=self.job.pk).update(actualizado_en=timezone.now() - timedelta(hours=1))
+
+    def test_retoma_desde_el_offset_guardado(self):
+        from .jobs import claim_sync_job, run_sync_job
+        from .models import SyncState
+        skips = []
+        self.stub.on_list = skips.append
+
+        job, debe_ejecutarse = claim_sync_job()
+        self.assertEqual((job.pk, debe_ejecutarse), (self.job.pk, True))
+        job = run_sync_job(job)
+
+        self.assertEqual(min(skips), 100)
+        self.assertEqual((job.paginas, job.filas, job.creados), (3, 205, 205))
+        self.assertEqual(MediaFile.objects.exclude(file_id='borrado').count(), 205)
+        # Sin las primeras páginas no hay limpieza inversa: queda para la siguiente completa
+        self.assertTrue(MediaFile.objects.filter(file_id='borrado').exists())
+        self.assertIsNone(SyncState.objects.get(clave='imagekit').ultima_completa)
+
+    def test_no_escribe_tras_ser_retomado_por_otro_worker(self):
+        from .jobs import claim_sync_job, run_sync_job
+        from .models import SyncJob
+        job, _ = claim_sync_job()
+        # Otro worker lo dio por interrumpido y lo retomó mientras este seguía
+        SyncJob.objects.filter(pk=job.pk).update(reanudaciones=job.reanudaciones + 1)
+
+        run_sync_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.estado, SyncJob.EJECUTANDO)
+        self.assertEqual((job.paginas, job.filas), (1, 100))
+
+
+class PaginacionKeysetTest(TestCase):
+    """La página 50 de la línea de tiempo cuesta lo mismo que la primera (sin OFFSET ni COUNT)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        MediaFile.objects.bulk_create(
+            [MediaFile(archivo=f'fotos/{i}.jpg', nombre=f'{i}.jpg', tipo='imagen') for i in range(3000)],
+            batch_size=500,
+        )
+
+    def test_latencia_plana_con_la_profundidad(self):
+        from .pagination import paginate_keyset
+        tiempos, consultas, vistos = [], [], 0
+        cursor = None
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                page = paginate_keyset(MediaFile.objects.all(), after=cursor)
+                tiempos.append(time.perf_counter() - started)
+            consultas.append([q['sql'].upper() for q in ctx.captured_queries])
+            vistos += len(page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+
+        self.assertEqual(vistos, 3000)
+        self.assertEqual(len(tiempos), 50)
+        for sqls in consultas:
+            self.assertEqual(len(sqls), 1)
+            self.assertNotIn('OFFSET', sqls[0])
+            self.assertNotIn('COUNT(', sqls[0])
+
+        primeras = sorted(tiempos[:10])[5]
+        ultimas = sorted(tiempos[-10:])[5]
+        # Con OFFSET la última página recorrería las 2940 filas anteriores
+        self.assertLess(ultimas, 3 * primeras + 0.005)
+
+
+class FilasSinBackfillTest(TestCase):
+    """Filas anteriores a las columnas precalculadas: la cuadrícula y el JSON calculan las URLs al vuelo."""
+
+    def test_cuadricula_y_json(self):
+        from django.template.loader import render_to_string
+        from .views import media_item_json
+        (media,) = MediaFile.objects.bulk_create([MediaFile(archivo='fotos/antigua.jpg', tipo='imagen')])
+        self.assertEqual(media.url_miniatura, '')
+
+        html = render_to_string('partials/_media_item.html', {'media': media})
+        self.assertNotIn('src=""', html)
+        self.assertNotIn('srcset=""', html)
+        self.assertIn(media.miniatura_url, html)
+
+        datos = media_item_json(media)
+        self.assertTrue(datos['full_url'].endswith('/fotos/antigua.jpg'))
+        self.assertTrue(datos['thumb_url'])
+        self.assertTrue(datos['thumb_srcset'])
+
+
+class EnlacesAlbumSenalesTest(TestCase):
+    """Enlaces archivo-álbum guardados o borrados como filas (inline del admin)."""
+
+    def setUp(self):
+        from . import search
+        cache.clear()
+        search.clear_index()
+        search.mark_built()
+        self.album = Album.objects.create(nombre='vacaciones')
+        (self.media,) = MediaFile.objects.bulk_create([MediaFile(archivo='fotos/x.jpg', nombre='x.jpg', tipo='imagen')])
+
+    def test_reindexa_y_cambia_la_generacion(self):
+        from .generation import current_generation
+        from .search import search_ids
+        antes = current_generation()[0]
+
+        enlace = AlbumArchivo.objects.create(album=self.album, mediafile=self.media)
+        self.assertEqual(search_ids('vacaciones'), [self.media.pk])
+        despues_alta = current_generation()[0]
+        self.assertGreater(despues_alta, antes)
+
+        enlace.delete()
+        self.assertEqual(search_ids('vacaciones'), [])
+        self.assertGreater(current_generation()[0], despues_alta)
+
+
+class BuscadorTest(TestCase):
+    """Índice sin construir, coincidencias recortadas y borrado por búsqueda."""
+
+    def setUp(self):
+        from . import search
+        search.clear_index()
+        self.medios = MediaFile.objects.bulk_create([
+            MediaFile(archivo=f'fotos/playa{i}.jpg', nombre=f'playa{i}.jpg', tipo='imagen') for i in range(3)
+        ])
+
+    def test_indice_sin_construir_usa_like(self):
+        from .search import apply_search, index_media
+        # Tras actualizar, las señales solo han indexado lo nuevo
+        index_media(MediaFile.objects.filter(pk=self.medios[0].pk))
+        self.assertEqual(apply_search(MediaFile.objects.all(), 'playa')[0].count(), 3)
+
+    def test_recorte_se_indica_y_el_borrado_usa_todas(self):
+        from . import search
+        from .deletion import select_ids
+        search.index_media(MediaFile.objects.all())
+        search.mark_built()
+
+        queryset, recortado = search.apply_search(MediaFile.objects.all(), 'playa', limit=2)
+        self.assertEqual((queryset.count(), recortado), (2, True))
+        self.assertEqual(search.apply_search(MediaFile.objects.all(), 'playa', limit=3)[1], False)
+        self.assertEqual(sorted(select_ids(consulta='playa')), [m.pk for m in self.medios])
+
+
+class OptimizadorTest(TestCase):
+    """Subida que supera el presupuesto de espera del pool."""
+
+    def tearDown(self):
+        from .optimizer import _reset_pool
+        _reset_pool()
+
+    @override_settings(GALLERY_IMAGE_OPTIMIZER='pool', GALLERY_OPTIMIZE_WORKERS=1,
+                       GALLERY_OPTIMIZE_BUDGETS={'JPEG': {'seconds': 0}})
+    def test_timeout_solo_lee_la_cabecera(self):
+        import io
+        from PIL import Image
+        from .optimizer import optimize_upload
+        buffer = io.BytesIO()
+        Image.effect_noise((1600, 1200), 64).convert('RGB').save(buffer, format='JPEG', quality=95)
+        data = buffer.getvalue()
+
+        contenido, info = optimize_upload('ruido.jpg', data)
+        self.assertIs(contenido, data)
+        self.assertIn('espera', info['skipped'])
+        self.assertEqual((info['width'], info['height'], info['mime']), (1600, 1200, 'image/jpeg'))
+        # Sin decodificar en la petición: el LQIP lo rellena backfill_lqip
+        self.assertNotIn('lqip', info)
+
+
+class ImportarDuplicadosTest(TransactionTestCase):
+    """import_media con archivos repetidos: varias filas comparten file_id y nombre guardado."""
+    # Las subidas consultan la BD desde los hilos del pool
+
+    def setUp(self):
+        import hashlib
+        import tempfile
+        from pathlib import Path
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        data = b'contenido repetido'
+        self.original = MediaFile.objects.bulk_create([MediaFile(
+            archivo='orig.jpg', nombre='orig.jpg', tipo='imagen', file_id='f-orig',
+            hash_contenido=hashlib.blake2b(data, digest_size=32).hexdigest(),
+        )])[0]
+        for carpeta in ('a', 'b'):
+            (self.root / carpeta).mkdir()
+            (self.root / carpeta / f'{carpeta}.jpg').write_bytes(data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _importar(self):
+        import io
+        from django.core.management import call_command
+        call_command('import_media', str(self.root), albumes=True, workers=1, stdout=io.StringIO())
+
+    def test_cada_ruta_se_enlaza_a_su_fila(self):
+        self._importar()
+        filas = MediaFile.objects.exclude(pk=self.original.pk)
+        self.assertEqual(sorted(filas.values_list('nombre', 'albumes__nombre')), [('a.jpg', 'a'), ('b.jpg', 'b')])
+
+    def test_manifiesto_recupera_duplicados_no_guardados(self):
+        from .management.commands.import_media import MANIFEST_NAME
+        with open(self.root / MANIFEST_NAME, 'w', encoding='utf-8') as manifest:
+            for ruta in ('a/a.jpg', 'b/b.jpg'):
+                manifest.write(json.dumps({
+                    'path': ruta, 'name': 'orig.jpg', 'file_id': 'f-orig', 'duplicado_de': self.original.pk,
+                    'tamano': 18, 'tamano_original': 0,
+                }) + '\n')
+        self._importar()
+        self.assertEqual(MediaFile.objects.filter(file_id='f-orig').count(), 3)
+        self._importar()
+        self.assertEqual(MediaFile.objects.filter(file_id='f-orig').count(), 3)
+
+
+class ImportarCopiasEnLaMismaEjecucionTest(StubImageKitMixin, TransactionTestCase):
+    """Copias idénticas dentro de una misma importación: una sola subida, bytes contados una vez."""
+
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        from pathlib import Path
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        for i in range(3):
+            (self.root / f'clip{i}.mp4').write_bytes(b'v' * 5000)
+
+    def test_una_subida_por_contenido(self):
+        import io
+        from django.core.management import call_command
+        from .models import StorageStats
+        salida = io.StringIO()
+        call_command('import_media', str(self.root), workers=3, stdout=salida)
+
+        self.assertEqual(self.stub.calls.count(('POST', '/upload')), 1)
+        self.assertEqual(MediaFile.objects.values('file_id').distinct().count(), 1)
+        self.assertEqual(MediaFile.objects.count(), 3)
+        stats = StorageStats.objects.get(clave='global')
+        self.assertEqual((stats.archivos, stats.bytes_total), (3, 5000))
+        self.assertIn('3 subidos', salida.getvalue())
+
+
+class ContadoresDuplicadosTest(TestCase):
+    """StorageStats cuenta una vez los bytes de un asset compartido por varias filas."""
+
+    def setUp(self):
+        from .stats import rebuild_storage_stats
+        rebuild_storage_stats()
+        self.filas = [
+            MediaFile.objects.create(archivo='orig.jpg', nombre=nombre, tipo='imagen', tamano=100, file_id='f-1')
+            for nombre in ('orig.jpg', 'copia.jpg')
+        ]
+
+    def _contadores(self):
+        from .models import StorageStats
+        stats = StorageStats.objects.get(clave='global')
+        return stats.archivos, stats.bytes_total
+
+    def test_alta_y_reconstruccion(self):
+        from .stats import rebuild_storage_stats
+        self.assertEqual(self._contadores(), (2, 100))
+        rebuild_storage_stats()
+        self.assertEqual(self._contadores(), (2, 100))
+
+    def test_borrado_por_filas(self):
+        self.filas[1].delete()
+        self.assertEqual(self._contadores(), (1, 100))
+        self.filas[0].delete()
+        self.assertEqual(self._contadores(), (0, 0))
+
+    def test_borrado_conjunto(self):
+        MediaFile.objects.filter(file_id='f-1').delete()
+        self.assertEqual(self._contadores(), (0, 0))
+
+    def test_borrado_masivo_de_una_copia(self):
+        from .deletion import delete_media
+        delete_media([self.filas[1].pk])
+        self.assertEqual(self._contadores(), (1, 100))
+
+
+class GeneracionSinContadoresTest(TestCase):
+    """bump_generation sin fila de StorageStats no deja los contadores a cero."""
+
+    def test_crea_la_fila_con_los_contadores_reales(self):
+        from .generation import bump_generation
+        from .models import StorageStats
+        from .stats import get_storage_stats
+        cache.clear()
+        MediaFile.objects.bulk_create([MediaFile(archivo='fotos/a.jpg', tipo='imagen', tamano=100)])
+        StorageStats.objects.all().delete()
+
+        bump_generation()
+
+        fila = StorageStats.objects.get(clave='global')
+        self.assertEqual((fila.archivos, fila.bytes_total), (1, 100))
+        self.assertGreater(fila.generacion, StorageStats._meta.get_field('generacion').default)
+        self.assertEqual(get_storage_stats()['total_bytes'], 100)
@@ -0,0 +1,159 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django.utils.formats import date_format
+from django.utils.text import capfirst
+
+from .models import MediaFile
+from .pagination import encode_cursor, paginate_keyset
+
+# Elementos que se precargan por mes (primer "pantallazo" de cada grupo)
+MONTH_PREVIEW = 24
+
+GENERATION_KEY = 'gallery:timeline:gen'
+
+
+def _cache_timeout():
+    return getattr(settings, 'GALLERY_TIMELINE_CACHE_TIMEOUT', 300)
+
+
+def _generation():
+    return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def _key(*parts):
+    return ':'.join(['gallery:timeline', f'v{_generation()}', *parts])
+
+
+def month_key(value):
+    """'YYYY-MM' de un datetime (en la zona horaria actual)."""
+    return timezone.localtime(value).strftime('%Y-%m')
+
+
+def month_label(value):
+    return capfirst(date_format(value, 'F Y'))
+
+
+def month_bounds(key):
+    """(inicio, fin) conscientes de zona horaria para 'YYYY-MM', o None si no es válido."""
+    try:
+        start = datetime.strptime(key, '%Y-%m')
+    except (TypeError, ValueError):
+        return None
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    tz = timezone.get_current_timezone()
+    return timezone.make_aware(start, tz), timezone.make_aware(end, tz)
+
+
+def _month_buckets(queryset):
+    rows = (
+        queryset.order_by()
+        .annotate(mes=TruncMonth('creado_en'))
+        .values('mes')
+        .annotate(n=Count('id'))
+        .order_by('-mes')
+    )
+    return [
+        {'key': month_key(row['mes']), 'label': month_label(timezone.localtime(row['mes'])), 'count': row['n']}
+        for row in rows if row['mes'] is not None
+    ]
+
+
+def month_buckets(queryset=None):
+    """
+    Meses de la línea de tiempo con su número de elementos, del más reciente al más antiguo.
+    Una sola consulta GROUP BY en la BD; sin filtro de búsqueda el resultado se cachea.
+    """
+    if queryset is not None:
+        return _month_buckets(queryset)
+    key = _key('months')
+    buckets = cache.get(key)
+    if buckets is None:
+        buckets = _month_buckets(MediaFile.objects.all())
+        cache.set(key, buckets, _cache_timeout())
+    return buckets
+
+
+def group_by_month(items, counts=None):
+    """
+    Agrupa una página ya ordenada en bloques por mes, con el total real del mes
+    (de month_buckets) para que la cabecera no dependa de dónde corta la página.
+    """
+    counts = counts or {}
+    groups = []
+    for media in items:
+        key = month_key(media.creado_en)
+        if not groups or groups[-1]['key'] != key:
+            groups.append({
+                'key': key,
+                'label': month_label(timezone.localtime(media.creado_en)),
+                'count': counts.get(key),
+                'items': [],
+            })
+        groups[-1]['items'].append(media)
+    return groups
+
+
+def month_page(key, queryset=None, per_page=MONTH_PREVIEW):
+    """
+    Primeros `per_page` elementos de un mes y el cursor para continuar con la paginación
+    por cursor de siempre (timeline_api). Sin filtro de búsqueda se cachea por mes.
+    Devuelve None si la clave no es válida.
+    """
+    bounds = month_bounds(key)
+    if bounds is None:
+        return None
+
+    cache_key = _key('month', key) if queryset is None else None
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    start, end = bounds
+    source = MediaFile.objects.all() if queryset is None else queryset
+    page = paginate_keyset(
+        source.filter(creado_en__gte=start, creado_en__lt=end),
+        per_page=per_page,
+    )
+    data = {
+        'key': key,
+        'label': month_label(start),
+        'items': list(page),
+        # Si el mes no cabe en la página se sigue dentro de él; si no, por el borde del mes
+        'next_cursor': page.next_cursor or _edge_cursor(start),
+    }
+    if cache_key:
+        cache.set(cache_key, data, _cache_timeout())
+    return data
+
+
+def _edge_cursor(moment):
+    """Cursor sintético (moment, id 0): todo lo anterior a `moment` en el orden de la línea de tiempo."""
+    return encode_cursor(SimpleNamespace(creado_en=moment, id=0))
+
+
+def start_cursor(key):
+    """Cursor que empieza la línea de tiempo en el mes 'YYYY-MM' (incluido)."""
+    bounds = month_bounds(key)
+    return _edge_cursor(bounds[1]) if bounds else None
+
+
+def invalidate_month(value):
+    """Un alta/baja/cambio de fecha solo afecta a la lista de meses y al mes del elemento."""
+    if value is None:
+        return
+    cache.delete_many([_key('months'), _key('month', month_key(value))])
+
+
+def invalidate_timeline():
+    """Invalidación total (operaciones masivas): se cambia de generación de claves."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, None)
@@ -1,60 +1,41 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.db.models import Count, Sum, Q
+from django.db.models import Count
 from django.contrib import messages
 from django.views.decorators.http import require_POST
 from django.http import JsonResponse
 from django.conf import settings
-from .models import Album, MediaFile
-from datetime import datetime
-from requests.auth import HTTPBasicAuth
-import requests
+from django.urls import reverse
+from .albums import album_page, con_totales_recursivos
+from .deletion import delete_media, select_ids
+from .health import CAIDO, DEGRADADO, OK, get_health
+from .models import Album, AlbumArchivo, MediaFile, SyncJob
+from .jobs import enqueue_sync
+from .stats import get_storage_stats
+from .search import MAX_MATCHES, apply_search, search_ids
+from .ik_api import safe_delete_file
 from django.core.paginator import Paginator
-
-# --- HELPERS ROBUSTOS (API DIRECTA) ---
-def safe_list_files(options):
-    """
-    Lista archivos conectando directamente a la API de ImageKit.
-    Documentación: https://imagekit.io/docs/api-reference
-    """
-    url = "https://api.imagekit.io/v1/files"
-    
-    # ImageKit usa Basic Auth: Usuario=PrivateKey, Password=""
-    auth = HTTPBasicAuth(settings.IMAGEKIT_PRIVATE_KEY, '')
-    
-    try:
-        response = requests.get(url, params=options, auth=auth, timeout=10)
-        response.raise_for_status() # Lanza error si hay 400/500
-        return response.json()      # Devuelve la lista de archivos
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Error de conexión con ImageKit: {e}")
-
-def safe_delete_file(file_id):
-    """
-    Borra un archivo usando la API directa.
-    """
-    url = f"https://api.imagekit.io/v1/files/{file_id}"
-    auth = HTTPBasicAuth(settings.IMAGEKIT_PRIVATE_KEY, '')
-    
-    try:
-        response = requests.delete(url, auth=auth, timeout=10)
-        response.raise_for_status()
-        return True
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Error borrando en ImageKit: {e}")
-
+from django.utils import timezone
+from django.utils.formats import date_format
+from django.utils.text import capfirst
+from .pagination import PAGE_SIZE, neighbours, paginate_keyset
+from .generation import cached_json_view, library_conditional
+from .presets import sign_srcset, sign_url
+from .timeline import group_by_month, month_buckets, month_key, month_page, start_cursor
+
+# Vecinos extra cuyas miniaturas/HD se precargan en el visor
+VIEWER_PREFETCH = 3
+
+@library_conditional
 def index(request):
     """
     Vista principal.
     Calcula el almacenamiento usando la base de datos local.
     """
-    media_files = MediaFile.objects.all().order_by('-creado_en')
-
-    # Cálculo detallado
-    total_bytes = MediaFile.objects.aggregate(Sum('tamano'))['tamano__sum'] or 0
-    
-    # Calcular bytes por tipo
-    image_bytes = MediaFile.objects.filter(tipo__in=['imagen', 'gif']).aggregate(Sum('tamano'))['tamano__sum'] or 0
-    video_bytes = MediaFile.objects.filter(tipo='video').aggregate(Sum('tamano'))['tamano__sum'] or 0
+    # Contadores desnormalizados (StorageStats + caché): O(1) consultas
+    stats = get_storage_stats()
+    total_bytes = stats['total_bytes']
+    image_bytes = stats['image_bytes']
+    video_bytes = stats['video_bytes']
 
     limit_gb = 20 # Límite gratuito
     limit_bytes = limit_gb * (1024**3)
@@ -85,47 +66,29 @@ def index(request):
         # Agregamos los porcentajes individuales al contexto
         'percent_image': percent_image,
         'percent_video': percent_video,
-        'file_count': media_files.count()
+        'file_count': stats['file_count']
     }
 
-    # 1. Consulta base ordenado por fecha
-    media_files = MediaFile.objects.all().order_by('-creado_en')
-    
-    # 2. Capturar el término de búsqueda
+    # 1. Consulta base ordenado por fecha + 2. término de búsqueda
     query = request.GET.get('q')
-    
     if query:
         query = query.strip()
-        search_filter = Q(nombre__icontains=query) # Por defecto busca por nombre
-        
-        # --- LÓGICA DE DETECCIÓN DE FECHA ---
-        date_obj = None
-        
-        # Intentar formato DD/MM/YYYY (ej: 25/12/2023)
-        if '/' in query:
-            try:
-                date_obj = datetime.strptime(query, '%d/%m/%Y')
-            except ValueError:
-                pass
-        
-        # Intentar formato YYYY-MM-DD (ej: 2023-12-25)
-        elif '-' in query:
-            try:
-                date_obj = datetime.strptime(query, '%Y-%m-%d')
-            except ValueError:
-                pass
-                
-        # Si se detectó una fecha válida, agregarla al filtro (OR)
-        if date_obj:
-            # Filtramos por el día exacto ignorando la hora
-            search_filter |= Q(creado_en__date=date_obj.date())
-
-        # Aplicar filtros
-        media_files = media_files.filter(search_filter)
-
-    paginator = Paginator(media_files, 60)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    # search_truncated: más coincidencias que MAX_MATCHES, se avisa en la página
+    media_files, search_truncated = _timeline_queryset(query)
+
+    # 3. Paginación por cursor (keyset): sin OFFSET ni COUNT(*).
+    # ?page=N se mantiene para enlaces antiguos.
+    if request.GET.get('page') and not (request.GET.get('after') or request.GET.get('before')):
+        paginator = Paginator(media_files.order_by('-creado_en', '-id'), PAGE_SIZE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+    else:
+        # ?mes=YYYY-MM (barra de meses) empieza la línea de tiempo en ese mes
+        after = request.GET.get('after') or start_cursor(request.GET.get('mes'))
+        page_obj = paginate_keyset(media_files, after=after, before=request.GET.get('before'))
+
+    # 4. Meses con su total (GROUP BY en la BD, cacheado sin búsqueda): cabeceras y barra de meses
+    months = month_buckets(media_files if query else None)
+    month_counts = {month['key']: month['count'] for month in months}
 
     context = {
         'media_files': page_obj,
@@ -133,14 +96,100 @@ def index(request):
         'title': 'Galería',
         'active_tab': 'general',
         'query': query,
-        'storage': storage_data
+        'search_truncated': search_truncated,
+        'max_matches': MAX_MATCHES,
+        'storage': storage_data,
+        'months': months,
+        'timeline_groups': group_by_month(page_obj, month_counts),
+        'current_month': request.GET.get('mes', ''),
     }
     return render(request, 'index.html', context)
 
 
+def _timeline_queryset(query=None):
+    """
+    Línea de tiempo principal, opcionalmente filtrada por el buscador.
+    Devuelve (queryset, recortado). Con búsqueda la cuadrícula sigue en orden de fecha
+    (cursor por (creado_en, id) y grupos por mes): la relevancia decide qué coincidencias
+    entran si hay más de MAX_MATCHES y ordena las sugerencias de /api/buscar/.
+    """
+    media_files = MediaFile.objects.all()
+    if not query:
+        return media_files, False
+
+    # Índice FTS (nombre, álbumes, tipo) + rangos de fecha: "2023-12", "diciembre 2023", 25/12/2023...
+    return apply_search(media_files, query)
+
+
+def media_item_json(media):
+    """Representación de un elemento de la cuadrícula para el scroll infinito."""
+    return {
+        'id': media.id,
+        'full_url': sign_url(media.completa_url),
+        'thumb_url': sign_url(media.miniatura_url),
+        'thumb_srcset': sign_srcset(media.miniatura_srcset),
+        'lqip': media.thumbnail_base64 or '',
+        'color': media.color_dominante,
+        'is_video': media.tipo == 'video',
+        'is_gif': media.animado or media.tipo == 'gif',
+        'month': capfirst(date_format(timezone.localtime(media.creado_en), 'F Y')),
+        'month_key': month_key(media.creado_en),
+    }
+
+
+@cached_json_view
+def timeline_api(request):
+    """
+    Scroll infinito de la línea de tiempo (JSON).
+    ?after=<cursor> devuelve la página siguiente; next_cursor es null al llegar al final.
+    """
+    query = (request.GET.get('q') or '').strip() or None
+    page = paginate_keyset(_timeline_queryset(query)[0], after=request.GET.get('after'))
+    return JsonResponse({
+        'items': [media_item_json(media) for media in page],
+        'next_cursor': page.next_cursor,
+    })
+
+
+@cached_json_view
+def month_timeline_api(request, mes):
+    """
+    Primeros elementos de un mes (barra de meses) y cursor para seguir con timeline_api.
+    """
+    query = (request.GET.get('q') or '').strip() or None
+    data = month_page(mes, _timeline_queryset(query)[0] if query else None)
+    if data is None:
+        return JsonResponse({'error': 'Mes no válido (formato YYYY-MM).'}, status=400)
+    return JsonResponse({
+        'key': data['key'],
+        'label': data['label'],
+        'items': [media_item_json(media) for media in data['items']],
+        'next_cursor': data['next_cursor'],
+    })
+
+
+@cached_json_view
+def search_api(request):
+    """Typeahead del buscador: coincidencias por prefijo ordenadas por relevancia."""
+    query = (request.GET.get('q') or '').strip()
+    ids = search_ids(query, limit=20) if query else []
+    if not ids:
+        return JsonResponse({'items': []})
+    found = MediaFile.objects.in_bulk(ids)
+    return JsonResponse({
+        'items': [
+            {**media_item_json(found[pk]), 'nombre': found[pk].nombre}
+            for pk in ids if pk in found
+        ],
+    })
+
+
+@library_conditional
 def lista_albumes(request):
-    albumes = (
+    # Totales con todo el subárbol (ruta materializada) en la misma consulta
+    albumes = con_totales_recursivos(
         Album.objects.filter(album_padre__isnull=True)
+        .select_related('imagen_preview')
         .annotate(
             cantidad_archivos=Count('archivos', distinct=True),
             cantidad_subalbumes=Count('subalbumes_directos', distinct=True)
@@ -154,24 +203,50 @@ def lista_albumes(request):
     })
 
 
+@library_conditional
 def detalle_album(request, album_id):
-    album = get_object_or_404(
-        Album.objects.annotate(
-            cantidad_archivos=Count('archivos', distinct=True),
-            cantidad_subalbumes=Count('subalbumes_directos', distinct=True)
-        ),
-        id=album_id
-    )
-    archivos = album.archivos.all().order_by('-creado_en')
-    subalbumes = (
+    album = get_object_or_404(Album, id=album_id)
+    # Portadas en la misma consulta (select_related): número de consultas constante
+    subalbumes = list(
         album.subalbumes_directos
+        .select_related('imagen_preview')
         .annotate(cantidad_archivos=Count('archivos', distinct=True))
         .order_by('-creado_en')
     )
-    context = {'album': album, 'archivos': archivos, 'subalbumes': subalbumes}
+    cantidad_archivos = AlbumArchivo.objects.filter(album=album).count()
+
+    # Misma cuadrícula que la línea de tiempo: páginas por cursor sobre el índice
+    # (album, -creado_en) de la tabla intermedia, miniaturas LQIP y scroll infinito.
+    page_obj = album_page(album, after=request.GET.get('after'), before=request.GET.get('before'))
+
+    context = {
+        'album': album,
+        'subalbumes': subalbumes,
+        'cantidad_archivos': cantidad_archivos,
+        'migas': album.migas,
+        'totales': album.totales_recursivos() if subalbumes else None,
+        'media_files': page_obj,
+        'page_obj': page_obj,
+        'timeline_groups': group_by_month(page_obj),
+        'timeline_api_url': reverse('album_timeline_api', args=[album.id]),
+        'title': album.nombre,
+        'active_tab': 'albumes',
+    }
     return render(request, 'detalle_album.html', context)
 
 
+@cached_json_view
+def album_timeline_api(request, album_id):
+    """Scroll infinito de la cuadrícula de un álbum (mismo formato que timeline_api)."""
+    album = get_object_or_404(Album, id=album_id)
+    page = album_page(album, after=request.GET.get('after'))
+    return JsonResponse({
+        'items': [media_item_json(media) for media in page],
+        'next_cursor': page.next_cursor,
+    })
+
+
+@library_conditional
 def ver_video(request, archivo_id):
     archivo = get_object_or_404(MediaFile, id=archivo_id)
     if not archivo.is_video():
@@ -182,140 +257,53 @@ def ver_video(request, archivo_id):
     return render(request, 'ver_video.html', {'archivo': archivo})
 
 
+@library_conditional
 def ver_archivo(request, album_id, archivo_id):
     album = get_object_or_404(Album, id=album_id)
-    archivos = list(album.archivos.all().order_by('creado_en'))
     archivo = get_object_or_404(MediaFile, id=archivo_id)
-    
-    prev_id, next_id = None, None
-    try:
-        index = archivos.index(archivo)
-        if index > 0: prev_id = archivos[index - 1].id
-        if index < len(archivos) - 1: next_id = archivos[index + 1].id
-    except ValueError: pass 
 
-    context = {'album': album, 'archivo': archivo, 'prev_id': prev_id, 'next_id': next_id}
+    # Vecinos dentro del álbum (orden ascendente por fecha) con búsquedas indexadas
+    newer, older = neighbours(album.archivos.all(), archivo, prefetch=VIEWER_PREFETCH)
+    prev_id = older[0].id if older else None
+    next_id = newer[0].id if newer else None
+
+    context = {
+        'album': album, 'archivo': archivo, 'prev_id': prev_id, 'next_id': next_id,
+        'preload': newer + older[:1],
+    }
     return render(request, 'ver_archivo.html', context)
 
 
 def sincronizar_galeria(request):
     """
-    Sincronización Bidireccional:
-    1. Descarga/Actualiza archivos desde ImageKit hacia local.
-    2. Elimina archivos locales si ya no existen en ImageKit (fueron borrados manualmente en la nube).
+    Sincronización Bidireccional (incremental), en segundo plano:
+    la vista solo encola el job y responde de inmediato con su id.
+    El progreso se consulta en `progreso_sincronizacion`.
+    ?completo=1 fuerza el listado completo con limpieza inversa.
     """
     if not request.user.is_staff:
         return redirect('index')
 
-    try:
-        # --- PASO 1: OBTENER LISTA COMPLETA DE LA NUBE (CON PAGINACIÓN) ---
-        all_cloud_files = []
-        skip = 0
-        limit = 100
-        
-        while True:
-            options = {"limit": limit, "skip": skip}
-            batch = safe_list_files(options)
-            
-            if not batch:
-                break
-                
-            all_cloud_files.extend(batch)
-            skip += limit
-            
-            # Si el lote es menor al límite, ya no hay más archivos
-            if len(batch) < limit:
-                break
-
-        # Crear un conjunto (Set) de IDs de la nube para búsqueda rápida
-        cloud_ids = {f['fileId'] for f in all_cloud_files if 'fileId' in f}
-
-        created_count = 0
-        updated_count = 0
-        deleted_local_count = 0
-        
-        # --- PASO 2: DESCARGAR Y ACTUALIZAR (Cloud -> Local) ---
-        for file_data in all_cloud_files:
-            file_id = file_data.get('fileId')
-            name = file_data.get('name')
-            size = file_data.get('size', 0)
-            file_type = file_data.get('fileType', 'image')
-            
-            if not file_id: continue
-
-            # A. ¿Ya tenemos este ID?
-            if MediaFile.objects.filter(file_id=file_id).exists():
-                continue 
-
-            # B. ¿Existe por nombre (subido manual)? Enlazamos.
-            existing_file = MediaFile.objects.filter(archivo=name).first() or \
-                            MediaFile.objects.filter(archivo__endswith=name).first()
-
-            if existing_file:
-                existing_file.file_id = file_id
-                existing_file.tamano = size
-                if file_type == 'image':
-                    existing_file.tipo = 'gif' if name.lower().endswith('.gif') else 'imagen'
-                else:
-                    existing_file.tipo = 'video'
-                existing_file.save()
-                updated_count += 1
-            else:
-                # C. Crear nuevo
-                mf = MediaFile(
-                    nombre=name,
-                    archivo=name, 
-                    file_id=file_id,
-                    tamano=size
-                )
-                if file_type == 'image':
-                    mf.tipo = 'gif' if name.lower().endswith('.gif') else 'imagen'
-                else:
-                    mf.tipo = 'video'
-                mf.save()
-                created_count += 1
-
-        # --- PASO 3: LIMPIEZA INVERSA OPTIMIZADA ---
-        # Obtenemos los archivos locales que tienen ID pero NO están en la lista descargada
-        local_files_linked = MediaFile.objects.exclude(file_id__isnull=True).exclude(file_id='')
-        
-        # 1. Recolectamos solo los IDs de base de datos a eliminar
-        ids_a_eliminar = [
-            lfile.id for lfile in local_files_linked 
-            if lfile.file_id not in cloud_ids
-        ]
-        
-        deleted_local_count = len(ids_a_eliminar)
-
-        if deleted_local_count > 0:
-            # TRUCO DE OPTIMIZACIÓN:
-            # Primero, desvinculamos el archivo de la BD para "engañar" a cualquier señal de limpieza.
-            # Esto evita que Django intente conectar con ImageKit para borrar el archivo.
-            archivos_a_borrar = MediaFile.objects.filter(id__in=ids_a_eliminar)
-            archivos_a_borrar.update(archivo=None, file_id=None)
-            
-            # Ahora sí, borramos masivamente los registros (1 sola consulta SQL, 0 Requests a API)
-            archivos_a_borrar.delete()
-        
-        # Mensajes de feedback
-        parts = []
-        if created_count: parts.append(f"{created_count} nuevos")
-        if updated_count: parts.append(f"{updated_count} enlazados")
-        if deleted_local_count: parts.append(f"{deleted_local_count} eliminados localmente")
-
-        if parts:
-            msg = "Sincronización: " + ", ".join(parts) + "."
-            messages.success(request, msg)
-        else:
-            messages.info(request, "La galería está perfectamente sincronizada.")
+    job = enqueue_sync(full=request.GET.get('completo') == '1')
+    progreso_url = reverse('progreso_sincronizacion', args=[job.pk])
 
-    except Exception as e:
-        messages.error(request, f"Error de sincronización: {str(e)}")
-        print(f"Error Sync: {e}")
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest' or \
+            'application/json' in request.headers.get('accept', ''):
+        return JsonResponse({'job_id': job.pk, 'estado': job.estado, 'progreso_url': progreso_url}, status=202)
 
+    messages.info(request, f"Sincronización #{job.pk} en curso. Progreso: {progreso_url}")
     return redirect('index')
 
 
+def progreso_sincronizacion(request, job_id):
+    """Progreso de un job de sincronización en JSON (páginas, contadores, ETA)."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'No autorizado'}, status=403)
+
+    job = get_object_or_404(SyncJob, id=job_id)
+    return JsonResponse(job.as_dict())
+
+
 @require_POST
 def eliminar_archivo(request):
     """
@@ -333,7 +321,11 @@ def eliminar_archivo(request):
         archivo = MediaFile.objects.get(id=archivo_id)
         
         # 1. Intentamos borrar de la nube PRIMERO
-        if archivo.file_id:
+        # (salvo que otro registro deduplicado siga usando el mismo asset)
+        compartido = archivo.file_id and MediaFile.objects.filter(
+            file_id=archivo.file_id
+        ).exclude(id=archivo.id).exists()
+        if archivo.file_id and not compartido:
             try:
                 safe_delete_file(archivo.file_id)
             except Exception as e:
@@ -354,6 +346,45 @@ def eliminar_archivo(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@require_POST
+def eliminar_archivos(request):
+    """
+    Borrado por lotes. Selección (una de ellas): ids (lista o "1,2,3"), album_id
+    (+ subalbumes=1 para todo el subárbol) o q (resultado del buscador).
+    Devuelve el resultado de cada archivo; los que fallan en la nube no se borran.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'No autorizado'}, status=403)
+
+    try:
+        if request.POST.getlist('ids'):
+            raw = [part for value in request.POST.getlist('ids') for part in value.split(',') if part.strip()]
+            ids = select_ids(ids=raw)
+        elif request.POST.get('album_id'):
+            album = get_object_or_404(Album, id=int(request.POST['album_id']))
+            ids = select_ids(album=album, subalbumes=request.POST.get('subalbumes') == '1')
+        elif (request.POST.get('q') or '').strip():
+            ids = select_ids(consulta=request.POST['q'].strip())
+        else:
+            return JsonResponse({'error': 'Indica ids, album_id o q'}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'IDs no válidos'}, status=400)
+
+    limite = getattr(settings, 'GALLERY_BULK_DELETE_MAX', 5000)
+    if not ids:
+        return JsonResponse({'error': 'No hay archivos que coincidan'}, status=404)
+    if len(ids) > limite:
+        return JsonResponse({'error': f'Demasiados archivos ({len(ids)}); el máximo por petición es {limite}.'}, status=400)
+
+    resultados = delete_media(ids)
+    fallidos = sum(1 for r in resultados if not r['ok'])
+    return JsonResponse({
+        'success': fallidos == 0,
+        'eliminados': len(resultados) - fallidos,
+        'fallidos': fallidos,
+        'resultados': resultados,
+    }, status=200 if fallidos == 0 else 207)
+
 def ver_perfil(request):
     """
     Vista de perfil de usuario.
@@ -361,10 +392,11 @@ def ver_perfil(request):
     almacenamiento detallado con datos para anillo SVG,
     y credenciales de API.
     """
-    # 1. Almacenamiento
-    total_bytes = MediaFile.objects.aggregate(Sum('tamano'))['tamano__sum'] or 0
-    image_bytes = MediaFile.objects.filter(tipo__in=['imagen', 'gif']).aggregate(Sum('tamano'))['tamano__sum'] or 0
-    video_bytes = MediaFile.objects.filter(tipo='video').aggregate(Sum('tamano'))['tamano__sum'] or 0
+    # 1. Almacenamiento (contadores desnormalizados, sin agregar la tabla)
+    stats = get_storage_stats()
+    total_bytes = stats['total_bytes']
+    image_bytes = stats['image_bytes']
+    video_bytes = stats['video_bytes']
 
     limit_gb = 20
     limit_bytes = limit_gb * (1024**3)
@@ -388,8 +420,8 @@ def ver_perfil(request):
             n += 1
         return f"{size:.2f} {power_labels[n]}"
 
-    file_count = MediaFile.objects.count()
-    album_count = Album.objects.count()
+    file_count = stats['file_count']
+    album_count = stats['album_count']
 
     storage_data = {
         'used_str': format_bytes(total_bytes),
@@ -407,19 +439,9 @@ def ver_perfil(request):
         'video_dash': video_dash,
     }
 
-    # 2. Verificar conexión con ImageKit (ping rápido a la API)
-    ik_connected = False
-    try:
-        auth = HTTPBasicAuth(settings.IMAGEKIT_PRIVATE_KEY, '')
-        response = requests.get(
-            "https://api.imagekit.io/v1/files",
-            params={"limit": 1},
-            auth=auth,
-            timeout=5
-        )
-        ik_connected = response.status_code == 200
-    except Exception:
-        ik_connected = False
+    # 2. Estado de ImageKit: lo último que midió el sondeo en segundo plano (caché, sin red)
+    ik_health = get_health()
+    ik_connected = ik_health['status'] in (OK, DEGRADADO)
 
     # 3. API Keys (ocultamos parte de la privada)
     private_key = getattr(settings, 'IMAGEKIT_PRIVATE_KEY', '')
@@ -430,6 +452,7 @@ def ver_perfil(request):
         'active_tab': 'perfil',
         'storage': storage_data,
         'ik_connected': ik_connected,
+        'ik_health': ik_health,
         'api_conf': {
             'public_key': getattr(settings, 'IMAGEKIT_PUBLIC_KEY', 'No configurada'),
             'url_endpoint': getattr(settings, 'IMAGEKIT_URL_ENDPOINT', 'No configurada'),
@@ -439,6 +462,19 @@ def ver_perfil(request):
     }
     return render(request, 'perfil.html', context)
 
+def health(request):
+    """
+    Estado para el balanceador (JSON, sin tocar la red). La app responde 200 aunque
+    ImageKit esté caído; con ?estricto=1 devuelve 503 en ese caso.
+    """
+    ik = get_health()
+    status = 503 if request.GET.get('estricto') == '1' and ik['status'] == CAIDO else 200
+    response = JsonResponse({'status': 'ok' if status == 200 else 'error', 'imagekit': ik}, status=status)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@library_conditional
 def ver_detalle_global(request, archivo_id):
     """
     Vista dedicada para ver un archivo individual navegando por
@@ -448,32 +484,20 @@ def ver_detalle_global(request, archivo_id):
     archivo = get_object_or_404(MediaFile, id=archivo_id)
     
     # 2. Obtener IDs vecinos para navegación (Next/Prev)
-    # IMPORTANTE: Debe usar el mismo orden que el index (-creado_en)
-    qs = MediaFile.objects.all().order_by('-creado_en')
-    ids = list(qs.values_list('id', flat=True))
-    
-    prev_id = None
-    next_id = None
-    
-    try:
-        current_idx = ids.index(archivo.id)
-        # En orden descendente:
-        # Prev es el índice ANTERIOR (menos reciente en la lista, pero más nuevo en fecha)
-        if current_idx > 0:
-            prev_id = ids[current_idx - 1]
-        
-        # Next es el índice SIGUIENTE (más antiguo en fecha)
-        if current_idx < len(ids) - 1:
-            next_id = ids[current_idx + 1]
-            
-    except ValueError:
-        pass # El archivo no está en la lista (raro)
+    # IMPORTANTE: Debe usar el mismo orden que el index (-creado_en, -id).
+    # Dos búsquedas sobre el índice de la línea de tiempo en vez de cargar todos los IDs:
+    # Prev es el más nuevo en fecha, Next el más antiguo.
+    newer, older = neighbours(MediaFile.objects.all(), archivo, prefetch=VIEWER_PREFETCH)
+    prev_id = newer[0].id if newer else None
+    next_id = older[0].id if older else None
 
     # 3. Contexto similar al index
     context = {
         'archivo': archivo,
         'prev_id': prev_id,
         'next_id': next_id,
+        # Los siguientes en el sentido de avance (más el anterior) se precargan en el visor
+        'preload': older + newer[:1],
         'title': archivo.nombre or 'Detalle',
         # Pasamos API keys para scripts si fuera necesario
         'api_conf': {
@@ -9,12 +9,19 @@ urlpatterns = [
     path('albumes/', views.lista_albumes, name='lista_albumes'),
     path('album/<int:album_id>/', views.detalle_album, name='detalle_album'),
     path('all', views.index),
+    path('api/timeline/', views.timeline_api, name='timeline_api'),
+    path('api/timeline/mes/<str:mes>/', views.month_timeline_api, name='month_timeline_api'),
+    path('api/buscar/', views.search_api, name='search_api'),
+    path('api/album/<int:album_id>/timeline/', views.album_timeline_api, name='album_timeline_api'),
     path('ver-video/<int:archivo_id>/', views.ver_video, name='ver_video'),
     path('album/<int:album_id>/archivo/<int:archivo_id>/', views.ver_archivo, name='ver_archivo'),
     path('sincronizar/', views.sincronizar_galeria, name='sincronizar'),
+    path('sincronizar/<int:job_id>/progreso/', views.progreso_sincronizacion, name='progreso_sincronizacion'),
     path('eliminar/', views.eliminar_archivo, name='eliminar_archivo'),
+    path('eliminar/lote/', views.eliminar_archivos, name='eliminar_archivos'),
     path('sw.js', TemplateView.as_view(template_name='sw.js', content_type='application/javascript'), name='sw'),
     path('perfil/', views.ver_perfil, name='ver_perfil'),
+    path('health', views.health, name='health'),
     path('ver/<int:archivo_id>/', views.ver_detalle_global, name='ver_detalle_global'),
     path('logout/', views.index, name="logout"),
     